@@ -6,6 +6,10 @@ __version__  # silence codequality
 from .membership import RolesNode
 from . import permissions  # noqa: F401
 from .permissions import requires
+from .gate_index import accessible_views
+from .prefetch import prefetch_role_sets
 
 SetMembershipNode = RolesNode  # For backwards compatibility purposes.
 requires
+accessible_views
+prefetch_role_sets
@@ -1,10 +1,27 @@
+from django.conf import settings
 from django.contrib.admin import ModelAdmin
+from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ValidationError
 
+from baya.membership import RolesNode
 from baya.utils import has_permission
+from baya.utils import user_in_group
 from baya.permissions import ALLOW_ALL
 from baya.permissions import requires
 
 
+def _filter_object_queryset(object_roles, queryset, user):
+    if object_roles is None or getattr(settings, 'BAYA_ALLOW_ALL', False):
+        return queryset
+    return object_roles.filter_queryset(queryset, user)
+
+
+def _user_has_object_permission(object_roles, user, obj):
+    if object_roles is None or getattr(settings, 'BAYA_ALLOW_ALL', False):
+        return True
+    return user_in_group(user, RolesNode(*object_roles.roles_for_object(obj)))
+
+
 class BayaInlineMixin(object):
     """Mixin for using with Django admin.InlineModelAdmin.
 
@@ -16,12 +33,48 @@ class BayaInlineMixin(object):
     inlines I would have to reimplement the entire ModelAdmin.change_view.
 
     BayaInline classes take required groups for CREATE, UPDATE, and DELETE
-    operations. See BayaModelAdmin for documentation on those class-level
-    constants.
+    operations, and OBJECT_ROLES to only show some of the inline objects.
+    See BayaModelAdmin for documentation on those class-level constants.
+    Django passes the parent object to inline permission checks, so the
+    OBJECT_ROLES filter the inline queryset, and the inline formset doesn't
+    validate unless the user has the OBJECT_ROLES of every object it adds or
+    changes.
     """
     CREATE = ALLOW_ALL
     UPDATE = ALLOW_ALL
     DELETE = ALLOW_ALL
+    OBJECT_ROLES = None
+
+    def get_queryset(self, request):
+        return _filter_object_queryset(
+            self.OBJECT_ROLES,
+            super(BayaInlineMixin, self).get_queryset(request),
+            request.user)
+
+    def get_formset(self, request, obj=None, **kwargs):
+        formset = super(BayaInlineMixin, self).get_formset(
+            request, obj, **kwargs)
+        if self.OBJECT_ROLES is None:
+            return formset
+        object_roles = self.OBJECT_ROLES
+        user = request.user
+
+        class ObjectRolesFormSet(formset):
+            def clean(self):
+                super(ObjectRolesFormSet, self).clean()
+                for form in self.forms:
+                    if (form.errors or not form.has_changed() or
+                            (self.can_delete and
+                             self._should_delete_form(form))):
+                        continue
+                    # The form's instance has the submitted values by now.
+                    if not _user_has_object_permission(
+                            object_roles, user, form.instance):
+                        raise ValidationError(
+                            "You don't have permission to save %s." %
+                            form.instance)
+
+        return ObjectRolesFormSet
 
     def has_add_permission(self, request, obj=None):
         return has_permission(requires(self.CREATE), request.user, 'post')
@@ -54,11 +107,26 @@ class BayaModelAdmin(ModelAdmin):
         DELETE: Permissions necessary to gain the app.delete_model django
             permission. You must still have POST permissions to delete
             the object.
+
+    Object level permissions are set with the OBJECT_ROLES class attribute, a
+    baya.dynamic_roles.ModelFieldGroupFormatter for the admin's model:
+
+        class BlogPostOptions(BayaModelAdmin):
+            OBJECT_ROLES = ModelFieldGroupFormatter(
+                BlogPost, 'category__name', '%s_editor')
+
+    The changelist and the change and delete views are then limited to the
+    objects whose groups the user is in. This is done by filtering the
+    queryset in the database, so it's a single query however many objects
+    there are. Objects are checked again as they're saved, so users can't
+    add objects, or move them, outside of their groups. Users still need
+    the CRUD permissions above.
     """
     CREATE = ALLOW_ALL
     READ = ALLOW_ALL
     UPDATE = ALLOW_ALL
     DELETE = ALLOW_ALL
+    OBJECT_ROLES = None
 
     def __init__(self, *args, **kwargs):
         super(BayaModelAdmin, self).__init__(*args, **kwargs)
@@ -74,6 +142,23 @@ class BayaModelAdmin(ModelAdmin):
             self.change_view)
         self.delete_view = requires(self.DELETE)(self.delete_view)
 
+    def get_queryset(self, request):
+        return _filter_object_queryset(
+            self.OBJECT_ROLES,
+            super(BayaModelAdmin, self).get_queryset(request),
+            request.user)
+
+    def user_has_object_permission(self, user, obj):
+        """Check the OBJECT_ROLES for a single object."""
+        return _user_has_object_permission(self.OBJECT_ROLES, user, obj)
+
+    def save_model(self, request, obj, form, change):
+        # has_change_permission only saw the object before the form changed
+        # it, and nothing checks added objects.
+        if not self.user_has_object_permission(request.user, obj):
+            raise PermissionDenied
+        super(BayaModelAdmin, self).save_model(request, obj, form, change)
+
     def user_has_add_permission(self, user):
         return has_permission(self.add_view, user, 'post')
 
@@ -85,10 +170,14 @@ class BayaModelAdmin(ModelAdmin):
                 has_permission(self.change_view, user, 'any'))
 
     def has_change_permission(self, request, obj=None):
-        return self.user_has_change_permission(request.user)
+        return (self.user_has_change_permission(request.user) and
+                (obj is None or
+                 self.user_has_object_permission(request.user, obj)))
 
     def user_has_delete_permission(self, request):
         return has_permission(self.delete_view, request, 'post')
 
     def has_delete_permission(self, request, obj=None):
-        return self.user_has_delete_permission(request.user)
+        return (self.user_has_delete_permission(request.user) and
+                (obj is None or
+                 self.user_has_object_permission(request.user, obj)))
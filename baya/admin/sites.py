@@ -13,6 +13,7 @@ from django.contrib.admin.sites import AdminSite
 
 from baya.permissions import requires
 from baya.membership import ValueNode
+from functools import lru_cache
 from functools import reduce
 
 
@@ -28,10 +29,31 @@ def _get_regex(url):
         return url.pattern.regex
 
 
+@lru_cache(maxsize=None)
+def _compile_pattern(pattern):
+    """Compile an admin url pattern so it matches the keys from _get_regex.
+
+    The pattern is used as a key and must be formatted to match what is
+    already in urls, else it will be added as a new pattern. When the newly
+    constructed pattern doesn't match, both the old and new version of the
+    pattern will be in the urls. The old pattern will match requests because
+    it's earlier in the list.
+    """
+    if django.VERSION[0] == 1:
+        return pattern
+    # django >= 2.0 pattern must be compiled into regex
+    if sys.version_info[0] == 3 and sys.version_info[1] <= 6:
+        # python 3.0 through 3.6 must escape slashes in the regex
+        return re.compile(pattern.replace('/', '\/'))  # noqa: W605
+    return re.compile(pattern)
+
+
 class NestedGroupsAdminSite(AdminSite):
     def __init__(self, *args, **kwargs):
         super(NestedGroupsAdminSite, self).__init__(*args, **kwargs)
         _admin_registry.add(self)
+        self._urls_cache = None
+        self._gated_urls = {}
         all_groups = self._get_required_baya_groups()
         if all_groups is not None:
             self.index = requires(all_groups)(self.index)
@@ -47,6 +69,54 @@ class NestedGroupsAdminSite(AdminSite):
                 admins.append((model, model_admin))
         return admins
 
+    def _get_registry_version(self):
+        """Return a value which changes whenever get_urls() would change.
+
+        This covers every registered model admin (django's own admin urls
+        depend on all of them) and the gates of the gated ones, since gates
+        can still be &-ed together after registration.
+        """
+        version = []
+        for model, model_admin in self._registry.items():
+            gate = getattr(model_admin, '_gate', None)
+            if gate is None:
+                version.append((model, model_admin, None, None))
+            else:
+                version.append((model, model_admin,
+                                gate.get_requires, gate.post_requires))
+        return tuple(version)
+
+    def _get_gated_url(self, model, model_admin):
+        """Return (compiled_pattern, url) for a gated model admin.
+
+        The result is cached per model, and only rebuilt when the model admin
+        or its gate changes.
+        """
+        gate = model_admin._gate
+        key = (model_admin, gate.get_requires, gate.post_requires)
+        cached = self._gated_urls.get(model)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        if hasattr(model._meta, 'module_name'):
+            model_name = model._meta.module_name
+        elif hasattr(model._meta, 'model_name'):
+            model_name = model._meta.model_name
+        else:
+            raise ValueError(
+                "Model Admin is missing a module or model name.")
+        pattern = (
+            r'^%s/%s/' %
+            (model._meta.app_label, model_name))
+        gated_url = (
+            _compile_pattern(pattern),
+            url(pattern,
+                requires(get=gate.get_requires,
+                         post=gate.post_requires)(
+                             include(model_admin.urls))))
+        self._gated_urls[model] = (key, gated_url)
+        return gated_url
+
     def get_urls(self):
         """Ensure that urls included in get_urls() are behind requires().
 
@@ -57,44 +127,26 @@ class NestedGroupsAdminSite(AdminSite):
 
         Would be a lot easier if django exposed something like
         get_patterns_for_app(app_label), but noooooo.
+
+        The patched list is only rebuilt when the registry changes, and the
+        gated include for a model admin is only rebuilt when that model admin
+        changes. See _get_registry_version and _get_gated_url.
         """
+        version = self._get_registry_version()
+        if self._urls_cache is not None and self._urls_cache[0] == version:
+            return list(self._urls_cache[1])
+
         # We have to maintain the URL ordering due to the way URLs are resolved
         # TODO - Test this, can lead to heisenbugs
         urls = OrderedDict((_get_regex(urlp), urlp) for urlp in
                            super(NestedGroupsAdminSite, self).get_urls())
         for model, model_admin in self._get_admins_with_gate():
-            if hasattr(model._meta, 'module_name'):
-                model_name = model._meta.module_name
-            elif hasattr(model._meta, 'model_name'):
-                model_name = model._meta.model_name
-            else:
-                raise ValueError(
-                    "Model Admin is missing a module or model name.")
-            pattern = (
-                r'^%s/%s/' %
-                (model._meta.app_label, model_name))
-
-            # The pattern is used as a key and must be formatted to match what is already in urls
-            # else it will be added as a new pattern. When the newly constructed pattern doesn't
-            # match, both the old and new version of the pattern will be in the urls. The old
-            # pattern will match requests because it's earlier in the list.
-            if django.VERSION[0] == 1:
-                compiled_pattern = pattern
-            elif django.VERSION[0] >= 2:
-                # django >= 2.0 pattern must be compiled into regex
-                if sys.version_info[0] == 3 and sys.version_info[1] <= 6:
-                    # python 3.0 through 3.6 must escape slashes in the regex
-                    escaped_pattern = pattern.replace('/', '\/')  # noqa: W605
-                else:
-                    escaped_pattern = pattern
-                compiled_pattern = re.compile(escaped_pattern)
-
-            urls[compiled_pattern] = url(
-                pattern,
-                requires(get=model_admin._gate.get_requires,
-                         post=model_admin._gate.post_requires)(
-                             include(model_admin.urls)))
-        return list(urls.values())
+            compiled_pattern, gated_url = self._get_gated_url(
+                model, model_admin)
+            urls[compiled_pattern] = gated_url
+        urls = list(urls.values())
+        self._urls_cache = (version, urls)
+        return list(urls)
 
     def _get_required_baya_groups(self, app_label=None):
         # Loop over all model admins, checking their set of permissions
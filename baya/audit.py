@@ -0,0 +1,247 @@
+"""Offline permission audits: which users can reach which views.
+
+Checking every (user, view) pair with user_in_group is far too slow for
+thousands of users and views. Instead, a PermissionAudit encodes the users'
+group memberships as packed boolean columns, one bit per user, and evaluates
+each membership node once for every user at the same time using bitwise
+AND/OR/XOR/NOT over those columns.
+
+This requires numpy, which you can install with `pip install baya[audit]`.
+
+Usage:
+
+    from baya.audit import PermissionAudit
+    from baya.gate_index import get_gate_index
+
+    audit = PermissionAudit({'alice': {'group1'}, 'bob': {'group2'}})
+    result = audit.audit(get_gate_index().items(), 'get')
+    result.users_for('my_view')  # ['alice']
+
+Views protected by a DynamicRolesNode can't be evaluated without a request,
+so they are reported in `result.dynamic` rather than in the matrix.
+"""
+from collections import defaultdict
+
+from .membership import AndNode
+from .membership import DynamicRolesNode
+from .membership import OrNode
+from .membership import XorNode
+from .utils import get_permission_nodes
+from .visitors import NodeVisitor
+
+
+DYNAMIC = 'dynamic'
+
+
+class MembershipMatrix(object):
+    """Users' group memberships, stored as one packed bit column per group.
+
+    Args:
+        user_roles: A mapping of user -> iterable of role names, or an
+            iterable of (user, roles) pairs.
+    """
+
+    def __init__(self, user_roles):
+        import numpy
+        self._numpy = numpy
+
+        if hasattr(user_roles, 'items'):
+            user_roles = user_roles.items()
+        self.users = []
+        role_members = defaultdict(list)
+        for user_index, (user, roles) in enumerate(user_roles):
+            self.users.append(user)
+            for role in roles:
+                role_members[role.lower()].append(user_index)
+
+        self._columns = {}
+        for role, members in role_members.items():
+            column = numpy.zeros(len(self.users), dtype=bool)
+            column[members] = True
+            self._columns[role] = numpy.packbits(column)
+        self.zeros = numpy.packbits(numpy.zeros(len(self.users), dtype=bool))
+        self.ones = numpy.packbits(numpy.ones(len(self.users), dtype=bool))
+
+    def __len__(self):
+        return len(self.users)
+
+    def column(self, role):
+        """Return the packed column of users in a role."""
+        return self._columns.get(role.lower(), self.zeros)
+
+    def unpack(self, packed):
+        """Return a packed column as a boolean array with one entry per user.
+        """
+        return self._numpy.unpackbits(
+            packed, count=len(self.users)).astype(bool)
+
+
+class VectorizedPermissionChecker(NodeVisitor):
+    """
+    NodeVisitor concrete class that checks a node for every user at once.
+
+    This is the vectorized counterpart of visitors.PermissionChecker: visit
+    returns a packed column (see MembershipMatrix) with a bit set for every
+    user that the node allows. Visiting a node which contains a
+    DynamicRolesNode returns None, since those need a request.
+
+    Results are cached per node, so nodes shared between many gates are only
+    evaluated once.
+    """
+
+    def __init__(self, matrix):
+        import numpy
+        self._numpy = numpy
+        self._matrix = matrix
+        self._cache = {}
+
+    def visit(self, node, **kwargs):
+        if node not in self._cache:
+            self._cache[node] = super(VectorizedPermissionChecker, self).visit(
+                node, **kwargs)
+        return self._cache[node]
+
+    def _visit_value_node(self, value_node, **kwargs):
+        if value_node.value:
+            return self._matrix.ones
+        return self._matrix.zeros
+
+    def _visit_roles_node(self, roles_node, **kwargs):
+        if isinstance(roles_node, DynamicRolesNode):
+            return None
+        result = self._matrix.ones
+        for role in roles_node.get_roles_set():
+            result = self._numpy.bitwise_and(
+                result, self._matrix.column(role))
+        return result
+
+    def _visit_unary_node(self, operator_node, visited_operand):
+        if visited_operand.value is None:
+            return None
+        # InvertNode is the only unary operator. The padding bits past the
+        # last user get flipped too, but they're dropped when unpacking.
+        return self._numpy.invert(visited_operand.value)
+
+    def _visit_binary_node(self, operator_node, left_visited_operand,
+                           right_visited_operand):
+        left = left_visited_operand.value
+        right = right_visited_operand.value
+        if left is None or right is None:
+            return None
+        if isinstance(operator_node, AndNode):
+            return self._numpy.bitwise_and(left, right)
+        if isinstance(operator_node, OrNode):
+            return self._numpy.bitwise_or(left, right)
+        if isinstance(operator_node, XorNode):
+            return self._numpy.bitwise_xor(left, right)
+        raise TypeError('Cannot visit node %r' % operator_node)
+
+
+class AuditResult(object):
+    """The outcome of PermissionAudit.audit.
+
+    Attributes:
+        views: The audited view names, in matrix row order.
+        users: The audited users, in matrix column order.
+        packed: A (views x ceil(users / 8)) uint8 array of packed bits.
+        dynamic: The names of views protected by DynamicRolesNodes, which
+            are all-False in the matrix.
+    """
+
+    def __init__(self, views, users, packed, dynamic):
+        self.views = views
+        self.users = users
+        self.packed = packed
+        self.dynamic = dynamic
+        self._view_rows = {view: row for row, view in enumerate(views)}
+
+    def to_dense(self):
+        """Return the (views x users) boolean matrix."""
+        import numpy
+        return numpy.unpackbits(
+            self.packed, axis=1, count=len(self.users)).astype(bool)
+
+    def allowed(self, view, user_index):
+        """Return True if the user at `user_index` may access `view`.
+
+        Returns DYNAMIC for views protected by DynamicRolesNodes.
+        """
+        if view in self.dynamic:
+            return DYNAMIC
+        row = self.packed[self._view_rows[view]]
+        return bool(row[user_index // 8] >> (7 - user_index % 8) & 1)
+
+    def users_for(self, view):
+        """Return the users which may access `view`, or DYNAMIC."""
+        if view in self.dynamic:
+            return DYNAMIC
+        import numpy
+        row = numpy.unpackbits(
+            self.packed[self._view_rows[view]], count=len(self.users))
+        return [self.users[index] for index in numpy.flatnonzero(row)]
+
+
+class PermissionAudit(object):
+    """Evaluate many views for many users at once.
+
+    Args:
+        user_roles: A mapping of user -> iterable of role names, or an
+            iterable of (user, roles) pairs. See MembershipMatrix.
+    """
+
+    def __init__(self, user_roles):
+        import numpy
+        self._numpy = numpy
+        self.matrix = MembershipMatrix(user_roles)
+        self._checker = VectorizedPermissionChecker(self.matrix)
+
+    def check_node(self, node):
+        """Return the packed column of users the node allows, or None."""
+        return self._checker.visit(node)
+
+    def check_gates(self, gates, permission='get'):
+        """Return the packed column of users a chain of Gates allows.
+
+        This has the same semantics as baya.utils.check_gates: every gate
+        must allow access, and no gates at all means no access. Returns None
+        if any of the gates contain a DynamicRolesNode.
+        """
+        if not gates:
+            return self.matrix.zeros
+        result = self.matrix.ones
+        for gate in gates:
+            allowed = self.matrix.zeros
+            for node in get_permission_nodes(gate, permission):
+                column = self.check_node(node)
+                if column is None:
+                    return None
+                allowed = self._numpy.bitwise_or(allowed, column)
+            result = self._numpy.bitwise_and(result, allowed)
+        return result
+
+    def audit(self, views, permission='get'):
+        """Check every view for every user.
+
+        Args:
+            views: An iterable of (view name, tuple of Gates), such as
+                baya.gate_index.GateIndex.items()
+            permission: The permission to check for. One of 'get', 'post',
+                'any'
+        Returns an AuditResult.
+        """
+        names = []
+        rows = []
+        dynamic = set()
+        for name, gates in views:
+            column = self.check_gates(gates, permission)
+            if column is None:
+                dynamic.add(name)
+                column = self.matrix.zeros
+            names.append(name)
+            rows.append(column)
+        if rows:
+            packed = self._numpy.vstack(rows)
+        else:
+            packed = self._numpy.zeros(
+                (0, len(self.matrix.zeros)), dtype=self._numpy.uint8)
+        return AuditResult(names, list(self.matrix.users), packed, dynamic)
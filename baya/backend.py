@@ -1,26 +1,138 @@
+import asyncio
+import contextvars
+import hashlib
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from functools import partial
 import six
 
+import ldap
+
 from django.conf import settings
 from django.contrib.auth import get_permission_codename
+from django.core.signals import request_finished
+from django.db import connections
 from django_auth_ldap.backend import LDAPBackend
+from django_auth_ldap.backend import _LDAPUser
+
+logger = logging.getLogger('baya')
+
+DEFAULT_LDAP_MAX_WORKERS = 4
+
+_ldap_executor = None
+_ldap_executor_lock = threading.Lock()
+
+
+def get_ldap_executor():
+    """Return the thread pool which async LDAP calls run on.
+
+    It has at most BAYA_LDAP_MAX_WORKERS (default 4) threads, which bounds
+    the number of concurrent LDAP operations the async methods start.
+    """
+    global _ldap_executor
+    if _ldap_executor is None:
+        with _ldap_executor_lock:
+            if _ldap_executor is None:
+                _ldap_executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'BAYA_LDAP_MAX_WORKERS',
+                                        DEFAULT_LDAP_MAX_WORKERS),
+                    thread_name_prefix='baya-ldap')
+    return _ldap_executor
+
+
+def _call_and_close_connections(fn, args, kwargs):
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        # Don't leak a database connection per pool thread, or hold on to
+        # pooled LDAP connections.
+        connections.close_all()
+        release_connections()
+
+
+async def run_in_ldap_executor(fn, *args, **kwargs):
+    """Await fn(*args, **kwargs), run on the LDAP thread pool.
+
+    python-ldap only has blocking calls, so this keeps them off the event
+    loop. Unlike sync_to_async, which runs everything on the one thread sync
+    code shares, up to BAYA_LDAP_MAX_WORKERS calls run at once.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        get_ldap_executor(),
+        partial(context.run, _call_and_close_connections, fn, args, kwargs))
 
 
 class NestedLDAPGroupsBackend(LDAPBackend):
 
     use_reconnecting_client = getattr(
         settings, 'BAYA_USE_RECONNECTING_CLIENT', False)
+    ldap_pool_size = getattr(settings, 'BAYA_LDAP_POOL_SIZE', None)
+    ldap_circuit_breaker = getattr(
+        settings, 'BAYA_LDAP_CIRCUIT_BREAKER', False)
 
     def _get_ldap(self):
-        if self.use_reconnecting_client:
-            if self._ldap is None:
-                ldap_module = super(NestedLDAPGroupsBackend, self).ldap
-                self._ldap = ReconnectingLDAP(ldap_module)
-            return self._ldap
-        else:
-            return super(NestedLDAPGroupsBackend, self).ldap
+        if self._ldap is None:
+            ldap_module = super(NestedLDAPGroupsBackend, self).ldap
+            if self.use_reconnecting_client:
+                ldap_module = ReconnectingLDAP(
+                    ldap_module, pool_size=self.ldap_pool_size,
+                    bind_dn=self.settings.BIND_DN)
+            if self.ldap_circuit_breaker:
+                ldap_module = CircuitBreakerLDAP(ldap_module)
+            self._ldap = ldap_module
+        return self._ldap
     ldap = property(_get_ldap)
 
+    single_flight_group_lookups = getattr(
+        settings, 'BAYA_SINGLE_FLIGHT_GROUP_LOOKUPS', True)
+
+    def _get_settings(self):
+        ldap_settings = super(NestedLDAPGroupsBackend, self).settings
+        group_type = ldap_settings.GROUP_TYPE
+        if (self.single_flight_group_lookups and group_type is not None and
+                not isinstance(group_type, SingleFlightGroupType)):
+            ldap_settings.GROUP_TYPE = SingleFlightGroupType(group_type)
+        return ldap_settings
+    settings = property(_get_settings, LDAPBackend.settings.fset)
+
+    def get_group_dns(self, username):
+        """Return the DNs of every (nested) LDAP group a user is in.
+
+        Unlike populate_user, this doesn't create or update a django user, so
+        it's safe to use for reporting. Outages which django-auth-ldap
+        ignores are raised, see raise_ldap_outages.
+        """
+        ldap_user = _LDAPUser(
+            self, username=self.django_to_ldap_username(username))
+        try:
+            with raise_ldap_outages():
+                if ldap_user.dn is None:
+                    return set()
+                return ldap_user.group_dns
+        finally:
+            release_ldap_connection(ldap_user)
+
+    async def aauthenticate(self, request, username=None, password=None,
+                            **kwargs):
+        """Async version of authenticate, see run_in_ldap_executor.
+
+        django.contrib.auth.aauthenticate calls this under ASGI.
+        """
+        return await run_in_ldap_executor(
+            self.authenticate, request, username=username, password=password,
+            **kwargs)
+
+    async def aget_group_dns(self, username):
+        """Async version of get_group_dns, see run_in_ldap_executor."""
+        return await run_in_ldap_executor(self.get_group_dns, username)
+
     def get_all_permissions(self, user, obj=None):
         """Return a set of <app_label>.<permission> for this user.
 
@@ -50,6 +162,68 @@ class NestedLDAPGroupsBackend(LDAPBackend):
         return permissions
 
 
+class SingleFlight(object):
+    """Share one call between concurrent callers with the same key.
+
+    The first caller for a key runs the function. Callers which arrive while
+    it's running wait for it, and get its result (or exception), instead of
+    running the function again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+_group_lookups = SingleFlight()
+
+
+class SingleFlightGroupType(object):
+    """Wraps an AUTH_LDAP_GROUP_TYPE so concurrent lookups share a search.
+
+    When a client fires a burst of requests at once, each one loads the
+    user's groups. Concurrent user_groups calls for the same user DN (and
+    group search) in this process share a single LDAP lookup instead.
+    NestedLDAPGroupsBackend wraps the group type with this unless
+    BAYA_SINGLE_FLIGHT_GROUP_LOOKUPS is False.
+    """
+
+    def __init__(self, group_type):
+        self.group_type = group_type
+
+    def __getattr__(self, name):
+        return getattr(self.group_type, name)
+
+    def user_groups(self, ldap_user, group_search):
+        key = (type(self.group_type), (ldap_user.dn or '').lower(),
+               getattr(group_search, 'base_dn', None),
+               getattr(group_search, 'filterstr', None))
+        group_infos = _group_lookups.do(
+            key, self.group_type.user_groups, ldap_user, group_search)
+        # Don't share the list between users.
+        return list(group_infos)
+
+
 class ReconnectingLDAP(object):
     """
     An object that makes the standard ldap.initialize function use
@@ -67,8 +241,18 @@ class ReconnectingLDAP(object):
     """
     retry_max = 6
 
-    def __init__(self, original_module):
+    def __init__(self, original_module, pool_size=None, bind_dn=None):
+        """
+        Args:
+            original_module: The ldap module.
+            pool_size: If set, connections come from a LDAPConnectionPool of
+                at most this many connections per server URI.
+            bind_dn: The DN which pooled connections stay bound as between
+                uses, see PooledLDAPConnection.
+        """
         self._original_module = original_module
+        self._pool_size = pool_size
+        self._bind_dn = bind_dn
 
     def __getattr__(self, name):
         """
@@ -87,5 +271,624 @@ class ReconnectingLDAP(object):
         # the kwarg would be accepted but discarded.  As of version 1.6.1,
         # there is only one call to `initialize` in `django-auth-ldap`, and the
         # only kwarg used is `bytes_mode=False`.
+        if self._pool_size:
+            pool = get_connection_pool(
+                uri, partial(self._connect, uri), self._pool_size,
+                self._bind_dn)
+            return pool.acquire()
+        return self._connect(uri)
+
+    def _connect(self, uri):
         return self._original_module.ldapobject.ReconnectLDAPObject(
             uri, retry_max=self.retry_max)
+
+
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(uri, connect, max_size, bind_dn=None):
+    """Return the process' LDAPConnectionPool for a server URI.
+
+    The pool is created on first use, with BAYA_LDAP_POOL_MAX_IDLE,
+    BAYA_LDAP_POOL_TIMEOUT and BAYA_LDAP_POOL_RETRIES.
+    """
+    with _connection_pools_lock:
+        if uri not in _connection_pools:
+            _connection_pools[uri] = LDAPConnectionPool(
+                connect, max_size=max_size,
+                max_idle=getattr(settings, 'BAYA_LDAP_POOL_MAX_IDLE', 300),
+                timeout=getattr(settings, 'BAYA_LDAP_POOL_TIMEOUT', 10),
+                bind_dn=bind_dn,
+                retries=getattr(settings, 'BAYA_LDAP_POOL_RETRIES', 1))
+        return _connection_pools[uri]
+
+
+class PoolExhaustedError(ldap.SERVER_DOWN):
+    """Raised when no pooled connection is released in time."""
+
+
+class LDAPConnectionPool(object):
+    """A thread safe pool of connections to one LDAP server.
+
+    django-auth-ldap makes a connection per _LDAPUser, so every login or
+    group lookup costs a TCP (and TLS) handshake and a bind. The pool hands
+    out PooledLDAPConnections instead, which keep their connection's TLS and
+    bind state. They go back to the pool when they're unbound, at the end of
+    the request (see release_connections), or when they're garbage
+    collected.
+
+    At most `max_size` connections are open at once; acquire waits up to
+    `timeout` seconds for one to be released, then raises
+    PoolExhaustedError. Connections which have been idle for `max_idle`
+    seconds are closed, and the ones which have been idle for `check_after`
+    seconds are checked with a whoami before they're reused, and replaced if
+    it fails. Connections which raised SERVER_DOWN (after the
+    ReconnectLDAPObject's own retries) aren't reused, and reads which raised
+    it are retried on another connection up to `retries` times.
+    """
+    check_after = 30
+
+    def __init__(self, connect, max_size=10, max_idle=300, timeout=10,
+                 bind_dn=None, retries=1, clock=time.monotonic):
+        """
+        Args:
+            connect: A callable that returns a new, unbound, LDAPObject.
+            bind_dn: The DN which connections can stay bound as (the service
+                account). Any other simple_bind_s goes to the server.
+            retries: How many other connections to retry a read on when a
+                connection goes down.
+            clock: Returns the time in seconds, for idle times.
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.bind_dn = bind_dn
+        self.retries = retries
+        self._clock = clock
+        self._condition = threading.Condition()
+        # (connection, state, released at) tuples, most recent last.
+        self._idle = []
+        self._size = 0
+
+    def acquire(self):
+        """Return a PooledLDAPConnection."""
+        return PooledLDAPConnection(self, *self.checkout())
+
+    def checkout(self):
+        """Return a (LDAPObject, state dict) to pass back to release."""
+        while True:
+            entry = self._checkout()
+            if entry is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    self._discard(None)
+                    raise
+                return connection, {}
+            connection, state, released_at = entry
+            if (self._clock() - released_at < self.check_after or
+                    self._is_healthy(connection)):
+                return connection, state
+            self._discard(connection)
+
+    def release(self, connection, state):
+        if state.get('broken'):
+            self._discard(connection)
+            return
+        with self._condition:
+            self._idle.append((connection, state, self._clock()))
+            self._condition.notify()
+
+    def clear(self):
+        """Close the idle connections."""
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def _checkout(self):
+        """Return an idle (connection, state, released_at), or None if the
+        caller should open a new connection.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                expired = self._evict()
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhaustedError(
+                        {'desc': 'LDAP connection pool exhausted'})
+                self._condition.wait(remaining)
+        for connection in expired:
+            self._close(connection)
+        return entry
+
+    def _evict(self):
+        """Remove and return the connections that have been idle too long.
+
+        Must be called with the lock held.
+        """
+        now = self._clock()
+        expired = [connection for connection, _, released_at in self._idle
+                   if now - released_at >= self.max_idle]
+        if expired:
+            self._idle = [entry for entry in self._idle
+                          if now - entry[2] < self.max_idle]
+            self._size -= len(expired)
+        return expired
+
+    @staticmethod
+    def _is_healthy(connection):
+        try:
+            connection.whoami_s()
+        except ldap.LDAPError:
+            return False
+        return True
+
+    def _discard(self, connection):
+        if connection is not None:
+            self._close(connection)
+        with self._condition:
+            self._size -= 1
+            self._condition.notify()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+
+def _bind_digest(who, cred):
+    if isinstance(cred, six.text_type):
+        cred = cred.encode('utf-8')
+    return hashlib.sha256(
+        (who or '').lower().encode('utf-8') + b'\0' + (cred or b'')
+    ).hexdigest()
+
+
+# The PooledLDAPConnections each thread has borrowed, see
+# release_connections.
+_borrowed = threading.local()
+# The outage errors raised on each thread, see raise_ldap_outages.
+_outages = threading.local()
+
+
+def _record_outage(error):
+    errors = getattr(_outages, 'errors', None)
+    if errors is not None:
+        errors.append(error)
+
+
+@contextmanager
+def raise_ldap_outages():
+    """Raise the outage errors that django-auth-ldap swallowed in the block.
+
+    LDAPSearch.execute logs LDAPErrors and returns no results, so a lookup
+    during an outage looks like a user with no groups. Pooled and circuit
+    breaker connections record the OUTAGE_ERRORS their calls raise (including
+    CircuitOpenError and PoolExhaustedError), and the first one is raised
+    when the block finishes.
+    """
+    previous = getattr(_outages, 'errors', None)
+    _outages.errors = errors = []
+    try:
+        yield
+    finally:
+        _outages.errors = previous
+    if errors:
+        raise errors[0]
+
+
+def release_connections(**kwargs):
+    """Return the current thread's pooled LDAP connections to their pools.
+
+    django-auth-ldap never unbinds its connections, so without this they'd
+    only go back to the pool when they're garbage collected. It's connected
+    to django's request_finished signal, and called after each task on the
+    LDAP thread pool. Connections bound as a user rather than the pool's
+    bind_dn are left alone, since their bind can't be restored.
+    """
+    borrowed = getattr(_borrowed, 'connections', None)
+    if not borrowed:
+        return
+    for connection in list(borrowed):
+        if connection.release():
+            borrowed.discard(connection)
+
+
+request_finished.connect(
+    release_connections, dispatch_uid='baya.backend.release_connections')
+
+
+def release_ldap_connection(ldap_user):
+    """Return an _LDAPUser's pooled connection to the pool.
+
+    The _LDAPUser connects and binds again if it needs LDAP after this.
+    Connections which aren't pooled are left alone.
+    """
+    connection = ldap_user._connection
+    if isinstance(connection, PooledLDAPConnection):
+        ldap_user._connection = None
+        ldap_user._connection_bound = False
+        connection.unbind_s()
+
+
+class PooledLDAPConnection(object):
+    """A LDAPObject on loan from a LDAPConnectionPool.
+
+    start_tls_s is only sent once per connection, and simple_bind_s as the
+    pool's bind_dn is skipped if the connection is already bound with the
+    same credentials. Other binds, like checking a user's password, always
+    go to the server.
+
+    unbind_s and release return the connection to the pool. After release
+    the next call borrows a connection again, and restores TLS and the
+    bind as the pool's bind_dn, so django-auth-ldap can keep using it.
+    """
+    # Set by CircuitBreakerLDAP, for the calls which go to the server.
+    breaker = None
+    # Calls which are safe to retry on another connection.
+    retry_methods = frozenset([
+        'search_s', 'search_st', 'search_ext_s', 'read_s', 'compare_s',
+        'compare_ext_s', 'whoami_s', 'simple_bind_s'])
+
+    def __init__(self, pool, connection, state):
+        self._pool = pool
+        self._bind_dn = (pool.bind_dn or '').lower()
+        self._tls = False
+        # The (who, cred) of a bind as bind_dn, to restore, and whether the
+        # connection is bound as anyone else.
+        self._bound_as = None
+        self._user_bound = False
+        self._lend(connection, state)
+
+    def _lend(self, connection, state):
+        self._connection = connection
+        self._state = state
+        self._release = weakref.finalize(
+            self, self._pool.release, connection, state)
+        if not hasattr(_borrowed, 'connections'):
+            _borrowed.connections = weakref.WeakSet()
+        _borrowed.connections.add(self)
+
+    def _borrow(self):
+        """Return the LDAPObject, borrowing one again after a release."""
+        if self._connection is not None:
+            return self._connection
+        connection, state = self._pool.checkout()
+        self._lend(connection, state)
+        try:
+            if self._tls and not state.get('tls'):
+                self._server_call('start_tls_s')
+                state['tls'] = True
+            if self._bound_as is not None:
+                digest = _bind_digest(*self._bound_as)
+                if state.get('bind') != digest:
+                    state['bind'] = None
+                    self._server_call('simple_bind_s', *self._bound_as)
+                    state['bind'] = digest
+        except CircuitOpenError:
+            self.release()
+            raise
+        except ldap.LDAPError:
+            state['broken'] = True
+            self.release()
+            raise
+        return connection
+
+    def __getattr__(self, name):
+        try:
+            connection = self._borrow()
+        except OUTAGE_ERRORS as e:
+            _record_outage(e)
+            raise
+        value = getattr(connection, name)
+        if callable(value):
+            return partial(self._call, name)
+        return value
+
+    def _server_call(self, name, *args, **kwargs):
+        method = getattr(self._connection, name)
+        if (self.breaker is None or
+                name in CircuitBreakerLDAPObject.local_methods):
+            return method(*args, **kwargs)
+        return self.breaker.call(method, *args, **kwargs)
+
+    def _call(self, name, *args, **kwargs):
+        try:
+            return self._call_with_retries(name, *args, **kwargs)
+        except OUTAGE_ERRORS as e:
+            _record_outage(e)
+            raise
+
+    def _call_with_retries(self, name, *args, **kwargs):
+        retries = self._pool.retries if name in self.retry_methods else 0
+        while True:
+            self._borrow()
+            if name == 'simple_bind_s':
+                # The connection's bind is unknown until this returns.
+                self._state['bind'] = None
+            try:
+                return self._server_call(name, *args, **kwargs)
+            except CircuitOpenError:
+                raise
+            except ldap.SERVER_DOWN:
+                self._state['broken'] = True
+                if retries <= 0 or self._user_bound:
+                    raise
+                retries -= 1
+                logger.warning("Retrying LDAP %s on another connection.",
+                               name)
+                self.release()
+
+    def start_tls_s(self):
+        self._tls = True
+        self._borrow()
+        if not self._state.get('tls'):
+            self._call('start_tls_s')
+            self._state['tls'] = True
+
+    def simple_bind_s(self, who=None, cred=None, *args, **kwargs):
+        reusable = (not args and not kwargs and who and
+                    who.lower() == self._bind_dn)
+        self._bound_as = None
+        self._user_bound = False
+        digest = _bind_digest(who, cred)
+        self._borrow()
+        if reusable and self._state.get('bind') == digest:
+            self._bound_as = (who, cred)
+            return None
+        result = self._call('simple_bind_s', who, cred, *args, **kwargs)
+        if reusable:
+            self._state['bind'] = digest
+            self._bound_as = (who, cred)
+        else:
+            self._user_bound = True
+        return result
+
+    def release(self):
+        """Return the connection to the pool, if its bind can be restored.
+
+        Returns True if it was returned (or already had been).
+        """
+        if self._user_bound:
+            return False
+        if self._connection is not None:
+            self._connection = None
+            self._release()
+        return True
+
+    def unbind_s(self):
+        """Return the connection to the pool."""
+        self._bound_as = None
+        self._user_bound = False
+        self.release()
+
+    unbind = unbind_s
+
+
+class CircuitOpenError(ldap.SERVER_DOWN):
+    """Raised instead of calling LDAP while the circuit breaker is open."""
+
+
+# Errors meaning the server is down or overloaded, rather than, say, a bad
+# password.
+OUTAGE_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.CONNECT_ERROR,
+                 ldap.UNAVAILABLE, ldap.BUSY)
+
+
+class CircuitBreaker(object):
+    """Fails LDAP calls fast while the server is down or too slow.
+
+    After `failure_threshold` consecutive calls raise one of OUTAGE_ERRORS
+    or take longer than `slow_call_threshold` seconds, the breaker opens,
+    and calls raise CircuitOpenError without going to the server. After
+    `reset_timeout` seconds it's half open: one call is let through, which
+    closes the breaker again if it succeeds in time, and reopens it if not.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, slow_call_threshold=None,
+                 reset_timeout=30, clock=time.monotonic):
+        if failure_threshold < 1:
+            raise ValueError("failure_threshold must be at least 1.")
+        self.failure_threshold = failure_threshold
+        self.slow_call_threshold = slow_call_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._rejected = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if (self._state == self.OPEN and
+                self._clock() - self._opened_at >= self.reset_timeout):
+            self._state = self.HALF_OPEN
+        return self._state
+
+    def stats(self):
+        """Return a dict describing the breaker, for monitoring."""
+        with self._lock:
+            return {
+                'state': self._current_state(),
+                'failures': self._failures,
+                'opened_at': self._opened_at,
+                'rejected': self._rejected,
+            }
+
+    def check(self):
+        """Raise CircuitOpenError if the breaker is open."""
+        with self._lock:
+            if self._current_state() == self.OPEN:
+                self._rejected += 1
+                raise CircuitOpenError({'desc': 'LDAP circuit breaker open'})
+
+    def call(self, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), recording how it went."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.OPEN or (state == self.HALF_OPEN and
+                                      self._trial_running):
+                self._rejected += 1
+                raise CircuitOpenError({'desc': 'LDAP circuit breaker open'})
+            trial = state == self.HALF_OPEN
+            if trial:
+                self._trial_running = True
+        started = self._clock()
+        try:
+            result = fn(*args, **kwargs)
+        except (CircuitOpenError, PoolExhaustedError):
+            # Raised before reaching the server, so says nothing about it.
+            self._record(None, trial)
+            raise
+        except OUTAGE_ERRORS:
+            self._record(False, trial)
+            raise
+        except BaseException:
+            # Not the server's fault, but it did answer.
+            self._record(True, trial)
+            raise
+        slow = (self.slow_call_threshold is not None and
+                self._clock() - started > self.slow_call_threshold)
+        self._record(not slow, trial)
+        return result
+
+    def _record(self, success, trial):
+        """Record a call's outcome: True, False, or None if it didn't count.
+        """
+        with self._lock:
+            if trial:
+                self._trial_running = False
+            if success is None:
+                return
+            if success:
+                if self._state != self.CLOSED:
+                    logger.warning("LDAP circuit breaker closed.")
+                self._state = self.CLOSED
+                self._failures = 0
+                return
+            self._failures += 1
+            if trial or (self._state == self.CLOSED and
+                         self._failures >= self.failure_threshold):
+                if self._state == self.CLOSED:
+                    logger.warning(
+                        "LDAP circuit breaker opened after %d failures.",
+                        self._failures)
+                self._state = self.OPEN
+                self._opened_at = self._clock()
+
+    def reset(self):
+        """Close the breaker."""
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+
+_circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(uri):
+    """Return the process' CircuitBreaker for a server URI.
+
+    It's created on first use, with BAYA_LDAP_BREAKER_FAILURE_THRESHOLD
+    (default 5), BAYA_LDAP_BREAKER_SLOW_CALL (seconds, default None) and
+    BAYA_LDAP_BREAKER_RESET_TIMEOUT (seconds, default 30).
+    """
+    with _circuit_breakers_lock:
+        if uri not in _circuit_breakers:
+            _circuit_breakers[uri] = CircuitBreaker(
+                failure_threshold=getattr(
+                    settings, 'BAYA_LDAP_BREAKER_FAILURE_THRESHOLD', 5),
+                slow_call_threshold=getattr(
+                    settings, 'BAYA_LDAP_BREAKER_SLOW_CALL', None),
+                reset_timeout=getattr(
+                    settings, 'BAYA_LDAP_BREAKER_RESET_TIMEOUT', 30))
+        return _circuit_breakers[uri]
+
+
+def get_circuit_breaker_stats():
+    """Return {server URI: CircuitBreaker.stats()}, for monitoring."""
+    with _circuit_breakers_lock:
+        breakers = dict(_circuit_breakers)
+    return {uri: breaker.stats() for uri, breaker in breakers.items()}
+
+
+class CircuitBreakerLDAP(object):
+    """Wraps the ldap module so connections go through a CircuitBreaker.
+
+    Like ReconnectingLDAP (which it can wrap), this only replaces
+    initialize. Each server URI has its own breaker, see
+    get_circuit_breaker.
+    """
+
+    def __init__(self, original_module):
+        self._original_module = original_module
+
+    def __getattr__(self, name):
+        return getattr(self._original_module, name)
+
+    def initialize(self, uri, *args, **kwargs):
+        breaker = get_circuit_breaker(uri)
+        # Don't wait for a pooled connection while the server is down.
+        breaker.check()
+        connection = self._original_module.initialize(uri, *args, **kwargs)
+        if isinstance(connection, PooledLDAPConnection):
+            # Pooled connections skip binds and TLS they've already done,
+            # which mustn't count as the server answering, so the breaker
+            # only wraps the calls that go to the server.
+            connection.breaker = breaker
+            return connection
+        return CircuitBreakerLDAPObject(connection, breaker)
+
+
+class CircuitBreakerLDAPObject(object):
+    """A LDAPObject whose calls to the server go through a CircuitBreaker.
+
+    Calls which raise OUTAGE_ERRORS are recorded for raise_ldap_outages.
+    """
+
+    # Methods which don't talk to the server.
+    local_methods = frozenset([
+        'get_option', 'set_option', 'fileno', 'unbind', 'unbind_s',
+        'unbind_ext', 'unbind_ext_s'])
+
+    def __init__(self, connection, breaker):
+        self._connection = connection
+        self._breaker = breaker
+
+    def __getattr__(self, name):
+        value = getattr(self._connection, name)
+        if callable(value) and name not in self.local_methods:
+            return partial(self._call, value)
+        return value
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return self._breaker.call(method, *args, **kwargs)
+        except OUTAGE_ERRORS as e:
+            _record_outage(e)
+            raise
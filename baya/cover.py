@@ -0,0 +1,227 @@
+"""Find the sets of groups which satisfy a BaseNode expression.
+
+This answers "which groups would grant access to this view?", eg for 403
+pages or access-request tooling:
+
+    from baya.cover import groups_to_grant
+    from baya.utils import get_user_roles
+
+    gate = request.resolver_match.func._gate
+    options = groups_to_grant(gate.get_membership_node(request),
+                              get_user_roles(request.user),
+                              request=request)
+    # options looks like [{'group1'}, {'group2', 'group3'}]
+
+The expression is converted into a minimized disjunctive normal form (DNF):
+an OR of terms, where each term is an AND of groups the user must be in and
+groups the user must not be in. Negations are pushed down to the groups, so
+InvertNodes and XorNodes are handled exactly. Terms are kept minimal while
+they're built: contradictory terms are dropped, terms which only differ in
+the polarity of one group are merged, and terms which are supersets of
+other terms are absorbed.
+
+DNFs can grow exponentially, so every intermediate DNF is bounded by
+`max_terms`. Expressions which exceed it raise a ValueError rather than
+using unbounded time and memory.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+from .membership import AndNode
+from .membership import DynamicRolesNode
+from .membership import InvertNode
+from .membership import OrNode
+from .membership import RolesNode
+from .membership import ValueNode
+from .membership import XorNode
+
+
+DEFAULT_MAX_TERMS = 256
+
+
+class GroupSet(namedtuple('GroupSet', ['requires', 'excludes'])):
+    """One way to satisfy an expression.
+
+    A user satisfies the expression if they are in every group in
+    `requires` and in none of the groups in `excludes`.
+    """
+    __slots__ = ()
+
+    def is_satisfied_by(self, roles):
+        return self.requires <= roles and not (self.excludes & roles)
+
+
+def _minimize(terms):
+    """Merge and absorb the terms of a DNF.
+
+    Each term is a frozenset of (role, required) literals.
+    """
+    terms = set(terms)
+    while True:
+        # Merge terms which only differ in one literal's polarity:
+        # (x & a) | (x & ~a) == x
+        merged = set()
+        for term in terms:
+            for literal in term:
+                role, required = literal
+                if (term - {literal}) | {(role, not required)} in terms:
+                    merged.add(term - {literal})
+        new_terms = merged - terms
+        terms |= merged
+        # Absorb terms which are supersets of another term: x | (x & a) == x
+        minimal = []
+        for term in sorted(terms, key=len):
+            if not any(kept <= term for kept in minimal):
+                minimal.append(term)
+        terms = set(minimal)
+        if not new_terms:
+            return frozenset(terms)
+
+
+def _is_consistent(term):
+    required = {role for role, req in term if req}
+    return not any(role in required for role, req in term if not req)
+
+
+class _DNFBuilder(object):
+    """Build the minimized DNF of a node, or of its negation."""
+
+    def __init__(self, max_terms, kwargs):
+        self.max_terms = max_terms
+        self.kwargs = kwargs
+        self._memo = {}
+
+    def _check_size(self, terms):
+        if len(terms) > self.max_terms:
+            raise ValueError(
+                "The expression needs more than %d terms in disjunctive "
+                "normal form." % self.max_terms)
+        return terms
+
+    def _union(self, left, right):
+        return self._check_size(_minimize(left | right))
+
+    def _product(self, left, right):
+        if len(left) * len(right) > self.max_terms ** 2:
+            raise ValueError(
+                "The expression needs more than %d terms in disjunctive "
+                "normal form." % self.max_terms)
+        terms = (l_term | r_term for l_term in left for r_term in right)
+        return self._check_size(
+            _minimize(term for term in terms if _is_consistent(term)))
+
+    def _roles(self, roles_node):
+        if isinstance(roles_node, DynamicRolesNode):
+            if not self.kwargs:
+                raise TypeError(
+                    "Cannot find the groups for %r without the kwargs (eg "
+                    "request) its callables need." % roles_node)
+            return roles_node.get_roles_set(**self.kwargs)
+        return roles_node.get_roles_set()
+
+    def dnf(self, node, positive=True):
+        key = (node, positive)
+        if key not in self._memo:
+            self._memo[key] = self._dnf(node, positive)
+        return self._memo[key]
+
+    def _dnf(self, node, positive):
+        if isinstance(node, ValueNode):
+            if bool(node.value) == positive:
+                return frozenset([frozenset()])
+            return frozenset()
+
+        if isinstance(node, RolesNode):
+            roles = {role.lower() for role in self._roles(node)}
+            if positive:
+                return frozenset([frozenset((role, True) for role in roles)])
+            return self._check_size(frozenset(
+                frozenset([(role, False)]) for role in roles))
+
+        if isinstance(node, InvertNode):
+            return self.dnf(node._operands[0], not positive)
+
+        if isinstance(node, (AndNode, OrNode, XorNode)):
+            left, right = node._operands
+            if isinstance(node, XorNode):
+                # a ^ b == (a & ~b) | (~a & b)
+                # ~(a ^ b) == (a & b) | (~a & ~b)
+                return self._union(
+                    self._product(self.dnf(left, True),
+                                  self.dnf(right, not positive)),
+                    self._product(self.dnf(left, False),
+                                  self.dnf(right, positive)))
+            # De Morgan: ~(a & b) == ~a | ~b, ~(a | b) == ~a & ~b
+            if isinstance(node, AndNode) == positive:
+                return self._product(self.dnf(left, positive),
+                                     self.dnf(right, positive))
+            return self._union(self.dnf(left, positive),
+                               self.dnf(right, positive))
+
+        raise TypeError('Cannot find the groups for node %r' % node)
+
+
+def _sort_key(group_set):
+    return (len(group_set.requires), len(group_set.excludes),
+            sorted(group_set.requires), sorted(group_set.excludes))
+
+
+def _group_sets(terms):
+    group_sets = [
+        GroupSet(frozenset(role for role, req in term if req),
+                 frozenset(role for role, req in term if not req))
+        for term in terms]
+    return tuple(sorted(group_sets, key=_sort_key))
+
+
+@lru_cache(maxsize=1024)
+def _static_group_sets(node, max_terms):
+    return _group_sets(_DNFBuilder(max_terms, {}).dnf(node))
+
+
+def minimal_group_sets(node, max_terms=DEFAULT_MAX_TERMS, **kwargs):
+    """Return the GroupSets which satisfy a node, cheapest first.
+
+    Args:
+        node: A BaseNode.
+        max_terms: The maximum number of terms in any intermediate DNF.
+            Raises a ValueError if the expression needs more.
+        kwargs: passed to DynamicRolesNode callables, like the kwargs to
+            PermissionChecker.visit. Nodes containing a DynamicRolesNode
+            raise a TypeError without them.
+
+    Returns a tuple of GroupSets. A user satisfies the node if and only if
+    they satisfy at least one of them. An empty tuple means nothing satisfies
+    the node (eg DENY_ALL). Results are cached per node, unless kwargs are
+    given.
+    """
+    if kwargs:
+        return _group_sets(_DNFBuilder(max_terms, kwargs).dnf(node))
+    return _static_group_sets(node, max_terms)
+
+
+def groups_to_grant(node, roles, max_terms=DEFAULT_MAX_TERMS, **kwargs):
+    """Return the cheapest sets of groups to add to `roles` to satisfy node.
+
+    Args:
+        node: A BaseNode.
+        roles: The groups the user is already in.
+        max_terms, kwargs: See minimal_group_sets.
+
+    Returns a list of frozensets of group names, smallest first, where
+    joining all of the groups in any one of them satisfies the node. Supersets
+    of other options are left out. Returns [frozenset()] if the roles already
+    satisfy the node, and [] if no groups can be added to satisfy it (eg
+    because the user is in an excluded group).
+    """
+    roles = {role.lower() for role in roles}
+    options = []
+    for group_set in minimal_group_sets(node, max_terms, **kwargs):
+        if group_set.excludes & roles:
+            continue
+        missing = group_set.requires - roles
+        if not any(option <= missing for option in options):
+            options = [option for option in options
+                       if not missing <= option]
+            options.append(missing)
+    return sorted(options, key=lambda option: (len(option), sorted(option)))
@@ -1,12 +1,145 @@
+import hashlib
 import logging
+import re
+import uuid
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache import caches
+from django.db.models import F
+from django.db.models import TextField
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.functions import Cast
+from django.db.models.functions import Lower
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.http import Http404
+
+from .utils import get_user_roles
 
 logger = logging.getLogger('baya')
 
 
+def _get_cache():
+    return caches[getattr(settings, 'BAYA_DYNAMIC_ROLES_CACHE',
+                          DEFAULT_CACHE_ALIAS)]
+
+
+def _hash(value):
+    return hashlib.md5(value.encode('utf-8')).hexdigest()
+
+
+def _class_path(obj):
+    return '%s.%s' % (obj.__class__.__module__, obj.__class__.__name__)
+
+
 class DynamicRoleCallable(object):
+    """Base class for DynamicRolesNode callables.
+
+    Results can be cached across requests in django's cache (the
+    BAYA_DYNAMIC_ROLES_CACHE alias, 'default' by default) by setting
+    `cache_timeout` and implementing `get_callable_key` and `get_cache_key`.
+    """
+    # Set to False if the roles can change within a request. See
+    # baya.membership.DynamicRolesNode.
+    memoize = True
+    # Seconds to cache results across requests for, or None to not cache.
+    cache_timeout = None
+    # Set to False if the callable doesn't use the ORM (or a database cache),
+    # so async views can run it outside the thread sensitive executor. See
+    # baya.membership.DynamicRolesNode.
+    thread_sensitive = True
+
     def __call__(self, **kwargs):
         raise NotImplementedError("You must implement this method.")
 
+    def get_callable_key(self):
+        """Return a string identifying the roles this callable computes.
+
+        Cached results are shared by every callable with the same key, in
+        every process, so it must include everything which changes the
+        result besides the cache key. Callables with a key of None aren't
+        cached.
+        """
+        return None
+
+    def get_cache_key(self, **kwargs):
+        """Return the key to cache the roles for these kwargs under.
+
+        The key only needs to be unique for this callable. Calls with a key
+        of None aren't cached.
+        """
+        return None
+
+    def _get_generation_key(self, callable_key):
+        return 'baya.roles.generation.%s' % _hash(callable_key)
+
+    def _get_generation(self, cache, callable_key):
+        # Every cache key includes a generation, so invalidating every key
+        # only needs a new generation.
+        generation_key = self._get_generation_key(callable_key)
+        generation = cache.get(generation_key)
+        if generation is None:
+            cache.add(generation_key, uuid.uuid4().hex, None)
+            generation = cache.get(generation_key)
+        return generation
+
+    def _make_cache_key(self, cache, callable_key, key):
+        return 'baya.roles.%s' % _hash('%s:%s:%s' % (
+            self._get_generation(cache, callable_key), callable_key, key))
+
+    def _read_cache(self, kwargs):
+        """Return (cache key, cached roles), or (None, None) if not cached."""
+        if self.cache_timeout is None:
+            return None, None
+        callable_key = self.get_callable_key()
+        if callable_key is None:
+            return None, None
+        key = self.get_cache_key(**kwargs)
+        if key is None:
+            return None, None
+        cache = _get_cache()
+        cache_key = self._make_cache_key(cache, callable_key, key)
+        return cache_key, cache.get(cache_key)
+
+    def _write_cache(self, cache_key, roles):
+        if isinstance(roles, set):
+            _get_cache().set(cache_key, roles, self.cache_timeout)
+
+    def get_cached_roles(self, **kwargs):
+        """Call the callable, using the cross-request cache if enabled."""
+        cache_key, roles = self._read_cache(kwargs)
+        if roles is None:
+            roles = self(**kwargs)
+            if cache_key is not None:
+                self._write_cache(cache_key, roles)
+        return roles
+
+    async def aget_cached_roles(self, **kwargs):
+        """Async version of get_cached_roles, for async callables.
+
+        django's cache API is sync, so the cache is used with sync_to_async.
+        """
+        from asgiref.sync import sync_to_async
+        cache_key, roles = await sync_to_async(self._read_cache)(kwargs)
+        if roles is None:
+            roles = await self(**kwargs)
+            if cache_key is not None:
+                await sync_to_async(self._write_cache)(cache_key, roles)
+        return roles
+
+    def invalidate(self, key=None):
+        """Drop the cached roles for one cache key, or for every key."""
+        callable_key = self.get_callable_key()
+        if callable_key is None:
+            return
+        cache = _get_cache()
+        if key is None:
+            cache.set(self._get_generation_key(callable_key),
+                      uuid.uuid4().hex, None)
+        else:
+            cache.delete(self._make_cache_key(cache, callable_key, key))
+
 
 class DjangoRequestCallable(DynamicRoleCallable):
     def __call__(self, request, **kwargs):
@@ -48,6 +181,8 @@ class DjangoRequestGroupFormatter(DjangoRequestCallable):
     This url will pass my_param1 to the formatter and log a warning about
     my_param2 being there.
     """
+    thread_sensitive = False
+
     def __init__(self, group_name_format, query_field):
         """
         Args:
@@ -59,19 +194,211 @@ class DjangoRequestGroupFormatter(DjangoRequestCallable):
         self.group_name_format = group_name_format
         self.query_field = query_field
 
-    def __call__(self, request):
+    def _get_query_value(self, request):
         url_kwargs = request.resolver_match.kwargs
         if self.query_field in url_kwargs and self.query_field in request.GET:
             logger.warning(
                 "The requested parameter (%s) was in both the url kwargs "
                 "and the url query parameters." % self.query_field)
-        value = url_kwargs.get(self.query_field,
-                               request.GET.get(self.query_field))
-        group = self.group_name_format % value
+        return url_kwargs.get(self.query_field,
+                              request.GET.get(self.query_field))
+
+    def __call__(self, request):
+        group = self.group_name_format % self._get_query_value(request)
         return {group.lower()}
 
+    def get_callable_key(self):
+        return repr((_class_path(self), self.group_name_format,
+                     self.query_field))
+
+    def get_cache_key(self, request, **kwargs):
+        value = self._get_query_value(request)
+        return None if value is None else str(value)
+
     def __repr__(self):
         return "%s(%s, %s)" % (
             self.__class__.__name__,
             self.group_name_format,
             self.query_field)
+
+
+class ModelFieldGroupFormatter(DjangoRequestGroupFormatter):
+    """Create a dynamic group, whose name depends on a field of an object.
+
+    This is the object level version of DjangoRequestGroupFormatter. Say
+    every BlogPost has a category, and only users in the <category>_editor
+    group may edit it:
+
+        post_editors = ModelFieldGroupFormatter(
+            BlogPost, 'category__name', "%s_editor", 'post_id')
+
+        @requires(DynamicRolesNode(post_editors))
+        def edit_post(request, post_id):
+            ...
+
+    The object's primary key is read from the url kwarg or query parameter
+    `query_field`, like DjangoRequestGroupFormatter, and the view 404s if
+    there's no such object.
+
+    Because the group name is a plain mapping of a model field, the check
+    can also be turned around into a single query. Listing views can use
+    `filter_queryset` instead of checking each object:
+
+        posts = post_editors.filter_queryset(BlogPost.objects.all(),
+                                             request.user)
+
+    Group names are lowercased, like everywhere in baya, so
+    `filter_queryset` matches them against the field's values as they are,
+    which should be lowercase too. Pass `ignore_case=True` if they aren't,
+    and index `lower(field)` so the query can still use an index.
+
+    When `field` spans a multi-valued relation, such as 'tags__name', the
+    object has a group per related value. The user needs every one of them,
+    both to pass the check and to be let through `filter_queryset`.
+
+    Looking the object up costs a query on every check. Pass a
+    `cache_timeout` to cache the groups per object across requests, and
+    invalidate them when the objects change:
+
+        post_editors = ModelFieldGroupFormatter(
+            BlogPost, 'category__name', "%s_editor", 'post_id',
+            cache_timeout=600)
+        post_editors.invalidate_on_save(Category)
+    """
+    # The object is looked up with the ORM.
+    thread_sensitive = True
+
+    def __init__(self, model, field, group_name_format, query_field='pk',
+                 cache_timeout=None, ignore_case=False):
+        """
+        Args:
+            model: The model class of the protected objects.
+            field: The field whose value is formatted into the group name.
+                This may span relations, eg 'category__name'.
+            group_name_format: The group name which can be formatted with the
+                field's value. It must contain exactly one %s. EG "%s_admin"
+            query_field: The query parameter which contains the primary key
+                of the object.
+            cache_timeout: Seconds to cache each object's groups for. See
+                DynamicRoleCallable.
+            ignore_case: Whether filter_queryset should lowercase the
+                field's values before matching them against the groups.
+        """
+        if group_name_format.count('%s') != 1:
+            raise ValueError(
+                "The group name format must contain exactly one %%s, not "
+                "%r." % group_name_format)
+        super(ModelFieldGroupFormatter, self).__init__(
+            group_name_format, query_field)
+        self.model = model
+        self.field = field
+        self.cache_timeout = cache_timeout
+        self.ignore_case = ignore_case
+        prefix, suffix = group_name_format.lower().split('%s')
+        self._group_name_re = re.compile(
+            '^%s(.+)%s$' % (re.escape(prefix), re.escape(suffix)))
+
+    def __call__(self, request):
+        values = list(self.model._default_manager.filter(
+            pk=self._get_query_value(request)).values_list(
+                self.field, flat=True))
+        if not values:
+            raise Http404("No %s matches the given query." %
+                          self.model._meta.object_name)
+        return {(self.group_name_format % value).lower()
+                for value in values}
+
+    def get_callable_key(self):
+        return repr((_class_path(self), self.model._meta.label, self.field,
+                     self.group_name_format, self.query_field))
+
+    def invalidate_on_save(self, *models):
+        """Invalidate the cached groups when objects are saved or deleted.
+
+        Saving one of `model`'s objects only invalidates that object's
+        groups. Saving any of the other `models`, such as the models that
+        `field` spans, invalidates every object's groups.
+        """
+        for sender in (self.model,) + models:
+            for signal in (post_save, post_delete):
+                signal.connect(self._invalidate_instance, sender=sender,
+                               weak=False,
+                               dispatch_uid='baya.roles.%s' % id(self))
+
+    def _invalidate_instance(self, sender, instance, **kwargs):
+        if sender is self.model:
+            self.invalidate(str(instance.pk))
+        else:
+            self.invalidate()
+
+    def roles_for_object(self, obj):
+        """Return the set of groups which grant access to `obj`."""
+        value = obj
+        for attr in self.field.split('__'):
+            value = getattr(value, attr)
+        return {(self.group_name_format % value).lower()}
+
+    def field_values(self, roles):
+        """Return the (lowercased) field values granted by a set of roles."""
+        values = set()
+        for role in roles:
+            match = self._group_name_re.match(role.lower())
+            if match:
+                values.add(match.group(1))
+        return values
+
+    def _is_multivalued(self):
+        """Return whether `field` spans a to-many relation."""
+        opts = self.model._meta
+        for name in self.field.split(LOOKUP_SEP):
+            field = opts.get_field(name)
+            if field.many_to_many or field.one_to_many:
+                return True
+            if not field.is_relation:
+                return False
+            opts = field.related_model._meta
+        return False
+
+    def _annotate_value(self, queryset):
+        """Annotate queryset with the field's value as _baya_group_value."""
+        value = F(self.field)
+        if self.ignore_case:
+            value = Lower(Cast(self.field, TextField()))
+        return queryset.annotate(_baya_group_value=value)
+
+    def filter_queryset(self, queryset, user):
+        """Filter a queryset down to the objects `user` has access to.
+
+        This runs as a single `WHERE field IN (...)` query, built from the
+        user's groups. For multi-valued fields the objects with a related
+        value outside of the user's groups are excluded by a subquery.
+
+        Args:
+            queryset: A queryset of `model`.
+            user: A django User with its ldap_user populated.
+        """
+        values = self.field_values(get_user_roles(user))
+        if not values:
+            return queryset.none()
+        if not self._is_multivalued():
+            if not self.ignore_case:
+                return queryset.filter(**{self.field + '__in': values})
+            return self._annotate_value(queryset).filter(
+                _baya_group_value__in=values)
+        # Filtering on the annotation, rather than the relation, matches
+        # each related value on its own, like __call__ does.
+        objects = self._annotate_value(self.model._default_manager.all())
+        return queryset.filter(
+            pk__in=objects.filter(
+                _baya_group_value__in=values).values('pk'),
+        ).exclude(
+            pk__in=objects.exclude(
+                _baya_group_value__in=values).values('pk'))
+
+    def __repr__(self):
+        return "%s(%s, %s, %s, %s)" % (
+            self.__class__.__name__,
+            self.model.__name__,
+            self.field,
+            self.group_name_format,
+            self.query_field)
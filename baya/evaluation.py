@@ -0,0 +1,255 @@
+"""Evaluate DynamicRolesNodes concurrently.
+
+PermissionChecker calls every DynamicRolesNode callable one after the other.
+When the callables do I/O, like ORM queries or calls to an entitlements
+service, it's faster to run them at the same time, and to stop as soon as
+the result is known: `{admin} | dynamic1 | dynamic2` doesn't need either
+callable for an admin, and only needs one of them if it returns the roles
+the user has.
+
+The expression is evaluated with three valued (Kleene) logic, where the
+dynamic nodes which haven't returned yet are unknown. Only the unknown nodes
+the result still depends on are started, and the expression is re-evaluated
+as each of them returns, until it's known.
+
+    from baya.evaluation import ConcurrentPermissionChecker
+
+    checker = ConcurrentPermissionChecker(get_user_roles(request.user))
+    checker.visit(node, request=request)
+
+Sync code runs the callables on a shared thread pool, with at most
+BAYA_DYNAMIC_ROLES_MAX_WORKERS (default 8) threads. Callables which check
+permissions themselves, on a pool thread, run their dynamic roles inline,
+since waiting on the full pool could deadlock. Async code (see
+`aevaluate`) runs them as tasks on the event loop instead. Set
+BAYA_CONCURRENT_DYNAMIC_ROLES = True to have Gates use these.
+
+Pool threads have their own database connections, which they keep between
+callables for up to CONN_MAX_AGE, like request threads do. They can't see
+the checking thread's uncommitted transaction, so while it's in an atomic
+block (eg with ATOMIC_REQUESTS) callables which use the ORM, that is which
+don't set `thread_sensitive = False`, run inline on the checking thread.
+"""
+import asyncio
+import threading
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db import connections
+
+from .membership import AndNode
+from .membership import DynamicRolesNode
+from .membership import OrNode
+from .membership import XorNode
+from .visitors import NodeVisitor
+
+
+DEFAULT_MAX_WORKERS = 8
+
+_executor = None
+_executor_lock = threading.Lock()
+# Marks the threads running a callable for ConcurrentPermissionChecker.
+_worker = threading.local()
+
+
+def get_executor():
+    """Return the thread pool which dynamic roles callables run on."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(
+                        settings, 'BAYA_DYNAMIC_ROLES_MAX_WORKERS',
+                        DEFAULT_MAX_WORKERS),
+                    thread_name_prefix='baya')
+    return _executor
+
+
+def is_enabled():
+    return getattr(settings, 'BAYA_CONCURRENT_DYNAMIC_ROLES', False)
+
+
+def split_dynamic_roles_node(node):
+    """Return a DynamicRolesNode for each of node's callables."""
+    if len(node._roles_set) == 1:
+        return [node]
+    return [node.__class__(_callable) for _callable in node._roles_set]
+
+
+class PartialEvaluator(NodeVisitor):
+    """
+    NodeVisitor concrete class that evaluates a node with some roles unknown.
+
+    Visiting returns a (value, pending) tuple. The value is True, False, or
+    None when it depends on DynamicRolesNode callables that haven't returned
+    yet, in which case `pending` is the set of their (single callable) nodes.
+    Unresolved nodes which can't change the value, like the right side of
+    `False & dynamic`, aren't pending.
+    """
+
+    def __init__(self, roles, resolved):
+        """
+        Args:
+            roles: An iterable of strings, representing roles a user has.
+            resolved: A dict mapping the single callable DynamicRolesNodes
+                (see split_dynamic_roles_node) which are resolved so far to
+                their roles sets.
+        """
+        self._roles_set = {role.lower() for role in roles}
+        self._resolved = resolved
+
+    def _visit_value_node(self, value_node, **kwargs):
+        return bool(value_node.value), frozenset()
+
+    def _visit_roles_node(self, roles_node, **kwargs):
+        if not isinstance(roles_node, DynamicRolesNode):
+            return roles_node.get_roles_set() <= self._roles_set, frozenset()
+        # `dynamic1 & dynamic2` is a single node, which requires the roles
+        # from each of its callables, so each callable is a separate leaf.
+        pending = set()
+        for leaf in split_dynamic_roles_node(roles_node):
+            if leaf not in self._resolved:
+                pending.add(leaf)
+            elif not self._resolved[leaf] <= self._roles_set:
+                return False, frozenset()
+        if pending:
+            return None, frozenset(pending)
+        return True, frozenset()
+
+    def _visit_unary_node(self, operator_node, visited_operand):
+        value, pending = visited_operand.value
+        if value is None:
+            return None, pending
+        return operator_node.operator(value), pending
+
+    def _visit_binary_node(self, operator_node, left_visited_operand,
+                           right_visited_operand):
+        left, left_pending = left_visited_operand.value
+        right, right_pending = right_visited_operand.value
+        if isinstance(operator_node, (AndNode, OrNode)):
+            # False dominates AND, True dominates OR.
+            dominant = isinstance(operator_node, OrNode)
+            if left is dominant or right is dominant:
+                return dominant, frozenset()
+        elif not isinstance(operator_node, XorNode):
+            raise TypeError('Cannot visit node %r' % operator_node)
+        if left is None or right is None:
+            return None, left_pending | right_pending
+        return operator_node.operator(left, right), frozenset()
+
+
+def _in_atomic_block():
+    return any(connections[alias].in_atomic_block for alias in connections)
+
+
+def _is_thread_sensitive(node):
+    """Return whether a single callable DynamicRolesNode uses the ORM."""
+    _callable, = node._roles_set
+    return getattr(_callable, 'thread_sensitive', True)
+
+
+def _get_roles_set(node, kwargs):
+    # Pool threads keep their connections across callables, so they're
+    # closed when they're too old, like request_started and
+    # request_finished do for request threads.
+    close_old_connections()
+    _worker.active = True
+    try:
+        return node.get_roles_set(**kwargs)
+    finally:
+        _worker.active = False
+        close_old_connections()
+
+
+class ConcurrentPermissionChecker(object):
+    """Check a node like PermissionChecker, running dynamic roles concurrently.
+
+    Args:
+        roles: An iterable of strings, representing roles a user has.
+        executor: The concurrent.futures.Executor to run the callables on.
+            Defaults to the shared, bounded, thread pool.
+    """
+
+    def __init__(self, roles, executor=None):
+        self._roles = roles
+        self._executor = executor
+
+    def visit(self, node, **kwargs):
+        """Return True if the roles satisfy node.
+
+        kwargs are passed to the DynamicRolesNode callables.
+        """
+        resolved = {}
+        evaluator = PartialEvaluator(self._roles, resolved)
+        running = {}
+        # Pool threads wouldn't see this thread's uncommitted changes.
+        in_atomic_block = _in_atomic_block()
+        try:
+            while True:
+                value, pending = evaluator.visit(node)
+                if value is not None:
+                    return value
+                to_start = [dynamic_node for dynamic_node in pending
+                            if dynamic_node not in running.values()]
+                if getattr(_worker, 'active', False) or (
+                        not running and len(to_start) == 1):
+                    # Nothing to overlap with, so skip the thread hop. Checks
+                    # nested in a callable always run inline, since they
+                    # could wait forever for a pool thread.
+                    inline, to_submit = to_start[:1], []
+                elif in_atomic_block:
+                    inline = [dynamic_node for dynamic_node in to_start
+                              if _is_thread_sensitive(dynamic_node)][:1]
+                    to_submit = [dynamic_node for dynamic_node in to_start
+                                 if not _is_thread_sensitive(dynamic_node)]
+                else:
+                    inline, to_submit = [], to_start
+                if to_submit:
+                    executor = self._executor or get_executor()
+                    for dynamic_node in to_submit:
+                        future = executor.submit(
+                            _get_roles_set, dynamic_node, kwargs)
+                        running[future] = dynamic_node
+                if inline:
+                    resolved[inline[0]] = inline[0].get_roles_set(**kwargs)
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    resolved[running.pop(future)] = future.result()
+        finally:
+            # The result is known (or failed), so the rest aren't needed.
+            for future in running:
+                future.cancel()
+
+
+async def aevaluate(node, roles, **kwargs):
+    """Async version of ConcurrentPermissionChecker(roles).visit(node).
+
+    The DynamicRolesNodes are awaited as tasks on the running event loop (see
+    DynamicRolesNode.aget_roles_set), and the ones still running when the
+    result is known are cancelled.
+    """
+    resolved = {}
+    evaluator = PartialEvaluator(roles, resolved)
+    running = {}
+    try:
+        while True:
+            value, pending = evaluator.visit(node)
+            if value is not None:
+                return value
+            for dynamic_node in pending:
+                if dynamic_node not in running.values():
+                    task = asyncio.ensure_future(
+                        dynamic_node.aget_roles_set(**kwargs))
+                    running[task] = dynamic_node
+            done, _ = await asyncio.wait(
+                running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                resolved[running.pop(task)] = task.result()
+    finally:
+        for task in running:
+            task.cancel()
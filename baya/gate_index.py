@@ -0,0 +1,246 @@
+"""An index from url names to the Gates protecting them.
+
+Reversing and then resolving a url just to find the Gates on its view costs
+far more than checking the Gates themselves. The GateIndex walks the urlconf
+once, composing the Gates added by requires() on url includes and patterns
+with the Gates on each view, so those lookups become a dict lookup.
+
+The index is built lazily for each urlconf and is keyed on django's cached
+URLResolver, so it is rebuilt after django.urls.clear_url_caches() runs.
+
+The index can also answer "which urls can this user access?" in one pass, see
+accessible_views.
+"""
+from collections import OrderedDict
+
+import django
+from django.urls import get_resolver
+from django.urls import resolve
+from django.urls import reverse
+if django.VERSION[0] == 1:
+    from django.core.urlresolvers import RegexURLResolver as URLResolver
+elif django.VERSION[0] >= 2:
+    from django.urls.resolvers import URLResolver
+
+from .role_sets import RoleDictionary
+from .role_sets import RoleSetCodec
+from .utils import check_gates
+from .utils import get_gates
+from .utils import get_permission_nodes
+from .utils import get_user_roles
+from .visitors import PermissionChecker
+from .visitors import PolicyCompiler
+
+
+class GateIndex(object):
+    """Map url names (including namespaces) to a tuple of Gates.
+
+    The tuple of Gates is ordered outermost first, exactly like
+    baya.utils.get_gates returns for the view that the url resolves to. An
+    empty tuple means the view isn't protected by baya.
+    """
+
+    def __init__(self, resolver=None):
+        self._gates = {}
+        # Names shared by patterns with different Gates, see get_gates.
+        self._ambiguous = set()
+        self._reversed = {}
+        # Names added by get_gates rather than add_patterns.
+        self._looked_up = set()
+        if resolver is not None:
+            self.add_patterns(resolver.url_patterns)
+        # Compiled policies, see _get_policies.
+        self._role_dictionary = RoleDictionary()
+        self._compiler = PolicyCompiler(self._role_dictionary)
+        self._policies = {}
+        self._codec = None
+
+    def add_patterns(self, patterns, namespace=None):
+        """Index a list of url patterns, eg from an admin site's get_urls().
+
+        Args:
+            patterns: A list of URLPatterns and URLResolvers.
+            namespace: The namespace the patterns are included under.
+        """
+        prefix = '%s:' % namespace if namespace else ''
+        self._add_patterns(patterns, prefix, ())
+        self._policies = {}
+
+    def _add_patterns(self, patterns, namespace_prefix, gates):
+        for pattern in patterns:
+            pattern_gates = gates + getattr(pattern, '_gates', ())
+            if isinstance(pattern, URLResolver):
+                prefix = namespace_prefix
+                if pattern.namespace:
+                    prefix = '%s%s:' % (namespace_prefix, pattern.namespace)
+                self._add_patterns(pattern.url_patterns, prefix, pattern_gates)
+            elif pattern.name:
+                name = namespace_prefix + pattern.name
+                pattern_gates += tuple(get_gates(pattern.callback))
+                if self._gates.get(name, pattern_gates) != pattern_gates:
+                    self._ambiguous.add(name)
+                # Like reverse() without args, the last pattern with a given
+                # name wins.
+                self._gates[name] = pattern_gates
+
+    def __contains__(self, name):
+        return name in self._gates
+
+    def __len__(self):
+        return len(self._gates)
+
+    def items(self):
+        return self._gates.items()
+
+    def get_gates(self, name, args=None, kwargs=None, urlconf=None):
+        """Return the tuple of Gates protecting the url called `name`.
+
+        Names which aren't in the index, such as application namespaced names
+        that django has to map to an instance namespace, fall back to
+        resolving the reversed url. So do names shared by several patterns
+        with different Gates, since reverse() picks between them by their
+        args and kwargs. The result is cached when no args or kwargs are
+        needed to reverse the url.
+        """
+        if name in self._ambiguous:
+            if not args and not kwargs and name in self._reversed:
+                return self._reversed[name]
+        elif name in self._gates:
+            return self._gates[name]
+        view_func = resolve(
+            reverse(name, urlconf=urlconf, args=args, kwargs=kwargs),
+            urlconf=urlconf).func
+        gates = tuple(get_gates(view_func))
+        if not args and not kwargs:
+            if name in self._ambiguous:
+                self._reversed[name] = gates
+            else:
+                self._gates[name] = gates
+                self._looked_up.add(name)
+                self._policies = {}
+        return gates
+
+    def _compile(self, permission_nodes):
+        """Compile the permission nodes of a chain of Gates.
+
+        Returns a function of a role bitmask, or None if any of the nodes
+        contain a DynamicRolesNode.
+        """
+        gate_policies = []
+        for nodes in permission_nodes:
+            policies = [self._compiler.visit(node) for node in nodes]
+            if any(policy is None for policy in policies):
+                return None
+            if len(policies) == 1:
+                gate_policies.append(policies[0])
+            else:
+                gate_policies.append(
+                    lambda mask, policies=policies: any(
+                        policy(mask) for policy in policies))
+        return lambda mask: all(policy(mask) for policy in gate_policies)
+
+    def _get_policies(self, permission):
+        """Return a list of (policy, gates, url names) for a permission.
+
+        Url names are grouped by the membership nodes of their Gates, so
+        every distinct policy is compiled and evaluated only once no matter
+        how many urls share it. Unprotected urls are left out, since
+        has_permission denies access to them.
+        """
+        if permission not in self._policies:
+            grouped = OrderedDict()
+            for name, gates in self._gates.items():
+                if not gates:
+                    continue
+                key = tuple(get_permission_nodes(gate, permission)
+                            for gate in gates)
+                grouped.setdefault(key, (gates, []))[1].append(name)
+            self._policies[permission] = [
+                (self._compile(key), gates, frozenset(names))
+                for key, (gates, names) in grouped.items()]
+        return self._policies[permission]
+
+    def get_role_set_codec(self):
+        """Return a RoleSetCodec over every role the urlconf's Gates refer to.
+
+        The dictionary is built once, from the sorted roles of the patterns
+        the index walked, so it's the same in every process running the same
+        urlconf. Urls which get_gates finds later don't change it, and the
+        codec encodes their roles by name.
+        """
+        if self._codec is None:
+            roles = RoleDictionary()
+            compiler = PolicyCompiler(roles)
+            for name, gates in self._gates.items():
+                if name in self._looked_up:
+                    continue
+                for gate in gates:
+                    for node in get_permission_nodes(gate, 'any'):
+                        compiler.visit(node)
+            self._codec = RoleSetCodec(RoleDictionary(roles))
+        return self._codec
+
+    def accessible_views(self, roles, method='get', **kwargs):
+        """Return the set of url names which the roles grant access to.
+
+        This agrees with calling has_permission on every url, but evaluates
+        each distinct policy only once against a bitmask of the roles.
+
+        Args:
+            roles: An iterable of role names, see baya.utils.get_user_roles.
+            method: The permission to check for. One of 'get', 'post', 'any'
+            kwargs: passed to the PermissionChecker.visit method. Urls
+                protected by DynamicRolesNodes are only checked when kwargs
+                (usually request=request) are given, and left out otherwise.
+        """
+        # Compile first, so the role dictionary has every role in it.
+        policies = self._get_policies(method)
+        mask = self._role_dictionary.encode(roles)
+        checker = None
+        accessible = set()
+        for policy, gates, names in policies:
+            if policy is not None:
+                allowed = policy(mask)
+            elif kwargs:
+                if checker is None:
+                    checker = PermissionChecker(roles)
+                allowed = check_gates(gates, checker, method, **kwargs)
+            else:
+                allowed = False
+            if allowed:
+                accessible.update(names)
+        return accessible
+
+
+# Maps urlconf -> (URLResolver, GateIndex)
+_gate_indexes = {}
+
+
+def get_gate_index(urlconf=None):
+    """Return the GateIndex for `urlconf`, defaulting to ROOT_URLCONF."""
+    resolver = get_resolver(urlconf)
+    cached = _gate_indexes.get(urlconf)
+    if cached is None or cached[0] is not resolver:
+        # Either never built, or clear_url_caches() has run since.
+        cached = (resolver, GateIndex(resolver))
+        _gate_indexes[urlconf] = cached
+    return cached[1]
+
+
+def get_role_set_codec(urlconf=None):
+    """Return the RoleSetCodec of the GateIndex for `urlconf`."""
+    return get_gate_index(urlconf).get_role_set_codec()
+
+
+def accessible_views(user, method='get', urlconf=None, **kwargs):
+    """Return the set of url names which `user` may access.
+
+    Args:
+        user: The django User which is being checked for access
+        method: The permission to check for. One of 'get', 'post', 'any'
+        urlconf: The urlconf to check, defaults to ROOT_URLCONF
+        kwargs: passed to the PermissionChecker.visit method, see
+            GateIndex.accessible_views.
+    """
+    return get_gate_index(urlconf).accessible_views(
+        get_user_roles(user), method, **kwargs)
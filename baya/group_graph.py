@@ -0,0 +1,314 @@
+"""An in-process snapshot of the LDAP group tree.
+
+Finding a user's nested groups with membership searches takes a round trip
+per level of the group tree. With the memberOf overlay the user's entry
+already lists its direct groups, so a snapshot of which groups each group is
+a member of is all that's needed to expand them to every (nested) group,
+without asking LDAP again. See baya.group_types.MemberOfGroupOfNamesType.
+
+The snapshot is reloaded every BAYA_GROUP_GRAPH_TTL seconds. In between, with
+BAYA_GROUP_GRAPH_SYNC_INTERVAL set, it's kept up to date by searching for the
+groups whose modifyTimestamp changed since the last sync (see
+GroupGraph.sync), on a background thread. Deleted groups can't be found that
+way, so they stay in the snapshot until it's reloaded.
+"""
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger('baya')
+
+DEFAULT_TTL = 300
+
+# LDAP GeneralizedTime, in UTC.
+GENERALIZED_TIME_FORMAT = '%Y%m%d%H%M%SZ'
+
+
+def _utcnow():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+class GroupGraph(object):
+    """Which groups each group is a member of, and their closures.
+
+    Args:
+        group_infos: (dn, attrs) tuples for every group, as returned by
+            the AUTH_LDAP_GROUP_SEARCH.
+        member_attr: The attribute listing a group's member DNs.
+        synced_at: The (UTC) datetime group_infos were searched for.
+    """
+
+    def __init__(self, group_infos, member_attr='member', synced_at=None):
+        self.member_attr = member_attr
+        self.synced_at = synced_at
+        self._lock = threading.Lock()
+        self._version = 0
+        self._group_infos = {}
+        self._closures = {}
+        for dn, attrs in group_infos:
+            self._group_infos[dn.lower()] = (dn.lower(), attrs)
+        parents = {}
+        for dn, attrs in self._group_infos.values():
+            for member_dn in self._member_groups(attrs):
+                parents.setdefault(member_dn, set()).add(dn)
+        # The sets are replaced rather than changed by update, so closure
+        # can read them without the lock.
+        self._parents = {dn: frozenset(group_dns)
+                         for dn, group_dns in parents.items()}
+
+    @classmethod
+    def load(cls, connection, group_search, member_attr='member',
+             now=_utcnow):
+        """Return a GroupGraph of every group group_search finds."""
+        synced_at = now()
+        return cls(group_search.execute(connection), member_attr, synced_at)
+
+    def __contains__(self, dn):
+        return dn.lower() in self._group_infos
+
+    def __len__(self):
+        return len(self._group_infos)
+
+    def group_info(self, dn):
+        return self._group_infos[dn.lower()]
+
+    def parents(self, dn):
+        """Return the DNs of the groups dn is a direct member of."""
+        return self._parents.get(dn.lower(), frozenset())
+
+    def closure(self, dns):
+        """Return the DNs of dns' groups, and all of the groups they're in.
+
+        DNs which aren't groups in the graph are ignored.
+        """
+        groups = set()
+        for dn in dns:
+            dn = dn.lower()
+            if dn in self._group_infos:
+                groups |= self._closure(dn)
+        return groups
+
+    def _closure(self, dn):
+        closures = self._closures
+        closure = closures.get(dn)
+        if closure is not None:
+            return closure
+        version = self._version
+        closure = {dn}
+        to_visit = [dn]
+        while to_visit:
+            for parent in self._parents.get(to_visit.pop(), ()):
+                if parent in closure:
+                    continue
+                cached = closures.get(parent)
+                if cached is not None:
+                    # Cached closures are complete, no need to walk them.
+                    closure |= cached
+                else:
+                    closure.add(parent)
+                    to_visit.append(parent)
+        closure = frozenset(closure)
+        if version == self._version:
+            # Don't cache a closure an update made stale while we walked.
+            closures[dn] = closure
+        return closure
+
+    def _member_groups(self, attrs):
+        return {member_dn.lower() for member_dn in attrs.get(self.member_attr, [])
+                if member_dn.lower() in self._group_infos}
+
+    def update(self, group_infos):
+        """Add or replace groups.
+
+        Only the closures of the groups below a changed membership are
+        forgotten (and recomputed when they're next needed).
+
+        Returns the set of DNs whose closures changed.
+        """
+        with self._lock:
+            # Closures walked while the parents change aren't cached.
+            self._version += 1
+            old_attrs = {}
+            for dn, attrs in group_infos:
+                dn = dn.lower()
+                if dn not in old_attrs:
+                    old_info = self._group_infos.get(dn)
+                    old_attrs[dn] = old_info and old_info[1]
+                self._group_infos[dn] = (dn, attrs)
+
+            changed = set()
+            for dn, attrs in old_attrs.items():
+                old_members = (self._member_groups(attrs)
+                               if attrs is not None else set())
+                new_members = self._member_groups(self._group_infos[dn][1])
+                for member_dn in old_members - new_members:
+                    self._parents[member_dn] = (
+                        self._parents.get(member_dn, frozenset()) - {dn})
+                for member_dn in new_members - old_members:
+                    self._add_parent(member_dn, dn)
+                changed |= old_members ^ new_members
+
+            # Groups listed as members before they were known weren't linked.
+            new_dns = {dn for dn, attrs in old_attrs.items() if attrs is None}
+            if new_dns:
+                for dn, attrs in self._group_infos.values():
+                    for member_dn in self._member_groups(attrs) & new_dns:
+                        self._add_parent(member_dn, dn)
+                changed |= new_dns
+
+            self._version += 1
+            # _closure adds to the dict without the lock, so copy it first.
+            self._closures = {
+                dn: closure for dn, closure in list(self._closures.items())
+                if not closure & changed}
+            return changed
+
+    def _add_parent(self, dn, parent_dn):
+        self._parents[dn] = self._parents.get(dn, frozenset()) | {parent_dn}
+
+    def sync(self, connection, group_search, now=_utcnow, overlap=60):
+        """Update the graph with the groups modified since synced_at.
+
+        Args:
+            connection: The LDAPObject to search with.
+            group_search: The AUTH_LDAP_GROUP_SEARCH.
+            now: Returns the current (UTC) datetime.
+            overlap: Seconds before synced_at to search from, to allow for
+                clock skew between this host and the LDAP servers.
+        Returns the set of DNs whose closures changed.
+        """
+        if self.synced_at is None:
+            raise ValueError("The graph has never been synced.")
+        started = now()
+        since = self.synced_at - datetime.timedelta(seconds=overlap)
+        search = group_search.search_with_additional_term_string(
+            '(modifyTimestamp>=%s)' % since.strftime(GENERALIZED_TIME_FORMAT))
+        changed = self.update(search.execute(connection))
+        self.synced_at = started
+        return changed
+
+
+class GroupGraphCache(object):
+    """Holds a GroupGraph per group search, reloaded every `ttl` seconds.
+
+    Only one thread loads a graph at a time; the others wait for it. With
+    a `sync_interval`, the graph is also synced that often, on a background
+    thread, while requests carry on with the graph as it is.
+    """
+
+    def __init__(self, ttl=None, sync_interval=None, clock=time.monotonic):
+        self._ttl = ttl
+        self._sync_interval = sync_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> [graph, loaded at, synced at]
+        self._graphs = {}
+        self._syncing = set()
+        self._executor = None
+
+    @property
+    def ttl(self):
+        if self._ttl is not None:
+            return self._ttl
+        return getattr(settings, 'BAYA_GROUP_GRAPH_TTL', DEFAULT_TTL)
+
+    @property
+    def sync_interval(self):
+        if self._sync_interval is not None:
+            return self._sync_interval
+        return getattr(settings, 'BAYA_GROUP_GRAPH_SYNC_INTERVAL', None)
+
+    def get(self, key, load, sync=None):
+        """Return the graph for key, calling load() if it's missing or old.
+
+        If sync is given, it's called with the graph on the background
+        thread when the graph is due a sync. It mustn't use anything
+        belonging to the current request.
+        """
+        with self._lock:
+            entry = self._graphs.get(key)
+            if entry is None or self._clock() - entry[1] >= self.ttl:
+                entry = [load(), self._clock(), self._clock()]
+                self._graphs[key] = entry
+        sync_interval = self.sync_interval
+        if (sync is not None and sync_interval is not None and
+                self._clock() - entry[2] >= sync_interval):
+            self._schedule_sync(key, entry, sync)
+        return entry[0]
+
+    def _schedule_sync(self, key, entry, sync):
+        with self._lock:
+            if key in self._syncing:
+                return
+            self._syncing.add(key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='baya-group-sync')
+        try:
+            self._executor.submit(self._sync, key, entry, sync)
+        except BaseException:
+            with self._lock:
+                self._syncing.discard(key)
+            raise
+
+    def _sync(self, key, entry, sync):
+        try:
+            sync(entry[0])
+            entry[2] = self._clock()
+        except Exception:
+            # The graph is used as it is, and synced again on the next get.
+            logger.exception("Syncing the group graph failed.")
+        finally:
+            with self._lock:
+                self._syncing.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._graphs.clear()
+
+    def shutdown(self, wait=True):
+        """Stop the background thread, after any queued syncs if wait."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+group_graphs = GroupGraphCache()
+
+
+def get_group_graph(connection, group_search, member_attr='member',
+                    sync_connection=None):
+    """Return the process' cached GroupGraph for group_search.
+
+    Args:
+        connection: A callable returning the LDAPObject to load the graph
+            with, so no connection is needed while the cached graph is fresh.
+        sync_connection: A callable returning a new LDAPObject to sync the
+            graph with, on the background thread. It's unbound afterwards.
+            Without it, the graph is only reloaded.
+    """
+    key = (_search_key(group_search), member_attr)
+
+    def sync(graph):
+        sync_ldap = sync_connection()
+        try:
+            graph.sync(sync_ldap, group_search)
+        finally:
+            sync_ldap.unbind_s()
+
+    return group_graphs.get(
+        key,
+        lambda: GroupGraph.load(connection(), group_search, member_attr),
+        sync if sync_connection is not None else None)
+
+
+def _search_key(group_search):
+    if hasattr(group_search, 'searches'):
+        # LDAPSearchUnion
+        return tuple(_search_key(search) for search in group_search.searches)
+    return (group_search.base_dn, group_search.scope, group_search.filterstr)
@@ -0,0 +1,143 @@
+"""Group types for AUTH_LDAP_GROUP_TYPE."""
+from django_auth_ldap.config import NestedMemberDNGroupType
+
+from .group_graph import get_group_graph
+
+
+DEFAULT_CHUNK_SIZE = 100
+
+
+def _service_connection(backend):
+    """Return a new LDAPObject, bound as AUTH_LDAP_BIND_DN."""
+    # Imported here, since the group type is created in the settings, before
+    # the auth models django_auth_ldap.backend imports are ready.
+    from django_auth_ldap.backend import _LDAPUser
+    return _LDAPUser(backend, username='').connection
+
+
+class BatchedNestedMemberDNGroupType(NestedMemberDNGroupType):
+    """A NestedMemberDNGroupType which splits wide levels into chunks.
+
+    Like NestedMemberDNGroupType, the user's groups are expanded breadth
+    first, with a `(|(member=dn1)(member=dn2)...)` search for the groups found
+    on the previous level. The only difference is that levels with more than
+    `chunk_size` groups are split into several searches, to keep the filters
+    within the server's limits. The chunks are sent at once and then
+    collected, so each level still takes one round trip.
+
+    Unlike LDAPSearchUnion, which logs LDAP errors and carries on, an error
+    in any chunk is raised, so a failed search can't drop groups.
+    """
+
+    def __init__(self, member_attr, name_attr='cn',
+                 chunk_size=DEFAULT_CHUNK_SIZE):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1.")
+        self.chunk_size = chunk_size
+        super(BatchedNestedMemberDNGroupType, self).__init__(
+            member_attr, name_attr)
+
+    def user_groups(self, ldap_user, group_search):
+        if ldap_user.dn is None:
+            return []
+        group_info_map = {}
+        member_dns = {ldap_user.dn.lower()}
+        searched_dns = set()
+        while member_dns:
+            group_infos = self.find_groups_with_any_member(
+                member_dns, group_search, ldap_user.connection)
+            searched_dns |= member_dns
+            new_group_dns = set()
+            for group_info in group_infos:
+                group_dn = group_info[0].lower()
+                group_info_map[group_dn] = group_info
+                new_group_dns.add(group_dn)
+            # Never search with the same DN twice, in case of cycles.
+            member_dns = new_group_dns - searched_dns
+        return list(group_info_map.values())
+
+    def find_groups_with_any_member(self, member_dn_set, group_search,
+                                    connection):
+        member_dns = sorted(member_dn_set)
+        searches = []
+        for start in range(0, len(member_dns), self.chunk_size):
+            terms = ''.join(
+                '(%s=%s)' % (self.member_attr,
+                             self.ldap.filter.escape_filter_chars(dn))
+                for dn in member_dns[start:start + self.chunk_size])
+            search = group_search.search_with_additional_term_string(
+                '(|%s)' % terms)
+            # Flatten an AUTH_LDAP_GROUP_SEARCH LDAPSearchUnion.
+            searches.extend(getattr(search, 'searches', [search]))
+        group_infos = {}
+        pending = []
+        try:
+            # Start every search before waiting for any results.
+            for search in searches:
+                pending.append((search, connection.search(
+                    search.base_dn, search.scope, search.filterstr,
+                    search.attrlist)))
+            while pending:
+                search, msgid = pending.pop(0)
+                kind, results = connection.result(msgid)
+                if kind not in (self.ldap.RES_SEARCH_ENTRY,
+                                self.ldap.RES_SEARCH_RESULT):
+                    results = []
+                group_infos.update(search._process_results(results))
+        finally:
+            # Don't leave the other chunks' results on the connection.
+            for _, msgid in pending:
+                connection.abandon(msgid)
+        return list(group_infos.items())
+
+
+class BatchedNestedGroupOfNamesType(BatchedNestedMemberDNGroupType):
+    """BatchedNestedMemberDNGroupType for groups of class groupOfNames.
+
+    Use this instead of django_auth_ldap.config.NestedGroupOfNamesType:
+
+        AUTH_LDAP_GROUP_TYPE = BatchedNestedGroupOfNamesType(chunk_size=100)
+    """
+
+    def __init__(self, name_attr='cn', chunk_size=DEFAULT_CHUNK_SIZE):
+        super(BatchedNestedGroupOfNamesType, self).__init__(
+            'member', name_attr, chunk_size)
+
+
+class MemberOfGroupOfNamesType(BatchedNestedGroupOfNamesType):
+    """A nested groupOfNames type which reads the user's memberOf.
+
+    With the memberOf overlay, the user's entry (which django-auth-ldap has
+    already fetched to find and bind the user) lists its direct groups. This
+    expands them to their nested groups with the process' GroupGraph (see
+    baya.group_graph), so once the graph is loaded, finding a user's groups
+    doesn't need any more LDAP searches.
+
+    The user search has to return the memberOf attribute, which OpenLDAP only
+    does when asked:
+
+        AUTH_LDAP_USER_SEARCH = LDAPSearch(
+            'ou=People,dc=example,dc=com', ldap.SCOPE_SUBTREE, '(uid=%(user)s)',
+            attrlist=['*', 'memberOf'])
+        AUTH_LDAP_GROUP_TYPE = MemberOfGroupOfNamesType()
+
+    Users without a memberOf attribute have their groups searched for like
+    BatchedNestedGroupOfNamesType.
+    """
+
+    def __init__(self, name_attr='cn', chunk_size=DEFAULT_CHUNK_SIZE,
+                 member_of_attr='memberOf'):
+        self.member_of_attr = member_of_attr
+        super(MemberOfGroupOfNamesType, self).__init__(name_attr, chunk_size)
+
+    def user_groups(self, ldap_user, group_search):
+        attrs = ldap_user.attrs
+        direct_group_dns = (attrs or {}).get(self.member_of_attr)
+        if direct_group_dns is None:
+            return super(MemberOfGroupOfNamesType, self).user_groups(
+                ldap_user, group_search)
+        graph = get_group_graph(
+            lambda: ldap_user.connection, group_search, self.member_attr,
+            sync_connection=lambda: _service_connection(ldap_user.backend))
+        return [graph.group_info(group_dn)
+                for group_dn in graph.closure(direct_group_dns)]
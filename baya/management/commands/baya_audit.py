@@ -0,0 +1,200 @@
+"""Stream which groups (and optionally users) can access every baya view.
+
+    ./manage.py baya_audit --format jsonl > audit.jsonl
+    ./manage.py baya_audit --users-file users.txt --processes 8 > audit.csv
+
+Each row describes one (view, method): the view's url name, the HTTP method
+class ('get' or 'post'), the composed membership expression protecting it,
+and the minimal sets of groups which satisfy that expression (see
+baya.cover). With a user list, each row also lists the users allowed in.
+
+Rows are written as they're computed, so memory doesn't grow with the number
+of views. Looking up users' groups in LDAP is the slow part of a user audit,
+so it can be fanned out over a process pool with --processes.
+"""
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from operator import and_
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from baya.admin.sites import _admin_registry
+from baya.backend import NestedLDAPGroupsBackend
+from baya.cover import DEFAULT_MAX_TERMS
+from baya.cover import minimal_group_sets
+from baya.gate_index import GateIndex
+from baya.gate_index import get_gate_index
+from baya.utils import get_permission_nodes
+from baya.utils import group_names
+from baya.visitors import ExpressionWriter
+from baya.visitors import iter_dynamic_roles_nodes
+
+DYNAMIC = 'dynamic'
+TOO_COMPLEX = 'too complex'
+UNGATED = 'ungated'
+
+
+def _resolve_role_sets(usernames):
+    """Return [(username, sorted roles)], looking the groups up in LDAP.
+
+    This runs in the worker processes, so it must be a module level function.
+    """
+    backend = NestedLDAPGroupsBackend()
+    return [(username, sorted(group_names(backend.get_group_dns(username))))
+            for username in usernames]
+
+
+def _chunks(items, chunk_size):
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+def _format_group_set(group_set):
+    """Format a group set row entry like 'a & b & ~c', or '*' if it's empty.
+    """
+    groups = (group_set['requires'] +
+              ['~%s' % group for group in group_set['excludes']])
+    return ' & '.join(groups) or '*'
+
+
+class Command(BaseCommand):
+    help = ("Stream the groups, and optionally the users, which can access "
+            "every view protected by baya.")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'], default='csv',
+            help="The output format. Defaults to csv.")
+        parser.add_argument(
+            '--method', choices=['get', 'post'], action='append',
+            dest='methods',
+            help="Only audit this method class. May be repeated. Defaults "
+                 "to both get and post.")
+        parser.add_argument(
+            '--users', nargs='+', default=[],
+            help="Also list which of these users can access each view.")
+        parser.add_argument(
+            '--users-file',
+            help="A file with one username per line, added to --users.")
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help="The number of processes to look up users' groups with. "
+                 "Defaults to 1, which doesn't start a process pool.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=100,
+            help="The number of users each process looks up at a time.")
+        parser.add_argument(
+            '--max-terms', type=int, default=DEFAULT_MAX_TERMS,
+            help="Give up on listing the groups for expressions which need "
+                 "more than this many terms. See baya.cover.")
+        parser.add_argument(
+            '--urlconf',
+            help="The urlconf to audit. Defaults to ROOT_URLCONF.")
+
+    def handle(self, *args, **options):
+        methods = options['methods'] or ['get', 'post']
+        usernames = list(options['users'])
+        if options['users_file']:
+            with open(options['users_file']) as users_file:
+                usernames.extend(
+                    line.strip() for line in users_file if line.strip())
+
+        audit = None
+        if usernames:
+            try:
+                from baya.audit import PermissionAudit
+                audit = PermissionAudit(self._get_role_sets(
+                    usernames, options['processes'], options['chunk_size']))
+            except ImportError:
+                raise CommandError(
+                    "Auditing users requires numpy. Install it with "
+                    "`pip install baya[audit]`.")
+
+        fields = ['view', 'method', 'expression', 'allowed_groups']
+        if audit is not None:
+            fields.append('allowed_users')
+        if options['format'] == 'csv':
+            writer = csv.writer(self.stdout, lineterminator='\n')
+            writer.writerow(fields)
+            write_row = lambda row: writer.writerow(  # noqa: E731
+                [self._csv_value(row[field]) for field in fields])
+        else:
+            write_row = lambda row: self.stdout.write(  # noqa: E731
+                json.dumps(row, sort_keys=True))
+
+        for name, gates in self._iter_views(options['urlconf']):
+            for method in methods:
+                write_row(self._get_row(
+                    name, gates, method, options['max_terms'], audit))
+
+    def _get_role_sets(self, usernames, processes, chunk_size):
+        chunks = _chunks(usernames, chunk_size)
+        role_sets = []
+        if processes <= 1:
+            for result in map(_resolve_role_sets, chunks):
+                role_sets.extend(result)
+        else:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                for result in executor.map(_resolve_role_sets, chunks):
+                    role_sets.extend(result)
+        return role_sets
+
+    def _iter_views(self, urlconf):
+        """Yield (url name, gates) for the urlconf and unmounted admin sites.
+        """
+        index = get_gate_index(urlconf)
+        mounted = set()
+        for name, _ in index.items():
+            mounted.update(name.split(':')[:-1])
+        for name, gates in sorted(index.items()):
+            yield name, gates
+
+        for site in sorted(_admin_registry, key=lambda site: site.name):
+            if site.name in mounted:
+                continue
+            site_index = GateIndex()
+            site_index.add_patterns(site.get_urls(), site.name)
+            for name, gates in sorted(site_index.items()):
+                yield name, gates
+
+    def _get_row(self, name, gates, method, max_terms, audit):
+        row = {'view': name, 'method': method}
+        if not gates:
+            row['expression'] = UNGATED
+            row['allowed_groups'] = []
+        else:
+            node = reduce(and_, [
+                get_permission_nodes(gate, method)[0] for gate in gates])
+            row['expression'] = ExpressionWriter().visit(node)
+            if any(True for _ in iter_dynamic_roles_nodes(node)):
+                row['allowed_groups'] = DYNAMIC
+            else:
+                try:
+                    row['allowed_groups'] = [
+                        {'requires': sorted(group_set.requires),
+                         'excludes': sorted(group_set.excludes)}
+                        for group_set in minimal_group_sets(node, max_terms)]
+                except ValueError:
+                    row['allowed_groups'] = TOO_COMPLEX
+
+        if audit is not None:
+            column = audit.check_gates(gates, method)
+            if column is None:
+                row['allowed_users'] = DYNAMIC
+            else:
+                allowed = audit.matrix.unpack(column)
+                row['allowed_users'] = [
+                    user for user, is_allowed
+                    in zip(audit.matrix.users, allowed) if is_allowed]
+        return row
+
+    def _csv_value(self, value):
+        if isinstance(value, list):
+            return '; '.join(
+                _format_group_set(item) if isinstance(item, dict)
+                else item
+                for item in value)
+        return value
@@ -1,9 +1,20 @@
 """Arbitrary expressions evaluated as an AST."""
+import asyncio
 from operator import and_
 from operator import not_
 from operator import or_
 from operator import xor
 
+try:
+    # Also recognizes functions marked with markcoroutinefunction.
+    from asgiref.sync import iscoroutinefunction
+except ImportError:
+    from asyncio import iscoroutinefunction
+
+
+# The request attribute DynamicRolesNode memoizes its callables' results in.
+DYNAMIC_ROLES_MEMO = '_baya_dynamic_roles'
+
 
 # Abstract base classes for nodes.
 
@@ -136,6 +147,10 @@ class DynamicRolesNode(RolesNode):
             # The user can only edit posts in their authorized category.
             ...
 
+    For this per-object pattern, baya.dynamic_roles.ModelFieldGroupFormatter
+    builds the callable from the model field, and can also filter listing
+    querysets in a single query rather than checking each object.
+
     The callable should take kwargs. Note that for Django requests, the
     kwarg `request` will be populated with the current request. The callable
     should return a set of group names.
@@ -143,19 +158,103 @@ class DynamicRolesNode(RolesNode):
     Note that DynamicRolesNodes are not compatible with Django admin panels
     because the request is not available to the auth backend when checking
     permissions.
+
+    When a request is passed in, each callable's result is memoized on the
+    request, so a callable shared by several gates or template checks only
+    runs once per request (and set of kwargs). Set a `memoize = False`
+    attribute on callables which must run on every check. DynamicRoleCallables
+    can also be cached across requests, see baya.dynamic_roles.
+
+    Callables may also be coroutine functions. Async views (see
+    Gate.aallow_or_deny) await them concurrently, and run sync callables
+    with sync_to_async. Sync views run async callables with async_to_sync.
+    sync_to_async runs sync callables one at a time on the thread sensitive
+    executor, which the ORM needs. Set a `thread_sensitive = False` attribute
+    on sync callables which don't use the ORM, so they run concurrently.
     """
     def __init__(self, *roles_callables):
         self._roles_set = frozenset(roles_callables)
 
+    def _get_memo(self, _callable, kwargs):
+        """Return the request's memo dict and key for a call, or (None, None).
+        """
+        request = kwargs.get('request')
+        if request is None or not getattr(_callable, 'memoize', True):
+            return None, None
+        try:
+            key = (_callable, frozenset(kwargs.items()))
+            hash(key)
+            memo = request.__dict__.setdefault(DYNAMIC_ROLES_MEMO, {})
+        except (AttributeError, TypeError):
+            # Unhashable kwargs, or a request we can't annotate.
+            return None, None
+        return memo, key
+
+    @staticmethod
+    def _is_async(_callable):
+        return (iscoroutinefunction(_callable) or
+                iscoroutinefunction(getattr(_callable, '__call__', None)))
+
+    def _call(self, _callable, kwargs):
+        if self._is_async(_callable):
+            from asgiref.sync import async_to_sync
+            return async_to_sync(self._acall)(_callable, kwargs)
+        from .dynamic_roles import DynamicRoleCallable
+        if isinstance(_callable, DynamicRoleCallable):
+            return _callable.get_cached_roles(**kwargs)
+        return _callable(**kwargs)
+
+    async def _acall(self, _callable, kwargs):
+        if self._is_async(_callable):
+            from .dynamic_roles import DynamicRoleCallable
+            if isinstance(_callable, DynamicRoleCallable):
+                return await _callable.aget_cached_roles(**kwargs)
+            return await _callable(**kwargs)
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(
+            self._call,
+            thread_sensitive=getattr(_callable, 'thread_sensitive', True),
+        )(_callable, kwargs)
+
+    @staticmethod
+    def _check_result(result, memo, key):
+        if not isinstance(result, set):
+            raise RuntimeError("The callable must return a set.")
+        if memo is not None:
+            memo[key] = result
+        return result
+
     def get_roles_set(self, **kwargs):
         roles = set()
         for _callable in self._roles_set:
-            result = _callable(**kwargs)
-            if not isinstance(result, set):
-                raise RuntimeError("The callable must return a set.")
+            memo, key = self._get_memo(_callable, kwargs)
+            if memo is not None and key in memo:
+                result = memo[key]
+            else:
+                result = self._check_result(
+                    self._call(_callable, kwargs), memo, key)
             roles |= result
         return roles
 
+    async def aget_roles_set(self, **kwargs):
+        """Async version of get_roles_set.
+
+        The callables which aren't memoized yet are awaited concurrently.
+        """
+        roles = set()
+        pending = []
+        for _callable in self._roles_set:
+            memo, key = self._get_memo(_callable, kwargs)
+            if memo is not None and key in memo:
+                roles |= memo[key]
+            else:
+                pending.append((_callable, memo, key))
+        results = await asyncio.gather(*[
+            self._acall(_callable, kwargs) for _callable, _, _ in pending])
+        for (_callable, memo, key), result in zip(pending, results):
+            roles |= self._check_result(result, memo, key)
+        return roles
+
     def __str__(self):
         return '{%s}' % self._roles_set
 
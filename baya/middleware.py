@@ -0,0 +1,123 @@
+"""Keep a signed snapshot of the user's roles in the session.
+
+Add SessionRolesMiddleware after django's AuthenticationMiddleware:
+
+    MIDDLEWARE = [
+        ...
+        'django.contrib.auth.middleware.AuthenticationMiddleware',
+        'baya.middleware.SessionRolesMiddleware',
+    ]
+
+When a user logs in, their roles are signed and stored in the session. On
+later requests the middleware checks the signature and puts the roles on
+request.user, where get_user_roles finds them, so the user's groups don't
+have to be looked up in LDAP. After BAYA_SESSION_ROLES_MAX_AGE seconds
+(default 300) the snapshot is dropped, and the next request that looks the
+roles up stores a new one.
+
+The roles are stored with the RoleSetCodec of the root urlconf's GateIndex.
+Snapshots made before the Gates' roles changed can't be decoded, and are
+dropped too.
+"""
+import base64
+
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.contrib.auth.signals import user_logged_in
+from django.core import signing
+from django.utils.deprecation import MiddlewareMixin
+
+from .gate_index import get_role_set_codec
+from .utils import get_user_roles
+
+
+SESSION_ROLES_KEY = '_baya_roles'
+SALT = 'baya.middleware.SessionRolesMiddleware'
+DEFAULT_MAX_AGE = 300
+
+
+def get_max_age():
+    return getattr(settings, 'BAYA_SESSION_ROLES_MAX_AGE', DEFAULT_MAX_AGE)
+
+
+def dumps_roles(user, roles):
+    """Return the signed snapshot of a user's roles.
+
+    Roles in the codec's dictionary are encoded with it, and the rest (most
+    of a user's LDAP groups, usually) are listed by name, where compression
+    does much better than on the encoded overflow.
+    """
+    codec = get_role_set_codec()
+    roles = {role.lower() for role in roles}
+    other = sorted(role for role in roles if role not in codec.role_dictionary)
+    encoded = base64.urlsafe_b64encode(codec.encode(roles.difference(other)))
+    return signing.dumps(
+        {'user': str(user.pk), 'roles': encoded.decode('ascii'),
+         'other': other},
+        salt=SALT, compress=True)
+
+
+def loads_roles(user, value, max_age=None):
+    """Return the roles in a snapshot made by dumps_roles.
+
+    Returns None if the snapshot is for another user, it's expired or been
+    tampered with, or the Gates' roles have changed since it was made.
+    """
+    if max_age is None:
+        max_age = get_max_age()
+    try:
+        data = signing.loads(value, salt=SALT, max_age=max_age)
+    except signing.BadSignature:
+        return None
+    if data.get('user') != str(user.pk):
+        return None
+    try:
+        return get_role_set_codec().decode(
+            base64.urlsafe_b64decode(data['roles'].encode('ascii'))
+        ).union(data.get('other', ()))
+    except ValueError:
+        return None
+
+
+def _groups_loaded(user):
+    groups = getattr(getattr(user, 'ldap_user', None), '_groups', None)
+    return getattr(groups, '_group_dns', None) is not None
+
+
+def store_session_roles(sender, request, user, **kwargs):
+    """user_logged_in receiver which stores the user's roles."""
+    if (getattr(request, 'session', None) is None or
+            not hasattr(user, 'ldap_user')):
+        return
+    request.session[SESSION_ROLES_KEY] = dumps_roles(
+        user, get_user_roles(user))
+
+
+user_logged_in.connect(
+    store_session_roles, dispatch_uid='baya.middleware.store_session_roles')
+
+
+class SessionRolesMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        session = request.session
+        if SESSION_KEY not in session:
+            # Nobody's logged in, so there's no need to load the user.
+            return
+        value = session.get(SESSION_ROLES_KEY)
+        user = request.user
+        if value is not None:
+            roles = loads_roles(user, value)
+            if roles is not None:
+                user._baya_roles = roles
+                return
+            del session[SESSION_ROLES_KEY]
+        request._baya_store_roles = True
+
+    def process_response(self, request, response):
+        if getattr(request, '_baya_store_roles', False):
+            user = request.user
+            # Only store roles this request had to look up anyway.
+            if _groups_loaded(user) and hasattr(request, 'session'):
+                request.session[SESSION_ROLES_KEY] = dumps_roles(
+                    user, get_user_roles(user))
+        return response
@@ -57,7 +57,8 @@ def mock_ldap_directory(
         bind_password=None,
         extra_users=None,
         group_lineage=None,
-        default_password=None):
+        default_password=None,
+        member_of_dns=False):
     """Get a directory for use with MockLdap.
 
     Args:
@@ -71,6 +72,9 @@ def mock_ldap_directory(
             establish a group hierarchy.
         default_password: Set the password for every user to
             `default_password`. Defaults to 'password'.
+        member_of_dns: List the DNs of users' groups in their memberOf
+            attribute, like the memberOf overlay, rather than the group
+            names.
     Returns a dict.
     """
     extra_users = extra_users or []
@@ -102,6 +106,8 @@ def mock_ldap_directory(
 
     # Create a person for every user, which includes that user's groups
     for user, groups in users_to_groups.items():
+        if member_of_dns:
+            groups = [group_dn(group_name, ldap_dc) for group_name in groups]
         all_users.append(person(user, groups, ldap_dc, default_password))
 
     # Now we need to build groups for every group we know about
@@ -7,6 +7,8 @@ if sys.version_info[:2] >= (3, 10):
 
 import django
 from django.conf import settings
+from django.utils.functional import LazyObject
+from django.utils.functional import empty
 from django.contrib.admin.options import BaseModelAdmin
 from django.contrib.admin.options import InlineModelAdmin
 from django.core.exceptions import PermissionDenied
@@ -18,18 +20,41 @@ elif django.VERSION[0] >= 2:
     from django.urls.resolvers import URLResolver
 import six
 
+from . import evaluation
 from .membership import BaseNode
+from .membership import iscoroutinefunction
 from .membership import ValueNode
 from .membership import RolesNode
-from .utils import group_names
+from .role_sets import RoleDictionary
+from .utils import aget_user_roles
+from .utils import get_permission_nodes
+from .utils import get_user_roles
 from .utils import user_in_group
 from .visitors import ExpressionWriter
+from .visitors import PermissionChecker
+from .visitors import PolicyCompiler
+from .visitors import aresolve_dynamic_roles
 
 
 DENY_ALL = ValueNode(False)
 ALLOW_ALL = ValueNode(True)
 
 
+async def _aget_user(request):
+    """Return request.user without a sync database query in async code."""
+    user = request.user
+    if isinstance(user, LazyObject):
+        if user._wrapped is not empty:
+            return user._wrapped
+        if hasattr(request, 'auser'):
+            # Django >= 5.0
+            return await request.auser()
+        from asgiref.sync import sync_to_async
+        await sync_to_async(user._setup)()
+        return user._wrapped
+    return user
+
+
 class Gate(object):
     """Track the groups that a view requires.
 
@@ -115,6 +140,80 @@ class Gate(object):
         return (self.user_has_get_permission(user) or
                 self.user_has_post_permission(user))
 
+    def filter_users(self, users_or_role_sets, method='get',
+                     role_dictionary=None, **kwargs):
+        """Return the users, or role sets, which have permission.
+
+        This is much cheaper than calling user_has_get_permission for every
+        user, since each distinct role set is only evaluated once, against
+        the gate's membership nodes compiled by visitors.PolicyCompiler.
+
+        Args:
+            users_or_role_sets: An iterable of django Users, iterables of role
+                names, or role bitmasks encoded by `role_dictionary`, in any
+                mix.
+            method: The permission to check for. One of 'get', 'post', 'any'
+            role_dictionary: The baya.role_sets.RoleDictionary which encoded
+                the bitmasks. It must contain every role in the gate's
+                nodes, or bitmasks raise a ValueError, since they can't
+                tell whether a user is in the missing roles.
+            kwargs: passed to the PermissionChecker.visit method, for nodes
+                containing DynamicRolesNodes.
+        Returns a list of the allowed items, in their original order.
+        """
+        nodes = get_permission_nodes(self, method)
+        can_decode = role_dictionary is not None
+        if role_dictionary is None:
+            role_dictionary = RoleDictionary()
+            known_roles = 0
+        else:
+            # Compile against a copy, so roles the gate adds can be found.
+            known_roles = len(role_dictionary)
+            role_dictionary = role_dictionary.copy()
+        compiler = PolicyCompiler(role_dictionary)
+        policies = [compiler.visit(node) for node in nodes]
+        missing_roles = list(role_dictionary)[known_roles:]
+
+        def check(roles):
+            if isinstance(roles, six.integer_types):
+                mask = roles
+                roles = role_dictionary.decode(mask)
+            else:
+                mask = role_dictionary.encode(roles)
+            checker = PermissionChecker(roles)
+            return any(
+                policy(mask) if policy is not None
+                else checker.visit(node, **kwargs)
+                for node, policy in zip(nodes, policies))
+
+        results = {}
+        allowed = []
+        for item in users_or_role_sets:
+            if isinstance(item, six.integer_types):
+                if not can_decode:
+                    raise ValueError(
+                        "A role_dictionary is required to check role "
+                        "bitmasks.")
+                if missing_roles:
+                    raise ValueError(
+                        "The role_dictionary is missing the roles %s, so "
+                        "role bitmasks can't be checked."
+                        % ', '.join(sorted(missing_roles)))
+                key = item
+            elif isinstance(item, six.string_types):
+                raise TypeError(
+                    "Role sets must be iterables of role names, not the "
+                    "string %r." % item)
+            elif isinstance(item, collections.abc.Iterable):
+                key = frozenset(role.lower() for role in item)
+            else:
+                key = frozenset(get_user_roles(item))
+            if key not in results:
+                results[key] = check(key)
+            if results[key]:
+                allowed.append(item)
+        return allowed
+
     def get_membership_node(self, request):
         if request.method in self.GET_METHODS:
             return self.get_requires
@@ -122,11 +221,15 @@ class Gate(object):
             return self.post_requires
 
     def get_permissions_required_data(self, request):
-        user_groups = []
+        user_roles = set()
+        if hasattr(request, 'user'):
+            user_roles = get_user_roles(request.user)
+        return self._get_permissions_required_data(request, user_roles)
+
+    def _get_permissions_required_data(self, request, user_roles):
+        user_groups = sorted(user_roles)
         user_groups_str = "{}"
-        if hasattr(request, 'user') and hasattr(request.user, 'ldap_user'):
-            user_groups = sorted(
-                group_names(request.user.ldap_user.group_dns))
+        if user_groups:
             user_groups_str = "{%s}" % ", ".join(
                 str(el) for el in user_groups)
         data = {
@@ -146,7 +249,6 @@ class Gate(object):
         These weird semantics are so you can do:
         return allow_or_deny(request) or HttpResponse(...)
         """
-        from django.contrib.auth.views import redirect_to_login
         # Annotate request with some baya information
         request.baya_requires = self.get_permissions_required_data(request)
         # Set BAYA_ALLOW_ALL while testing in development to disable
@@ -162,10 +264,42 @@ class Gate(object):
         elif (request.method in self.GET_METHODS and
                 self.has_get_permission(request)):
             return None
+        return self._deny(request, request.user)
 
+    async def aallow_or_deny(self, request):
+        """Async version of allow_or_deny, for async views.
+
+        The dynamic roles callables are awaited concurrently (see
+        DynamicRolesNode), and the user and its groups are only loaded in a
+        thread if they aren't loaded already.
+        """
+        user = await _aget_user(request)
+        user_roles = await aget_user_roles(user)
+        request.baya_requires = self._get_permissions_required_data(
+            request, user_roles)
+        if getattr(settings, 'BAYA_ALLOW_ALL', False):
+            return None
+
+        node = self.get_membership_node(request)
+        if node is not None:
+            if evaluation.is_enabled():
+                allowed = await evaluation.aevaluate(
+                    node, user_roles, request=request)
+            else:
+                resolved = await aresolve_dynamic_roles(node, request=request)
+                allowed = PermissionChecker(
+                    user_roles, resolved=resolved).visit(node, request=request)
+            if allowed:
+                return None
+        return self._deny(request, user)
+
+    def _deny(self, request, user):
+        """Redirect unauthenticated users to login, or raise PermissionDenied.
+        """
+        from django.contrib.auth.views import redirect_to_login
         is_authenticated = (
-            request.user.is_authenticated() if django.VERSION[:2] < (1, 10)
-            else request.user.is_authenticated)
+            user.is_authenticated() if django.VERSION[:2] < (1, 10)
+            else user.is_authenticated)
         if not is_authenticated:
             path = request.get_full_path()
             return redirect_to_login(path, self.login_url)
@@ -174,7 +308,7 @@ class Gate(object):
             "User {user} does not have permission to {method} to this "
             "resource. Groups {groups} are required, but {user} only has "
             "{user_groups}").format(
-                user=request.user,
+                user=user,
                 method=request.method,
                 groups=request.baya_requires['requires_groups'],
                 user_groups=request.baya_requires['user_groups'])
@@ -268,8 +402,12 @@ class requires(object):
         """Decorate a view method.
 
         This is pretty simple - just attach a Gate as a `_gate` property
-        to the function and then wrap it in the method dispatcher.
+        to the function and then wrap it in the method dispatcher. Async
+        views get an async dispatcher, see Gate.aallow_or_deny.
         """
+        if iscoroutinefunction(fn):
+            return self._decorate_async_method(fn)
+
         @functools.wraps(fn)
         def dispatcher(*args, **kwargs):
             largs = list(args)
@@ -283,6 +421,22 @@ class requires(object):
         dispatcher._gate = self.gate
         return dispatcher
 
+    def _decorate_async_method(self, fn):
+        # Like dispatcher, this must only close over fn and self, in that
+        # order, for utils.get_gates.
+        @functools.wraps(fn)
+        async def async_dispatcher(*args, **kwargs):
+            largs = list(args)
+            if isinstance(largs[0], BaseModelAdmin):
+                func = functools.partial(fn, largs.pop(0))
+            else:
+                func = fn
+            request = largs.pop(0)
+            return (await self.gate.aallow_or_deny(request) or
+                    await func(request, *largs, **kwargs))
+        async_dispatcher._gate = self.gate
+        return async_dispatcher
+
     def decorate_url_pattern(self, pattern, *args, **kwargs):
         """Decorate a RegexURLPattern or RegexURLResolver.
 
@@ -291,7 +445,9 @@ class requires(object):
                 django.core.urlresolvers
 
         This decorates the callback for a url after it gets resolved with
-        self.decorate_method.
+        self.decorate_method. The gates are also recorded, outermost first,
+        in a `_gates` property on the pattern so they can be found without
+        resolving a url (see baya.gate_index).
         """
         resolve_fn = pattern.resolve
 
@@ -303,6 +459,7 @@ class requires(object):
                     result.func, *args, **kwargs)
             return result
         pattern.resolve = patch_resolve
+        pattern._gates = (self.gate,) + getattr(pattern, '_gates', ())
         return pattern
 
     def decorate_admin(self, cls, *args, **kwargs):
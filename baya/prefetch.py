@@ -0,0 +1,154 @@
+"""Look up the roles of many users at once, for batch jobs.
+
+Checking permissions for each of many users, say to send a report to
+everyone who can see it, normally costs a user search and a nested group
+lookup per user. prefetch_role_sets reads the users' memberOf attributes
+with one search per `chunk_size` users instead, and expands them with the
+process' GroupGraph (see baya.group_graph):
+
+    role_sets = prefetch_role_sets(usernames)
+    allowed = gate.filter_users(role_sets.values())
+    if user_in_group(role_sets['alice'], 'billing'):
+        ...
+
+This needs the memberOf overlay, and an AUTH_LDAP_USER_SEARCH whose filter
+matches the username with a single `(attr=%(user)s)` term. Otherwise, and
+for users the bulk searches don't find or who have no memberOf, the roles
+are looked up one user at a time.
+"""
+import re
+
+from .utils import group_names
+
+
+DEFAULT_CHUNK_SIZE = 100
+
+_USER_TERM = re.compile(r'\(([\w;-]+)=%\(user\)s\)')
+
+
+def _lower_keys(attrs):
+    return {name.lower(): values for name, values in attrs.items()}
+
+
+def _user_attr(user_search):
+    """Return the attribute user_search matches the username with."""
+    filterstrs = {search.filterstr for search in
+                  getattr(user_search, 'searches', [user_search])}
+    attrs = {tuple(_USER_TERM.findall(filterstr)) for filterstr in filterstrs}
+    if len(attrs) != 1:
+        return None
+    attr = attrs.pop()
+    return attr[0] if len(attr) == 1 else None
+
+
+def _search_member_of(connection, user_search, user_attr, ldap_usernames,
+                      member_of_attr):
+    """Return {lowercased ldap username: memberOf DNs} for the users found.
+
+    The users are found with one search, OR-ing user_search's filter for
+    each of them. Users without a memberOf attribute are left out.
+    """
+    from django_auth_ldap.config import LDAPSearch
+    from django_auth_ldap.config import LDAPSearchUnion
+    from ldap.filter import escape_filter_chars
+    searches = []
+    for search in getattr(user_search, 'searches', [user_search]):
+        filterstr = '(|%s)' % ''.join(
+            search.filterstr % {'user': escape_filter_chars(username)}
+            for username in ldap_usernames)
+        # LDAPSearch.execute %-formats the filter again.
+        searches.append(LDAPSearch(
+            search.base_dn, search.scope, filterstr.replace('%', '%%'),
+            attrlist=[user_attr, member_of_attr]))
+    if len(searches) == 1:
+        results = searches[0].execute(connection)
+    else:
+        results = LDAPSearchUnion(*searches).execute(connection)
+    wanted = {username.lower() for username in ldap_usernames}
+    member_of = {}
+    for _, attrs in results:
+        attrs = _lower_keys(attrs)
+        if member_of_attr.lower() not in attrs:
+            continue
+        for value in attrs.get(user_attr.lower(), []):
+            if value.lower() in wanted:
+                member_of[value.lower()] = attrs[member_of_attr.lower()]
+    return member_of
+
+
+def prefetch_role_sets(usernames, backend=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                       member_of_attr='memberOf'):
+    """Return {username: frozenset of (lowercased) role names}.
+
+    The role sets can be passed to Gate.filter_users, and to
+    baya.utils.user_in_group and has_permission in place of a user.
+
+    Args:
+        usernames: An iterable of django usernames.
+        backend: The NestedLDAPGroupsBackend (or LDAPBackend) to read the
+            LDAP settings and connect with. Defaults to a new
+            NestedLDAPGroupsBackend.
+        chunk_size: The most users to find with one search.
+        member_of_attr: The attribute listing a user's direct groups.
+    """
+    from django_auth_ldap.backend import _LDAPUser
+    from .backend import NestedLDAPGroupsBackend
+    from .group_graph import get_group_graph
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1.")
+    if backend is None:
+        backend = NestedLDAPGroupsBackend()
+    ldap_settings = backend.settings
+    ldap_usernames = {username: backend.django_to_ldap_username(username)
+                      for username in usernames}
+
+    role_sets = {}
+    user_attr = None
+    if ldap_settings.USER_SEARCH is not None:
+        user_attr = _user_attr(ldap_settings.USER_SEARCH)
+    if user_attr is not None and ldap_usernames:
+        # Bind as AUTH_LDAP_BIND_DN, like group lookups do.
+        service_user = _LDAPUser(backend, username='')
+        try:
+            connection = service_user.connection
+            unique = sorted(set(ldap_usernames.values()))
+            member_of = {}
+            for start in range(0, len(unique), chunk_size):
+                member_of.update(_search_member_of(
+                    connection, ldap_settings.USER_SEARCH, user_attr,
+                    unique[start:start + chunk_size], member_of_attr))
+            if member_of:
+                graph = get_group_graph(
+                    lambda: connection, ldap_settings.GROUP_SEARCH,
+                    getattr(ldap_settings.GROUP_TYPE, 'member_attr',
+                            'member'))
+                for username, ldap_username in ldap_usernames.items():
+                    direct_group_dns = member_of.get(ldap_username.lower())
+                    if direct_group_dns is not None:
+                        role_sets[username] = frozenset(
+                            group_names(graph.closure(direct_group_dns)))
+        finally:
+            _unbind(service_user)
+
+    for username, ldap_username in ldap_usernames.items():
+        if username not in role_sets:
+            ldap_user = _LDAPUser(backend, username=ldap_username)
+            try:
+                group_dns = (ldap_user.group_dns
+                             if ldap_user.dn is not None else ())
+            finally:
+                _unbind(ldap_user)
+            role_sets[username] = frozenset(group_names(group_dns))
+    return role_sets
+
+
+def _unbind(ldap_user):
+    """Unbind an _LDAPUser's connection, if it made one.
+
+    Pooled connections go back to the pool.
+    """
+    connection = ldap_user._connection
+    if connection is not None:
+        ldap_user._connection = None
+        ldap_user._connection_bound = False
+        connection.unbind_s()
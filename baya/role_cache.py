@@ -0,0 +1,238 @@
+"""A stale-while-revalidate cache of users' role sets.
+
+Looking up a user's nested groups takes several LDAP searches, so with
+BAYA_ROLE_CACHE_TIMEOUT set, get_user_roles caches each user's roles (in the
+BAYA_ROLE_CACHE cache, 'default' by default, encoded with
+baya.gate_index.get_role_set_codec) for that many seconds. Once they're
+older than that, requests keep getting the cached roles while a
+single background thread per process looks them up again. Only roles older
+than BAYA_ROLE_CACHE_HARD_EXPIRY seconds (twice the timeout by default) are
+never used, so the request looks them up itself.
+
+Set BAYA_ROLE_CACHE_HARD_EXPIRY to the timeout to never use stale roles.
+
+With BAYA_ROLE_CACHE_MAX_STALE_ON_ERROR set, roles up to that many seconds
+old are also used when looking them up fails with an LDAP error, for
+example while baya.backend.CircuitBreaker is open. django-auth-ldap ignores
+failed searches, so only the outages that pooled or circuit breaker
+connections record are noticed (see baya.backend.raise_ldap_outages).
+"""
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import ldap
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS
+from django.core.cache import caches
+
+logger = logging.getLogger('baya')
+
+
+def get_timeout():
+    return getattr(settings, 'BAYA_ROLE_CACHE_TIMEOUT', None)
+
+
+def is_enabled():
+    return get_timeout() is not None
+
+
+class RoleSetCache(object):
+    """Caches role sets, refreshing stale ones on a background thread.
+
+    Args:
+        timeout: Seconds the cached roles are fresh for.
+        hard_expiry: Seconds after which the cached roles aren't used
+            (but see max_stale_on_error). Between `timeout` and `hard_expiry`, the cached roles are
+            returned and refreshed in the background.
+        cache_alias: The django cache to store the roles in.
+        max_stale_on_error: Seconds for which cached roles are used, even
+            after the hard expiry, when looking them up raises an LDAPError.
+        clock: Returns the current time in seconds. Cached roles may be
+            shared between processes, so this has to be wall clock time.
+    """
+
+    def __init__(self, timeout, hard_expiry=None,
+                 cache_alias=DEFAULT_CACHE_ALIAS, max_stale_on_error=None,
+                 clock=time.time):
+        if hard_expiry is None:
+            hard_expiry = 2 * timeout
+        if hard_expiry < timeout:
+            raise ValueError("hard_expiry must be at least the timeout.")
+        self.timeout = timeout
+        self.hard_expiry = hard_expiry
+        self.cache_alias = cache_alias
+        self.max_stale_on_error = max_stale_on_error
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self._executor = None
+
+    @staticmethod
+    def get_codec():
+        """Return the RoleSetCodec roles are cached with."""
+        from .gate_index import get_role_set_codec
+        return get_role_set_codec()
+
+    def _make_key(self, key):
+        return 'baya.user_roles.%s' % hashlib.md5(
+            key.encode('utf-8')).hexdigest()
+
+    def get(self, key, load, refresh=None):
+        """Return the roles for key.
+
+        Args:
+            key: The user's (LDAP) username.
+            load: Returns the roles. Called on this thread when there are no
+                usable cached roles.
+            refresh: Returns the roles, on the background thread, when the
+                cached roles are stale. It mustn't use anything belonging to
+                the current request. Defaults to `load`.
+        """
+        cache_key = self._make_key(key)
+        entry = self._fetch(cache_key)
+        if entry is not None:
+            roles, fetched_at = entry
+            age = self._clock() - fetched_at
+            if age < self.timeout:
+                return roles
+            if age < self.hard_expiry:
+                self._schedule_refresh(cache_key, refresh or load)
+                return roles
+        try:
+            return self._load(cache_key, load)
+        except ldap.LDAPError as e:
+            if (entry is None or self.max_stale_on_error is None or
+                    age >= self.max_stale_on_error):
+                raise
+            logger.warning("Using cached roles, %ds old: %s", age, e)
+            return roles
+
+    def _load(self, cache_key, load):
+        roles = set(load())
+        self._store(cache_key, roles)
+        return roles
+
+    def _fetch(self, cache_key):
+        """Return the cached (roles, fetched at), or None."""
+        entry = caches[self.cache_alias].get(cache_key)
+        if entry is None:
+            return None
+        data, fetched_at = entry
+        try:
+            return set(self.get_codec().decode(data)), fetched_at
+        except ValueError:
+            # Cached before the Gates' roles changed.
+            return None
+
+    def _store(self, cache_key, roles):
+        caches[self.cache_alias].set(
+            cache_key, (self.get_codec().encode(roles), self._clock()),
+            max(self.hard_expiry, self.max_stale_on_error or 0))
+
+    def _schedule_refresh(self, cache_key, refresh):
+        with self._lock:
+            if cache_key in self._refreshing:
+                return
+            self._refreshing.add(cache_key)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='baya-role-refresh')
+        try:
+            self._executor.submit(self._refresh, cache_key, refresh)
+        except BaseException:
+            with self._lock:
+                self._refreshing.discard(cache_key)
+            raise
+
+    def _refresh(self, cache_key, refresh):
+        try:
+            self._load(cache_key, refresh)
+        except Exception:
+            # The stale roles are used until the hard expiry, after which
+            # requests look the roles up (and see the error) themselves.
+            logger.exception("Refreshing cached roles failed.")
+        finally:
+            with self._lock:
+                self._refreshing.discard(cache_key)
+
+    def shutdown(self, wait=True):
+        """Stop the background thread, after any queued refreshes if wait."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+_role_cache = None
+_role_cache_lock = threading.Lock()
+
+
+def get_role_cache():
+    """Return the process' RoleSetCache, configured from the settings."""
+    global _role_cache
+    if _role_cache is None:
+        with _role_cache_lock:
+            if _role_cache is None:
+                _role_cache = RoleSetCache(
+                    get_timeout(),
+                    getattr(settings, 'BAYA_ROLE_CACHE_HARD_EXPIRY', None),
+                    getattr(settings, 'BAYA_ROLE_CACHE', DEFAULT_CACHE_ALIAS),
+                    getattr(settings, 'BAYA_ROLE_CACHE_MAX_STALE_ON_ERROR',
+                            None))
+    return _role_cache
+
+
+def _load_roles(ldap_user):
+    """Return the roles of an _LDAPUser.
+
+    django-auth-ldap logs and ignores failed searches, so this raises the
+    outages it ignored (see baya.backend.raise_ldap_outages) rather than
+    caching the roles it found without them.
+    """
+    from .backend import raise_ldap_outages
+    from .utils import group_names
+    with raise_ldap_outages():
+        if ldap_user.dn is None:
+            return set()
+        return group_names(ldap_user.group_dns)
+
+
+def _lookup_roles(backend, username):
+    from django_auth_ldap.backend import _LDAPUser
+    from .backend import release_ldap_connection
+    ldap_user = _LDAPUser(backend, username=username)
+    try:
+        return _load_roles(ldap_user)
+    finally:
+        release_ldap_connection(ldap_user)
+
+
+def get_user_roles(ldap_user):
+    """Return the roles of an authenticated user's ldap_user, cached.
+
+    The roles are kept on the ldap_user, so the cache is only read (and
+    written, after a lookup) once per request. Groups django-auth-ldap
+    already looked up for this request, e.g. at login, are used but not
+    cached, since the searches it ignored can't be told from missing groups.
+
+    The background refresh looks the user up with a new _LDAPUser, so it
+    doesn't share the request's LDAP connection.
+    """
+    roles = getattr(ldap_user, '_baya_cached_roles', None)
+    if roles is None:
+        username = ldap_user._username
+        groups = getattr(ldap_user, '_groups', None)
+        if getattr(groups, '_group_dns', None) is not None:
+            from .utils import group_names
+            roles = group_names(ldap_user.group_dns)
+        else:
+            roles = get_role_cache().get(
+                username,
+                lambda: _load_roles(ldap_user),
+                lambda: _lookup_roles(ldap_user.backend, username))
+        roles = frozenset(roles)
+        ldap_user._baya_cached_roles = roles
+    return set(roles)
@@ -0,0 +1,222 @@
+"""Compact representations of a user's set of roles.
+
+Roles are usually handled as sets of lowercased group names (see
+baya.utils.group_names). When the same role sets are checked against many
+nodes it is much cheaper to number the roles once, and represent each role
+set as an integer bitmask over those numbers.
+
+To store role sets, in sessions or caches, RoleSetCodec encodes them as
+compact bytes over a RoleDictionary.
+"""
+import hashlib
+
+
+class RoleDictionary(object):
+    """Assign every role name a stable bit position.
+
+    Usage:
+
+        roles = RoleDictionary(['a', 'b'])
+        mask = roles.encode(user_groups)
+        assert roles.decode(mask) <= set(user_groups)
+
+    Roles which aren't in the dictionary are ignored by `encode`, so the
+    dictionary must contain every role the encoded sets are checked against.
+    """
+
+    def __init__(self, roles=()):
+        self._ids = {}
+        self._roles = []
+        for role in sorted({role.lower() for role in roles}):
+            self.add(role)
+
+    def add(self, role):
+        """Add a role (if it's new) and return its bit position."""
+        role = role.lower()
+        if role not in self._ids:
+            self._ids[role] = len(self._roles)
+            self._roles.append(role)
+        return self._ids[role]
+
+    def copy(self):
+        """Return a RoleDictionary with the same bit positions."""
+        role_dictionary = RoleDictionary()
+        for role in self._roles:
+            role_dictionary.add(role)
+        return role_dictionary
+
+    def __contains__(self, role):
+        return role.lower() in self._ids
+
+    def __len__(self):
+        return len(self._roles)
+
+    def __iter__(self):
+        return iter(self._roles)
+
+    def encode(self, roles):
+        """Return the bitmask for an iterable of role names."""
+        ids = self._ids
+        mask = 0
+        for role in roles:
+            role_id = ids.get(role.lower())
+            if role_id is not None:
+                mask |= 1 << role_id
+        return mask
+
+    def decode(self, mask):
+        """Return the frozenset of role names in a bitmask."""
+        return frozenset(role for role_id, role in enumerate(self._roles)
+                         if mask >> role_id & 1)
+
+    def __repr__(self):
+        return 'RoleDictionary(%s)' % ', '.join(
+            '"%s"' % role for role in self._roles)
+
+
+ENCODING_VERSION = 1
+
+
+def _write_varint(out, value):
+    while value > 0x7f:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos):
+    """Return (value, position after it)."""
+    value = 0
+    shift = 0
+    while True:
+        try:
+            byte = data[pos]
+        except IndexError:
+            raise ValueError("Truncated role set.")
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+class RoleSetCodec(object):
+    """A compact, versioned bytes encoding of role sets.
+
+    Roles in the RoleDictionary are stored as a sorted list of their ids,
+    each one as a varint of the gap from the previous id, so sets of roles
+    from a dictionary of a few hundred roles take about a byte per role.
+    Other roles go in an overflow section as UTF-8 names. `contains` checks
+    for a role without decoding the whole set.
+
+    The encoding starts with ENCODING_VERSION, and the size and a
+    fingerprint of the dictionary it was encoded with. Sets can be decoded
+    with that dictionary, or one with roles added since; anything else
+    raises ValueError, as does data which isn't an encoded role set.
+
+    Usage:
+
+        codec = RoleSetCodec(RoleDictionary(['a', 'b']))
+        data = codec.encode(user_groups)
+        assert codec.decode(data) == {role.lower() for role in user_groups}
+        assert codec.contains(data, 'a') == ('a' in codec.decode(data))
+    """
+
+    def __init__(self, role_dictionary):
+        self.role_dictionary = role_dictionary
+        self._fingerprints = {}
+
+    def fingerprint(self, size=None):
+        """Return 4 bytes identifying the first `size` dictionary roles."""
+        if size is None:
+            size = len(self.role_dictionary)
+        if size not in self._fingerprints:
+            roles = self.role_dictionary._roles[:size]
+            digest = hashlib.sha1('\n'.join(roles).encode('utf-8')).digest()
+            self._fingerprints[size] = digest[:4]
+        return self._fingerprints[size]
+
+    def encode(self, roles):
+        """Return the bytes for an iterable of role names."""
+        ids = self.role_dictionary._ids
+        role_ids = []
+        overflow = []
+        for role in {role.lower() for role in roles}:
+            role_id = ids.get(role)
+            if role_id is None:
+                overflow.append(role)
+            else:
+                role_ids.append(role_id)
+        id_section = bytearray()
+        previous = -1
+        for role_id in sorted(role_ids):
+            _write_varint(id_section, role_id - previous - 1)
+            previous = role_id
+        size = len(self.role_dictionary)
+        out = bytearray([ENCODING_VERSION])
+        _write_varint(out, size)
+        out += self.fingerprint(size)
+        _write_varint(out, len(id_section))
+        out += id_section
+        _write_varint(out, len(overflow))
+        for role in sorted(overflow):
+            name = role.encode('utf-8')
+            _write_varint(out, len(name))
+            out += name
+        return bytes(out)
+
+    def _read_header(self, data):
+        """Return (dictionary size, ids start, ids end)."""
+        if not data or data[0] != ENCODING_VERSION:
+            raise ValueError("Unsupported role set encoding.")
+        size, pos = _read_varint(data, 1)
+        if (size > len(self.role_dictionary) or
+                data[pos:pos + 4] != self.fingerprint(size)):
+            raise ValueError(
+                "Role set was encoded with a different RoleDictionary.")
+        id_length, pos = _read_varint(data, pos + 4)
+        return size, pos, pos + id_length
+
+    def decode(self, data):
+        """Return the frozenset of role names in encoded data."""
+        size, pos, end = self._read_header(data)
+        dictionary_roles = self.role_dictionary._roles
+        roles = []
+        role_id = -1
+        while pos < end:
+            gap, pos = _read_varint(data, pos)
+            role_id += gap + 1
+            if role_id >= size:
+                raise ValueError("Invalid role set.")
+            roles.append(dictionary_roles[role_id])
+        count, pos = _read_varint(data, end)
+        for _ in range(count):
+            length, pos = _read_varint(data, pos)
+            if pos + length > len(data):
+                raise ValueError("Truncated role set.")
+            roles.append(data[pos:pos + length].decode('utf-8'))
+            pos += length
+        return frozenset(roles)
+
+    def contains(self, data, role):
+        """Return whether the encoded role set contains role."""
+        size, pos, end = self._read_header(data)
+        role = role.lower()
+        wanted = self.role_dictionary._ids.get(role)
+        if wanted is not None and wanted < size:
+            role_id = -1
+            while pos < end:
+                gap, pos = _read_varint(data, pos)
+                role_id += gap + 1
+                if role_id >= wanted:
+                    return role_id == wanted
+            return False
+        # Roles added to the dictionary since encoding are in the overflow.
+        name = role.encode('utf-8')
+        count, pos = _read_varint(data, end)
+        for _ in range(count):
+            length, pos = _read_varint(data, pos)
+            if length == len(name) and data[pos:pos + length] == name:
+                return True
+            pos += length
+        return False
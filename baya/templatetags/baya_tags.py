@@ -1,7 +1,9 @@
-from baya.utils import has_permission
+from baya.gate_index import get_gate_index
+from baya.utils import check_gates
+from baya.utils import get_user_roles
+from baya.visitors import PermissionChecker
 from django import template
-from django.urls import resolve
-from django.urls import reverse
+from django.urls import get_urlconf
 
 register = template.Library()
 
@@ -27,11 +29,58 @@ def can_user_perform_action(context, action, *args, **kwargs):
         If there is no Gate (no requires function wrapping the viewfunc),
         has_permission returns False.
 
-        action, args, and kwargs are fed directly into reverse. If they aren't
-        given correctly, exceptions will be thrown. e.g. You supply both
-        args and kwargs. For details please see django docs:
+        The Gates are looked up by url name in the GateIndex (see
+        baya.gate_index). Only names missing from the index are fed into
+        reverse, with args and kwargs. If they aren't given correctly,
+        exceptions will be thrown. e.g. You supply both args and kwargs. For
+        details please see django docs:
         https://docs.djangoproject.com/en/1.8/ref/urlresolvers/#reverse
     """
-    view_func = resolve(reverse(action, args=args, kwargs=kwargs)).func
+    urlconf = get_urlconf()
+    gates = get_gate_index(urlconf).get_gates(
+        action, args=args, kwargs=kwargs, urlconf=urlconf)
+    checker = PermissionChecker(get_user_roles(context['user']))
+    return check_gates(gates, checker, 'any')
 
-    return has_permission(view_func, context['user'], 'any')
+
+@register.simple_tag(takes_context=True)
+def baya_permission_map(context, *actions, **aliased_actions):
+    """
+    Assignment tag to check user permission for many urls at once.
+
+    Example:
+        {%  baya_permission_map "home" "blag_list" as perms %}
+        {%  if perms.home %}...{%  endif %}
+
+        {%  baya_permission_map blags="admin:tests_blag_changelist" as perms %}
+        {%  if perms.blags %}...{%  endif %}
+
+    Args:
+        context: The template context (implicitly passed in because
+            takes_context=True)
+        actions: The names of the urls, which are also the keys of the
+            returned dict.
+        aliased_actions: Maps keys of the returned dict to url names. Use this
+            for namespaced url names, which can't be looked up in templates.
+
+    Returns:
+        dict: Maps each action (or alias) to True if user has permission,
+            False otherwise.
+
+    Caveats:
+        This only supports url names which reverse without args or kwargs.
+        The Gates for each url name come from the GateIndex (see
+        baya.gate_index), and the user's groups are only looked up once per
+        tag.
+    """
+    actions = {action: action for action in actions}
+    actions.update(aliased_actions)
+    urlconf = get_urlconf()
+    index = get_gate_index(urlconf)
+    checker = PermissionChecker(get_user_roles(context['user']))
+    cache = {}
+    return {
+        key: check_gates(index.get_gates(action, urlconf=urlconf),
+                         checker, 'any', cache)
+        for key, action in actions.items()
+    }
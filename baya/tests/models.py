@@ -20,3 +20,12 @@ class PhotoBlagEntry(models.Model):
     blag = models.ForeignKey(Blag, on_delete=models.CASCADE)
     title = models.CharField(max_length=255)
     # and a file field for a photo but whatever
+
+
+class Tag(models.Model):
+    name = models.CharField(max_length=128)
+
+
+class TaggedEntry(models.Model):
+    title = models.CharField(max_length=255)
+    tags = models.ManyToManyField(Tag, blank=True)
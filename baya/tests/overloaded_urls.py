@@ -0,0 +1,22 @@
+import django
+if django.VERSION[:2] < (4, 0):
+    from django.conf.urls import url
+else:
+    from django.urls import re_path
+    url = re_path
+
+from baya.permissions import requires
+
+from .views import my_undecorated_view
+
+
+# One url name for two patterns with different Gates. reverse() picks the
+# pattern by the args it's given.
+urlpatterns = [
+    url(r'^overloaded/(?P<pk>\d+)/$', requires('aa')(my_undecorated_view),
+        name='overloaded'),
+    url(r'^overloaded/$', requires('a')(my_undecorated_view),
+        name='overloaded'),
+    url(r'^same/(?P<pk>\d+)/$', requires('a')(my_undecorated_view),
+        name='same'),
+]
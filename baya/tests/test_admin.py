@@ -1,8 +1,15 @@
 import six
 from django.contrib.admin.options import InlineModelAdmin
+from django.core.exceptions import PermissionDenied
+from django.test import TestCase
 
 from baya import RolesNode as g
+from baya.admin import BayaInlineMixin
+from baya.admin import BayaModelAdmin
 from baya.admin.sites import NestedGroupsAdminSite
+from baya.admin.sites import _admin_registry
+from baya.admin.sites import _get_regex
+from baya.dynamic_roles import ModelFieldGroupFormatter
 from baya.permissions import requires
 from baya.permissions import ALLOW_ALL
 from baya.tests.admin import BlagEntryInline
@@ -91,6 +98,46 @@ class TestAdminSite(LDAPGroupAuthTestBase):
         self.assertFalse(perms['delete'])
 
 
+class TestAdminSiteUrls(TestCase):
+    def setUp(self):
+        self.site = NestedGroupsAdminSite(name='urls-test')
+        # Don't let this site leak into the backend's permission checks.
+        _admin_registry.discard(self.site)
+
+    def _get_url(self, urls, pattern):
+        for urlp in urls:
+            if _get_regex(urlp).pattern == pattern:
+                return urlp
+
+    def test_get_urls_cached(self):
+        self.site.register(Blag, BayaModelAdmin)
+        urls = self.site.get_urls()
+        cached_urls = self.site.get_urls()
+        self.assertEqual(len(urls), len(cached_urls))
+        for urlp, cached_urlp in zip(urls, cached_urls):
+            self.assertIs(urlp, cached_urlp)
+
+    def test_get_urls_registry_changed(self):
+        self.site.register(Blag, BayaModelAdmin)
+        blag_url = self._get_url(self.site.get_urls(), '^tests/blag/')
+        self.assertIsNotNone(blag_url)
+        self.assertIsNone(
+            self._get_url(self.site.get_urls(), '^tests/blagentry/'))
+
+        self.site.register(BlagEntry, BayaModelAdmin)
+        urls = self.site.get_urls()
+        # The unchanged model admin's include is reused
+        self.assertIs(self._get_url(urls, '^tests/blag/'), blag_url)
+        self.assertIsNotNone(self._get_url(urls, '^tests/blagentry/'))
+
+    def test_get_urls_gate_changed(self):
+        self.site.register(Blag, BayaModelAdmin)
+        blag_url = self._get_url(self.site.get_urls(), '^tests/blag/')
+        self.site._registry[Blag]._gate.get_requires &= g('A')
+        new_blag_url = self._get_url(self.site.get_urls(), '^tests/blag/')
+        self.assertIsNot(new_blag_url, blag_url)
+
+
 class TestOptions(LDAPGroupAuthTestBase):
     def _get_options(self):
         return site._registry[Blag]
@@ -212,6 +259,100 @@ class TestCRUDOptions(LDAPGroupAuthTestBase):
                 self.mock_get_request(self.login('has_b'))))
 
 
+class TestObjectRoles(LDAPGroupAuthTestBase):
+    """Entries are visible to users in the group named after their blag."""
+    OBJECT_ROLES = ModelFieldGroupFormatter(
+        BlagEntry, 'blag__name', '%s', ignore_case=True)
+
+    def setUp(self):
+        super(TestObjectRoles, self).setUp()
+        self.entries = {
+            name: BlagEntry.objects.create(
+                blag=Blag.objects.create(name=name), title=name)
+            for name in ['A', 'aa', 'b']}
+
+        class EntryOptions(BayaModelAdmin):
+            OBJECT_ROLES = self.OBJECT_ROLES
+
+        class EntryInline(BayaInlineMixin, InlineModelAdmin):
+            model = BlagEntry
+            OBJECT_ROLES = self.OBJECT_ROLES
+
+        self.options = EntryOptions(BlagEntry, site)
+        self.inline = EntryInline(Blag, site)
+
+    def test_get_queryset(self):
+        for options in [self.options, self.inline]:
+            request = self.mock_get_request(self.login('has_aa'))
+            self.assertEqual(list(options.get_queryset(request)),
+                             [self.entries['aa']])
+            request = self.mock_get_request(self.login('has_a_b'))
+            self.assertEqual(
+                set(options.get_queryset(request)),
+                {self.entries['A'], self.entries['aa'], self.entries['b']})
+            request = self.mock_get_request(self.login('has_nothing'))
+            self.assertFalse(options.get_queryset(request).exists())
+
+    def test_allow_all(self):
+        request = self.mock_get_request(self.login('has_nothing'))
+        with self.settings(BAYA_ALLOW_ALL=True):
+            self.assertEqual(self.options.get_queryset(request).count(), 3)
+
+    def test_object_permissions(self):
+        request = self.mock_post_request(self.login('has_aa'))
+        for permission in [self.options.has_change_permission,
+                           self.options.has_delete_permission]:
+            self.assertTrue(permission(request))
+            self.assertTrue(permission(request, self.entries['aa']))
+            self.assertFalse(permission(request, self.entries['A']))
+
+    def test_save_added_object(self):
+        request = self.mock_post_request(self.login('has_aa'))
+        entry = BlagEntry(blag=self.entries['b'].blag, title='new')
+        with self.assertRaises(PermissionDenied):
+            self.options.save_model(request, entry, None, False)
+        self.assertIsNone(entry.pk)
+        entry.blag = self.entries['aa'].blag
+        self.options.save_model(request, entry, None, False)
+        self.assertIsNotNone(entry.pk)
+
+    def test_save_reassigned_object(self):
+        request = self.mock_post_request(self.login('has_aa'))
+        entry = self.entries['aa']
+        self.assertTrue(self.options.has_change_permission(request, entry))
+        # The form moves the entry to a blag the user has no access to.
+        entry.blag = self.entries['b'].blag
+        with self.assertRaises(PermissionDenied):
+            self.options.save_model(request, entry, None, True)
+        entry.refresh_from_db()
+        self.assertEqual(entry.blag, self.entries['aa'].blag)
+
+    def _inline_formset(self, request, blag):
+        formset_class = self.inline.get_formset(request, blag)
+        prefix = formset_class.get_default_prefix()
+        return formset_class(
+            {'%s-TOTAL_FORMS' % prefix: '1',
+             '%s-INITIAL_FORMS' % prefix: '0',
+             '%s-0-title' % prefix: 'new',
+             '%s-0-body' % prefix: 'body'},
+            instance=blag, prefix=prefix)
+
+    def test_save_inline_object(self):
+        request = self.mock_post_request(self.login('has_aa'))
+        formset = self._inline_formset(request, self.entries['b'].blag)
+        self.assertFalse(formset.is_valid())
+        self.assertTrue(formset.non_form_errors())
+        formset = self._inline_formset(request, self.entries['aa'].blag)
+        self.assertTrue(formset.is_valid())
+
+    def test_no_object_roles(self):
+        request = self.mock_post_request(self.login('has_aa'))
+        options = BayaModelAdmin(BlagEntry, site)
+        self.assertEqual(options.get_queryset(request).count(), 3)
+        self.assertTrue(
+            options.has_change_permission(request, self.entries['A']))
+
+
 class TestInlines(LDAPGroupAuthTestBase):
     def setUp(self):
         super(TestInlines, self).setUp()
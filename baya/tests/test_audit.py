@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from ..audit import DYNAMIC
+from ..audit import MembershipMatrix
+from ..audit import PermissionAudit
+from ..gate_index import get_gate_index
+from ..membership import DynamicRolesNode as dg
+from ..membership import RolesNode as g
+from ..permissions import ALLOW_ALL
+from ..permissions import DENY_ALL
+from ..permissions import Gate
+from ..utils import check_gates
+from ..visitors import PermissionChecker
+
+USER_ROLES = {
+    'has_all': {'a_admin', 'a', 'aa', 'ab', 'aaa', 'b'},
+    'has_a': {'a', 'aa', 'ab', 'aaa'},
+    'has_aa': {'aa', 'aaa'},
+    'has_aaa': {'aaa'},
+    'has_b': {'b'},
+    'has_a_b': {'a', 'aa', 'ab', 'aaa', 'b'},
+    'has_nothing': {'nothing'},
+    'has_none': set(),
+}
+
+
+class TestMembershipMatrix(TestCase):
+    def test_columns(self):
+        matrix = MembershipMatrix([('u1', ['A']), ('u2', ['a', 'b'])])
+        self.assertEqual(matrix.users, ['u1', 'u2'])
+        self.assertEqual(list(matrix.unpack(matrix.column('a'))),
+                         [True, True])
+        self.assertEqual(list(matrix.unpack(matrix.column('B'))),
+                         [False, True])
+        self.assertEqual(list(matrix.unpack(matrix.column('c'))),
+                         [False, False])
+
+
+class TestPermissionAudit(TestCase):
+    def setUp(self):
+        self.audit = PermissionAudit(USER_ROLES)
+        self.users = self.audit.matrix.users
+
+    def _assert_agrees(self, node):
+        column = self.audit.matrix.unpack(self.audit.check_node(node))
+        for user, allowed in zip(self.users, column):
+            self.assertEqual(
+                allowed, PermissionChecker(USER_ROLES[user]).visit(node),
+                "%s %r" % (user, node))
+
+    def test_nodes(self):
+        a, aa, b = g('a'), g('aa'), g('b')
+        for node in [a, g('a', 'b'), g(), a & b, a | b, a ^ b, ~a,
+                     ~(a | b) & aa, (a & b) ^ (aa | ~b), ALLOW_ALL, DENY_ALL,
+                     DENY_ALL | b]:
+            self._assert_agrees(node)
+
+    def test_dynamic_node(self):
+        node = g('a') | dg(lambda **kwargs: {'a'})
+        self.assertIsNone(self.audit.check_node(node))
+
+    def test_no_gates(self):
+        column = self.audit.matrix.unpack(self.audit.check_gates(()))
+        self.assertFalse(column.any())
+
+    def test_gates(self):
+        gates = (Gate(get_requires=g('a') | g('b'), post_requires=g('a')),
+                 Gate(get_requires=~g('aa')))
+        for permission in ['get', 'post', 'any']:
+            column = self.audit.matrix.unpack(
+                self.audit.check_gates(gates, permission))
+            for user, allowed in zip(self.users, column):
+                self.assertEqual(
+                    allowed,
+                    check_gates(gates, PermissionChecker(USER_ROLES[user]),
+                                permission))
+
+    def test_audit_urls(self):
+        for permission in ['get', 'post', 'any']:
+            result = self.audit.audit(get_gate_index().items(), permission)
+            dense = result.to_dense()
+            self.assertEqual(dense.shape,
+                             (len(result.views), len(result.users)))
+            for row, view in enumerate(result.views):
+                gates = get_gate_index().get_gates(view)
+                if view in result.dynamic:
+                    self.assertEqual(result.users_for(view), DYNAMIC)
+                    continue
+                for index, user in enumerate(result.users):
+                    expected = check_gates(
+                        gates, PermissionChecker(USER_ROLES[user]),
+                        permission)
+                    self.assertEqual(dense[row, index], expected)
+                    self.assertEqual(result.allowed(view, index), expected)
+
+    def test_audit_dynamic(self):
+        result = self.audit.audit(get_gate_index().items())
+        self.assertEqual(result.dynamic, {'query_param_view'})
+        self.assertEqual(result.allowed('query_param_view', 0), DYNAMIC)
+
+    def test_users_for(self):
+        result = self.audit.audit(get_gate_index().items())
+        self.assertEqual(set(result.users_for('my_undecorated_view')),
+                         {'has_all', 'has_a', 'has_a_b'})
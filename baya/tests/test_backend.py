@@ -1,10 +1,36 @@
+import asyncio
+import threading
+import time
+
 import ldap
+from asgiref.sync import async_to_sync
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test.utils import override_settings
+from django_auth_ldap.config import NestedGroupOfNamesType
 from mock import Mock
+from mock import patch
 from mock import sentinel
 
+from baya.backend import CircuitBreaker
+from baya.backend import CircuitBreakerLDAP
+from baya.backend import CircuitOpenError
+from baya.backend import LDAPConnectionPool
 from baya.backend import NestedLDAPGroupsBackend
+from baya.backend import PoolExhaustedError
 from baya.backend import ReconnectingLDAP
+from baya.backend import SingleFlight
+from baya.backend import SingleFlightGroupType
+from baya.backend import get_circuit_breaker_stats
+from baya.backend import get_ldap_executor
+from baya.backend import raise_ldap_outages
+from baya.backend import release_connections
+from baya.backend import release_ldap_connection
+from baya.backend import run_in_ldap_executor
+from baya.mock_ldap_helpers import group_dn
+from baya.mock_ldap_helpers import mock_ldap_setup
+
+from . import directory
 
 
 class TestReconnectingLDAP(TestCase):
@@ -22,6 +48,266 @@ class TestReconnectingLDAP(TestCase):
             sentinel.uri, retry_max=6)
 
 
+class TestReconnectingLDAPPool(TestCase):
+
+    def setUp(self):
+        patcher = patch('baya.backend._connection_pools', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ldap = Mock()
+        self.ldap.ldapobject.ReconnectLDAPObject.side_effect = (
+            lambda *args, **kwargs: Mock())
+        self.reconnecting_ldap = ReconnectingLDAP(
+            self.ldap, pool_size=2, bind_dn='cn=auth')
+
+    def test_reuse(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        connection.start_tls_s()
+        connection.simple_bind_s('cn=auth', 'password')
+        raw = connection._connection
+        connection.unbind_s()
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        self.assertIs(connection._connection, raw)
+        connection.start_tls_s()
+        connection.simple_bind_s('CN=auth', 'password')
+        self.assertEqual(raw.start_tls_s.call_count, 1)
+        self.assertEqual(raw.simple_bind_s.call_count, 1)
+        self.ldap.ldapobject.ReconnectLDAPObject.assert_called_once_with(
+            'ldap://a', retry_max=6)
+
+    def test_user_binds(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        raw = connection._connection
+        connection.simple_bind_s('cn=user', 'password')
+        connection.simple_bind_s('cn=user', 'password')
+        connection.simple_bind_s('cn=auth', 'password')
+        connection.simple_bind_s('cn=auth', 'other')
+        self.assertEqual(raw.simple_bind_s.call_count, 4)
+
+    def test_garbage_collected(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        raw = connection._connection
+        del connection
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        self.assertIs(connection._connection, raw)
+        other = self.reconnecting_ldap.initialize('ldap://b')
+        self.assertIsNot(other._connection, raw)
+
+    def test_broken(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        connection._pool.retries = 0
+        raw = connection._connection
+        raw.search_s.side_effect = ldap.SERVER_DOWN()
+        self.assertRaises(ldap.SERVER_DOWN, connection.search_s, 'dc=test')
+        connection.unbind_s()
+        raw.unbind_s.assert_called_once_with()
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        self.assertIsNot(connection._connection, raw)
+
+    def test_retry(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        connection.start_tls_s()
+        connection.simple_bind_s('cn=auth', 'password')
+        raw = connection._connection
+        raw.search_s.side_effect = ldap.SERVER_DOWN()
+        self.assertIsNotNone(connection.search_s('dc=test'))
+        retried = connection._connection
+        self.assertIsNot(retried, raw)
+        raw.unbind_s.assert_called_once_with()
+        # The new connection gets the same TLS and service bind.
+        retried.start_tls_s.assert_called_once_with()
+        retried.simple_bind_s.assert_called_once_with('cn=auth', 'password')
+        retried.search_s.assert_called_once_with('dc=test')
+
+    def test_no_retry(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        raw = connection._connection
+        raw.search_s.side_effect = ldap.SERVER_DOWN()
+        raw.modify_s.side_effect = ldap.SERVER_DOWN()
+        # Writes aren't retried, nor are reads bound as a user.
+        self.assertRaises(ldap.SERVER_DOWN, connection.modify_s, 'cn=x', [])
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        raw = connection._connection
+        raw.search_s.side_effect = ldap.SERVER_DOWN()
+        connection.simple_bind_s('cn=user', 'password')
+        self.assertRaises(ldap.SERVER_DOWN, connection.search_s, 'dc=test')
+
+    def test_release_connections(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        connection.start_tls_s()
+        connection.simple_bind_s('cn=auth', 'password')
+        raw = connection._connection
+        user_connection = self.reconnecting_ldap.initialize('ldap://a')
+        user_connection.simple_bind_s('cn=user', 'password')
+        release_connections()
+        self.assertIsNone(connection._connection)
+        self.assertIsNotNone(user_connection._connection)
+        # Used again, it borrows the released connection, which is still
+        # set up.
+        connection.search_s('dc=test')
+        self.assertIs(connection._connection, raw)
+        self.assertEqual(raw.start_tls_s.call_count, 1)
+        self.assertEqual(raw.simple_bind_s.call_count, 1)
+
+    def test_release_restores_bind(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        connection.simple_bind_s('cn=auth', 'password')
+        raw = connection._connection
+        connection.release()
+        # Rebound as a user while connection was released.
+        other = self.reconnecting_ldap.initialize('ldap://a')
+        self.assertIs(other._connection, raw)
+        other.simple_bind_s('cn=user', 'password')
+        other.unbind_s()
+        connection.search_s('dc=test')
+        self.assertIs(connection._connection, raw)
+        self.assertEqual(raw.simple_bind_s.call_count, 3)
+        raw.simple_bind_s.assert_called_with('cn=auth', 'password')
+
+    def test_release_ldap_connection(self):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        ldap_user = Mock(_connection=connection, _connection_bound=True)
+        release_ldap_connection(ldap_user)
+        self.assertIsNone(ldap_user._connection)
+        self.assertFalse(ldap_user._connection_bound)
+        self.assertIsNone(connection._connection)
+        # Connections that aren't pooled are left alone.
+        ldap_user = Mock(_connection=Mock(spec=['unbind_s']))
+        release_ldap_connection(ldap_user)
+        self.assertIsNotNone(ldap_user._connection)
+        self.assertFalse(ldap_user._connection.unbind_s.called)
+
+    @patch('baya.backend._LDAPUser')
+    def test_get_group_dns_releases(self, _LDAPUser):
+        connection = self.reconnecting_ldap.initialize('ldap://a')
+        _LDAPUser.return_value._connection = connection
+        _LDAPUser.return_value.group_dns = {'cn=a'}
+        backend = NestedLDAPGroupsBackend()
+        with patch.object(NestedLDAPGroupsBackend, 'django_to_ldap_username',
+                          side_effect=lambda username: username,
+                          create=True):
+            self.assertEqual(backend.get_group_dns('user'), {'cn=a'})
+        self.assertIsNone(connection._connection)
+
+
+class TestLDAPConnectionPool(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.pool = LDAPConnectionPool(
+            Mock(side_effect=lambda: Mock()), max_size=1, max_idle=300,
+            timeout=0.01, clock=lambda: self.now)
+
+    def test_exhausted(self):
+        connection = self.pool.acquire()
+        self.assertRaises(PoolExhaustedError, self.pool.acquire)
+        connection.unbind_s()
+        self.pool.acquire()
+
+    def test_wait(self):
+        connection = self.pool.acquire()
+        raw = connection._connection
+        self.pool.timeout = 5
+        threading.Timer(0.05, connection.unbind_s).start()
+        self.assertIs(self.pool.acquire()._connection, raw)
+
+    def test_health_check(self):
+        connection = self.pool.acquire()
+        raw = connection._connection
+        connection.unbind_s()
+        self.now = 10
+        self.assertIs(self.pool.acquire()._connection, raw)
+        self.assertFalse(raw.whoami_s.called)
+        self.now = 100
+        raw.whoami_s.side_effect = ldap.SERVER_DOWN()
+        connection = self.pool.acquire()
+        self.assertIsNot(connection._connection, raw)
+        raw.unbind_s.assert_called_once_with()
+
+    def test_idle_eviction(self):
+        connection = self.pool.acquire()
+        raw = connection._connection
+        connection.unbind_s()
+        self.now = 300
+        self.assertIsNot(self.pool.acquire()._connection, raw)
+        raw.unbind_s.assert_called_once_with()
+        self.assertFalse(raw.whoami_s.called)
+
+    def test_clear(self):
+        connection = self.pool.acquire()
+        raw = connection._connection
+        connection.unbind_s()
+        self.pool.clear()
+        raw.unbind_s.assert_called_once_with()
+        self.assertIsNot(self.pool.acquire()._connection, raw)
+
+
+class TestSingleFlight(TestCase):
+
+    def test_concurrent(self):
+        started = threading.Event()
+        finish = threading.Event()
+        calls = []
+
+        def lookup(value):
+            calls.append(value)
+            started.set()
+            finish.wait(5)
+            return [value]
+
+        single_flight = SingleFlight()
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                single_flight.do('key', lookup, 1)))
+            for _ in range(5)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        time.sleep(0.05)
+        finish.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(calls, [1])
+        self.assertEqual(results, [[1]] * 5)
+        # Once the call finishes, the next one runs again.
+        self.assertEqual(single_flight.do('key', lookup, 2), [2])
+        self.assertEqual(calls, [1, 2])
+
+    def test_exception(self):
+        single_flight = SingleFlight()
+        self.assertRaises(
+            ldap.SERVER_DOWN, single_flight.do, 'key', Mock(
+                side_effect=ldap.SERVER_DOWN()))
+        self.assertEqual(single_flight.do('key', lambda: 1), 1)
+
+    def test_group_type(self):
+        group_type = Mock()
+        group_type.user_groups.return_value = [('cn=a', {})]
+        single_flight_type = SingleFlightGroupType(group_type)
+        ldap_user = Mock(dn='CN=user')
+        group_infos = single_flight_type.user_groups(
+            ldap_user, sentinel.group_search)
+        self.assertEqual(group_infos, [('cn=a', {})])
+        self.assertIsNot(group_infos, group_type.user_groups.return_value)
+        group_type.user_groups.assert_called_once_with(
+            ldap_user, sentinel.group_search)
+        self.assertIs(single_flight_type.group_name_from_info,
+                      group_type.group_name_from_info)
+
+    def test_backend(self):
+        group_type = NestedLDAPGroupsBackend().settings.GROUP_TYPE
+        self.assertIsInstance(group_type, SingleFlightGroupType)
+        self.assertIsInstance(group_type.group_type, NestedGroupOfNamesType)
+
+        class TestBackend(NestedLDAPGroupsBackend):
+            single_flight_group_lookups = False
+
+        self.assertIsInstance(TestBackend().settings.GROUP_TYPE,
+                              NestedGroupOfNamesType)
+
+
 class TestReconnectingLDAPBackend(TestCase):
 
     class TestBackend(NestedLDAPGroupsBackend):
@@ -44,3 +330,331 @@ class TestNonReconnectingLDAPBackend(TestCase):
         ldap_module = backend.ldap
         self.assertFalse(isinstance(ldap_module, ReconnectingLDAP))
         self.assertIs(ldap_module.SERVER_DOWN, ldap.SERVER_DOWN)
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self):
+        self.now = 0
+        self.breaker = CircuitBreaker(
+            failure_threshold=2, slow_call_threshold=5, reset_timeout=30,
+            clock=lambda: self.now)
+
+    def _fail(self):
+        self.assertRaises(ldap.SERVER_DOWN, self.breaker.call,
+                          Mock(side_effect=ldap.SERVER_DOWN))
+
+    def test_opens(self):
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        fn = Mock()
+        self.assertRaises(CircuitOpenError, self.breaker.call, fn)
+        self.assertRaises(ldap.SERVER_DOWN, self.breaker.check)
+        self.assertFalse(fn.called)
+        self.assertEqual(self.breaker.stats()['rejected'], 2)
+
+    def test_successes_reset_failures(self):
+        self._fail()
+        self.assertIs(self.breaker.call(lambda: sentinel.result),
+                      sentinel.result)
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_other_errors(self):
+        for _ in range(3):
+            self.assertRaises(
+                ldap.INVALID_CREDENTIALS, self.breaker.call,
+                Mock(side_effect=ldap.INVALID_CREDENTIALS))
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_pool_exhausted(self):
+        self._fail()
+        # Neither a failure nor a success, since the server wasn't called.
+        self.assertRaises(PoolExhaustedError, self.breaker.call,
+                          Mock(side_effect=PoolExhaustedError))
+        self.assertEqual(self.breaker.stats()['failures'], 1)
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_slow_calls(self):
+        def slow():
+            self.now += 6
+            return sentinel.result
+        self.assertIs(self.breaker.call(slow), sentinel.result)
+        self.breaker.call(slow)
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open(self):
+        self._fail()
+        self._fail()
+        self.now += 30
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        # A failed trial call reopens the breaker straight away.
+        self._fail()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.now += 30
+
+        def trial():
+            # Only one call is let through while half open.
+            self.assertRaises(CircuitOpenError, self.breaker.call, Mock())
+            return sentinel.result
+        self.assertIs(self.breaker.call(trial), sentinel.result)
+        self.assertEqual(self.breaker.stats(), {
+            'state': CircuitBreaker.CLOSED, 'failures': 0,
+            'opened_at': 30, 'rejected': 1})
+
+    def test_reset(self):
+        self._fail()
+        self._fail()
+        self.breaker.reset()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+class TestCircuitBreakerLDAP(TestCase):
+
+    def setUp(self):
+        patcher = patch('baya.backend._circuit_breakers', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ldap = Mock()
+        self.ldap.SERVER_DOWN = ldap.SERVER_DOWN
+        self.connection = self.ldap.initialize.return_value
+        self.connection.search_s.side_effect = ldap.SERVER_DOWN
+
+    @override_settings(BAYA_LDAP_BREAKER_FAILURE_THRESHOLD=2)
+    def test_initialize(self):
+        breaker_ldap = CircuitBreakerLDAP(self.ldap)
+        self.assertIs(breaker_ldap.SERVER_DOWN, ldap.SERVER_DOWN)
+        connection = breaker_ldap.initialize('ldap://a', bytes_mode=False)
+        self.ldap.initialize.assert_called_once_with(
+            'ldap://a', bytes_mode=False)
+        for _ in range(2):
+            self.assertRaises(ldap.SERVER_DOWN, connection.search_s, 'ou=a')
+        self.assertEqual(self.connection.search_s.call_count, 2)
+        self.assertRaises(CircuitOpenError, connection.search_s, 'ou=a')
+        self.assertEqual(self.connection.search_s.call_count, 2)
+        # Local calls still work, so the connection can be cleaned up.
+        connection.unbind_s()
+        self.connection.unbind_s.assert_called_once_with()
+        self.assertRaises(CircuitOpenError, breaker_ldap.initialize,
+                          'ldap://a')
+        # Each server has its own breaker.
+        breaker_ldap.initialize('ldap://b').simple_bind_s()
+        self.assertEqual(
+            {uri: stats['state']
+             for uri, stats in get_circuit_breaker_stats().items()},
+            {'ldap://a': CircuitBreaker.OPEN,
+             'ldap://b': CircuitBreaker.CLOSED})
+
+    @override_settings(BAYA_LDAP_BREAKER_FAILURE_THRESHOLD=2)
+    def test_pooled(self):
+        patcher = patch('baya.backend._connection_pools', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.ldap.ldapobject.ReconnectLDAPObject.return_value = (
+            self.connection)
+        self.connection.search_s.side_effect = ldap.TIMEOUT
+        breaker_ldap = CircuitBreakerLDAP(
+            ReconnectingLDAP(self.ldap, pool_size=1, bind_dn='cn=auth'))
+        for _ in range(2):
+            connection = breaker_ldap.initialize('ldap://a')
+            connection.set_option(ldap.OPT_REFERRALS, 0)
+            connection.simple_bind_s('cn=auth', 'password')
+            self.assertRaises(ldap.TIMEOUT, connection.search_s, 'ou=a')
+            connection.unbind_s()
+        # The second bind was skipped, and didn't count as the server
+        # answering.
+        self.connection.simple_bind_s.assert_called_once_with(
+            'cn=auth', 'password')
+        self.assertRaises(CircuitOpenError, breaker_ldap.initialize,
+                          'ldap://a')
+
+    @override_settings(BAYA_LDAP_BREAKER_FAILURE_THRESHOLD=1,
+                       BAYA_LDAP_POOL_TIMEOUT=0)
+    def test_pool_exhausted(self):
+        patcher = patch('baya.backend._connection_pools', {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        breaker_ldap = CircuitBreakerLDAP(
+            ReconnectingLDAP(self.ldap, pool_size=1, bind_dn='cn=auth'))
+        connection = breaker_ldap.initialize('ldap://a')
+        self.assertRaises(PoolExhaustedError, breaker_ldap.initialize,
+                          'ldap://a')
+        connection.release()
+        other = breaker_ldap.initialize('ldap://a')
+        with self.assertRaises(PoolExhaustedError):
+            connection.search_s('ou=a')
+        other.unbind_s()
+        self.assertEqual(get_circuit_breaker_stats()['ldap://a']['state'],
+                         CircuitBreaker.CLOSED)
+
+    def test_raise_ldap_outages(self):
+        connection = CircuitBreakerLDAP(self.ldap).initialize('ldap://a')
+
+        def search():
+            # Like django-auth-ldap's LDAPSearch.execute.
+            try:
+                return connection.search_s('ou=a')
+            except ldap.LDAPError:
+                return []
+
+        with self.assertRaises(ldap.SERVER_DOWN):
+            with raise_ldap_outages():
+                search()
+        self.connection.search_s.side_effect = ldap.NO_SUCH_OBJECT
+        with raise_ldap_outages():
+            self.assertEqual(search(), [])
+
+    def test_backend(self):
+        class TestBackend(NestedLDAPGroupsBackend):
+            use_reconnecting_client = True
+            ldap_circuit_breaker = True
+
+        ldap_module = TestBackend().ldap
+        self.assertIsInstance(ldap_module, CircuitBreakerLDAP)
+        self.assertIsInstance(ldap_module._original_module, ReconnectingLDAP)
+
+
+class TestAsyncBackend(TransactionTestCase):
+    """Runs the async methods against an in-process mock LDAP directory.
+
+    The LDAP calls run on other threads, which write to the database, so
+    this can't be a (single transaction) TestCase.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestAsyncBackend, cls).setUpClass()
+        cls.mockldap = mock_ldap_setup(
+            ldap_dc='dc=test',
+            extra_users=directory.test_users,
+            group_lineage=directory.group_lineage)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.mockldap
+        super(TestAsyncBackend, cls).tearDownClass()
+
+    def setUp(self):
+        self.mockldap.start()
+        self.backend = NestedLDAPGroupsBackend()
+
+    def tearDown(self):
+        self.mockldap.stop()
+
+    def test_aauthenticate(self):
+        user = async_to_sync(self.backend.aauthenticate)(
+            None, username='has_aa', password='password')
+        self.assertEqual(user.username, 'has_aa')
+        self.assertEqual(user.ldap_user.group_names, {'aa', 'aaa'})
+        self.assertIsNone(async_to_sync(self.backend.aauthenticate)(
+            None, username='has_aa', password='wrong'))
+
+    def test_aget_group_dns(self):
+        self.assertEqual(
+            async_to_sync(self.backend.aget_group_dns)('has_aa'),
+            {group_dn('aa', 'dc=test'), group_dn('aaa', 'dc=test')})
+        self.assertEqual(
+            async_to_sync(self.backend.aget_group_dns)('unknown'), set())
+
+    def test_concurrent(self):
+        usernames = ['has_a', 'has_aa', 'has_b', 'has_nothing']
+
+        async def get_all():
+            return await asyncio.gather(*[
+                self.backend.aget_group_dns(username)
+                for username in usernames])
+
+        self.assertEqual(
+            async_to_sync(get_all)(),
+            [self.backend.get_group_dns(username) for username in usernames])
+
+
+class TestPooledCircuitBreakerBackend(TestCase):
+    """Looks groups up in a mock directory, through the pool and breaker."""
+
+    class TestBackend(NestedLDAPGroupsBackend):
+        use_reconnecting_client = True
+        ldap_pool_size = 2
+        ldap_circuit_breaker = True
+
+    @classmethod
+    def setUpClass(cls):
+        super(TestPooledCircuitBreakerBackend, cls).setUpClass()
+        cls.mockldap = mock_ldap_setup(
+            ldap_dc='dc=test',
+            extra_users=directory.test_users,
+            group_lineage=directory.group_lineage)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.mockldap
+        super(TestPooledCircuitBreakerBackend, cls).tearDownClass()
+
+    def setUp(self):
+        self.mockldap.start()
+        self.addCleanup(self.mockldap.stop)
+        for name in ['_connection_pools', '_circuit_breakers']:
+            patcher = patch('baya.backend.%s' % name, {})
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.ldap_object = self.mockldap['ldap://localhost']
+
+    @override_settings(BAYA_LDAP_BREAKER_FAILURE_THRESHOLD=2)
+    def test_group_lookups(self):
+        backend = self.TestBackend()
+        for _ in range(3):
+            self.assertEqual(
+                backend.get_group_dns('has_aa'),
+                {group_dn('aa', 'dc=test'), group_dn('aaa', 'dc=test')})
+        # The lookups shared a connection, and its bind.
+        self.assertEqual(
+            self.ldap_object.methods_called().count('simple_bind_s'), 1)
+        self.assertEqual(
+            get_circuit_breaker_stats()['ldap://localhost']['failures'], 0)
+
+        # django-auth-ldap ignores failed searches, but they're still
+        # outages, and open the breaker.
+        with patch.object(self.ldap_object, 'search_s',
+                          side_effect=ldap.TIMEOUT) as search_s:
+            for _ in range(2):
+                self.assertRaises(ldap.TIMEOUT, backend.get_group_dns,
+                                  'has_aa')
+            self.assertRaises(CircuitOpenError, backend.get_group_dns,
+                              'has_aa')
+        self.assertEqual(search_s.call_count, 2)
+
+
+class TestRunInLDAPExecutor(TestCase):
+    def setUp(self):
+        patcher = patch('baya.backend._ldap_executor', None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @override_settings(BAYA_LDAP_MAX_WORKERS=2)
+    def test_bounded(self):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def ldap_call(value):
+            with lock:
+                running.append(value)
+                max_running.append(len(running))
+            time.sleep(0.05)
+            with lock:
+                running.remove(value)
+            return threading.current_thread(), value
+
+        async def run_all():
+            return await asyncio.gather(*[
+                run_in_ldap_executor(ldap_call, value) for value in range(4)])
+
+        results = async_to_sync(run_all)()
+        self.assertEqual([value for _, value in results], list(range(4)))
+        self.assertNotIn(threading.current_thread(),
+                         [thread for thread, _ in results])
+        self.assertEqual(max(max_running), 2)
+        get_ldap_executor().shutdown()
@@ -21,12 +21,16 @@ from ..mock_ldap_helpers import mock_ldap_setup
 
 
 class LDAPGroupAuthTestBase(TestCase):
+    # See mock_ldap_directory.
+    member_of_dns = False
+
     @classmethod
     def setUpClass(cls):
         cls.mockldap = mock_ldap_setup(
             ldap_dc='dc=test',
             extra_users=directory.test_users,
-            group_lineage=directory.group_lineage)
+            group_lineage=directory.group_lineage,
+            member_of_dns=cls.member_of_dns)
 
     @classmethod
     def tearDownClass(cls):
@@ -0,0 +1,98 @@
+import csv
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from django.core.management import call_command
+from mock import patch
+
+from ..backend import NestedLDAPGroupsBackend
+from ..management.commands.baya_audit import _resolve_role_sets
+from .test_base import LDAPGroupAuthTestBase
+
+
+class TestBayaAudit(LDAPGroupAuthTestBase):
+    def _call(self, *args):
+        stdout = StringIO()
+        call_command('baya_audit', *args, stdout=stdout)
+        return stdout.getvalue()
+
+    def _csv_rows(self, *args):
+        rows = list(csv.DictReader(StringIO(self._call(*args))))
+        return {(row['view'], row['method']): row for row in rows}
+
+    def test_csv(self):
+        rows = self._csv_rows()
+        index = rows[('index', 'get')]
+        self.assertEqual(index['expression'], '{aa}')
+        self.assertEqual(index['allowed_groups'], 'aa')
+        self.assertNotIn('allowed_users', index)
+        self.assertEqual(rows[('login', 'get')]['expression'], 'ungated')
+        self.assertEqual(
+            rows[('query_param_view', 'get')]['allowed_groups'], 'dynamic')
+
+    def test_admin_site(self):
+        rows = self._csv_rows('--method', 'get')
+        self.assertIn(('example:index', 'get'), rows)
+        self.assertNotIn(('example:index', 'post'), rows)
+
+    def test_jsonl(self):
+        rows = [json.loads(line)
+                for line in self._call('--format', 'jsonl').splitlines()]
+        index = [row for row in rows
+                 if row['view'] == 'index' and row['method'] == 'get'][0]
+        self.assertEqual(index['allowed_groups'],
+                         [{'requires': ['aa'], 'excludes': []}])
+
+    def test_users(self):
+        rows = self._csv_rows('--users', 'has_aa', 'has_aaa', 'has_nothing')
+        self.assertEqual(rows[('index', 'get')]['allowed_users'], 'has_aa')
+        self.assertEqual(rows[('login', 'get')]['allowed_users'], '')
+        self.assertEqual(
+            rows[('query_param_view', 'get')]['allowed_users'], 'dynamic')
+
+    def test_resolve_role_sets(self):
+        self.assertEqual(
+            _resolve_role_sets(['has_aa', 'unknown']),
+            [('has_aa', ['aa', 'aaa']), ('unknown', [])])
+
+    def test_chunks(self):
+        with patch.object(NestedLDAPGroupsBackend, 'get_group_dns',
+                          return_value=set()) as get_group_dns:
+            self._call('--users', 'u1', 'u2', 'u3', '--chunk-size', '2')
+        self.assertEqual(get_group_dns.call_count, 3)
+
+    def test_processes(self):
+        users = ['--users', 'has_aa', 'has_aaa', 'has_nothing',
+                 '--chunk-size', '1']
+        expected = self._csv_rows(*users)
+        # Threads stand in for the worker processes, which wouldn't see the
+        # mock LDAP server.
+        with patch('baya.management.commands.baya_audit.ProcessPoolExecutor',
+                   wraps=ThreadPoolExecutor) as executor:
+            rows = self._csv_rows('--processes', '2', *users)
+        executor.assert_called_once_with(max_workers=2)
+        self.assertEqual(rows, expected)
+
+    def test_processes_shut_down_on_error(self):
+        executors = []
+
+        def make_executor(**kwargs):
+            executor = ThreadPoolExecutor(**kwargs)
+            executors.append(executor)
+            return executor
+
+        with patch('baya.management.commands.baya_audit.ProcessPoolExecutor',
+                   make_executor), \
+                patch.object(NestedLDAPGroupsBackend, 'get_group_dns',
+                             side_effect=RuntimeError):
+            self.assertRaises(RuntimeError, self._call,
+                              '--users', 'u1', '--processes', '2')
+        self.assertTrue(executors[0]._shutdown)
+
+    def test_gate_errors_are_raised(self):
+        # Only DynamicRolesNodes are reported as dynamic, other errors in
+        # a Gate's nodes aren't hidden.
+        with patch('baya.management.commands.baya_audit.minimal_group_sets',
+                   side_effect=TypeError):
+            self.assertRaises(TypeError, self._call)
@@ -0,0 +1,125 @@
+from itertools import product
+from unittest import TestCase
+
+from mock import MagicMock
+
+from ..cover import GroupSet
+from ..cover import groups_to_grant
+from ..cover import minimal_group_sets
+from ..dynamic_roles import DjangoRequestGroupFormatter
+from ..membership import DynamicRolesNode as dg
+from ..membership import RolesNode as g
+from ..permissions import ALLOW_ALL
+from ..permissions import DENY_ALL
+from ..visitors import PermissionChecker
+
+
+def _set(requires=(), excludes=()):
+    return GroupSet(frozenset(requires), frozenset(excludes))
+
+
+class TestMinimalGroupSets(TestCase):
+    def setUp(self):
+        self.a = g('A')
+        self.b = g('B')
+        self.c = g('C')
+
+    def _assert_equivalent(self, node, roles=('a', 'b', 'c')):
+        """Every truth assignment agrees with the PermissionChecker."""
+        group_sets = minimal_group_sets(node)
+        for values in product([False, True], repeat=len(roles)):
+            user_roles = {role for role, value in zip(roles, values) if value}
+            self.assertEqual(
+                any(gs.is_satisfied_by(user_roles) for gs in group_sets),
+                PermissionChecker(user_roles).visit(node),
+                "%r %s" % (node, user_roles))
+
+    def test_roles(self):
+        self.assertEqual(minimal_group_sets(g('A', 'B')), (_set('ab'),))
+
+    def test_values(self):
+        self.assertEqual(minimal_group_sets(ALLOW_ALL), (_set(),))
+        self.assertEqual(minimal_group_sets(DENY_ALL), ())
+        self.assertEqual(minimal_group_sets(DENY_ALL | self.a), (_set('a'),))
+
+    def test_or_cheapest_first(self):
+        node = (self.a & self.b) | self.c
+        self.assertEqual(minimal_group_sets(node),
+                         (_set('c'), _set('ab')))
+
+    def test_absorption(self):
+        node = self.a | (self.a & self.b)
+        self.assertEqual(minimal_group_sets(node), (_set('a'),))
+
+    def test_invert(self):
+        self.assertEqual(minimal_group_sets(~self.a), (_set((), 'a'),))
+        self.assertEqual(minimal_group_sets(~(self.a & self.b)),
+                         (_set((), 'a'), _set((), 'b')))
+        self.assertEqual(minimal_group_sets(~g('A', 'B')),
+                         (_set((), 'a'), _set((), 'b')))
+
+    def test_xor(self):
+        self.assertEqual(minimal_group_sets(self.a ^ self.b),
+                         (_set('a', 'b'), _set('b', 'a')))
+        self.assertEqual(minimal_group_sets(~(self.a ^ self.b)),
+                         (_set((), 'ab'), _set('ab')))
+
+    def test_contradiction(self):
+        self.assertEqual(minimal_group_sets(self.a & ~self.a), ())
+
+    def test_merge(self):
+        node = (self.a & self.b) | (self.a & ~self.b)
+        self.assertEqual(minimal_group_sets(node), (_set('a'),))
+
+    def test_equivalent(self):
+        a, b, c = self.a, self.b, self.c
+        for node in [a & b | c, ~(a | b) & c, (a ^ b) ^ c, ~(a ^ b) | c,
+                     (a & b) ^ (b | ~c), ~((a | ~b) & (b ^ c))]:
+            self._assert_equivalent(node)
+
+    def test_max_terms(self):
+        node = g('x0') | g('y0')
+        for i in range(1, 10):
+            node &= g('x%d' % i) | g('y%d' % i)
+        with self.assertRaises(ValueError):
+            minimal_group_sets(node, max_terms=64)
+        self.assertEqual(len(minimal_group_sets(node, max_terms=1024)),
+                         2 ** 10)
+
+    def test_cached(self):
+        node = self.a | self.b
+        self.assertIs(minimal_group_sets(node), minimal_group_sets(node))
+
+    def test_dynamic(self):
+        node = self.a & dg(DjangoRequestGroupFormatter('%s_admin', 'group'))
+        with self.assertRaises(TypeError):
+            minimal_group_sets(node)
+        request = MagicMock()
+        request.resolver_match.kwargs = {'group': 'b'}
+        request.GET = {}
+        self.assertEqual(minimal_group_sets(node, request=request),
+                         (_set(['a', 'b_admin']),))
+
+
+class TestGroupsToGrant(TestCase):
+    def test_missing_groups(self):
+        node = (g('A') & g('B')) | g('C', 'D')
+        self.assertEqual(groups_to_grant(node, []),
+                         [{'a', 'b'}, {'c', 'd'}])
+        self.assertEqual(groups_to_grant(node, ['A']),
+                         [{'b'}, {'c', 'd'}])
+        self.assertEqual(groups_to_grant(node, ['c']), [{'d'}, {'a', 'b'}])
+
+    def test_already_allowed(self):
+        self.assertEqual(groups_to_grant(g('A') | g('B'), ['b']),
+                         [frozenset()])
+
+    def test_supersets_dropped(self):
+        node = (g('A') & g('B')) | (g('A') & g('C') & g('D'))
+        self.assertEqual(groups_to_grant(node, ['a', 'c']), [{'b'}, {'d'}])
+        self.assertEqual(groups_to_grant(node, ['b']), [{'a'}])
+
+    def test_excluded(self):
+        node = g('A') & ~g('B')
+        self.assertEqual(groups_to_grant(node, []), [{'a'}])
+        self.assertEqual(groups_to_grant(node, ['b']), [])
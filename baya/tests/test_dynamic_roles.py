@@ -1,9 +1,23 @@
+from asgiref.sync import async_to_sync
 from mock import MagicMock
 from mock import patch
 
 from unittest import TestCase
 
+from django.core.cache import cache
+from django.db import connection
+from django.http import Http404
+from django.test import TestCase as DjangoTestCase
+from django.test.utils import CaptureQueriesContext
+
 from ..dynamic_roles import DjangoRequestGroupFormatter
+from ..dynamic_roles import DynamicRoleCallable
+from ..dynamic_roles import ModelFieldGroupFormatter
+from ..membership import DynamicRolesNode
+from .models import Blag
+from .models import BlagEntry
+from .models import Tag
+from .models import TaggedEntry
 
 
 class TestDjangoRequestGroupFormatter(TestCase):
@@ -59,3 +73,217 @@ class TestDjangoRequestGroupFormatter(TestCase):
     def test_repr(self):
         re = repr(self.formatter)
         self.assertIn(self.formatter.__class__.__name__, re)
+
+
+class TestModelFieldGroupFormatter(DjangoTestCase):
+    def setUp(self):
+        self.formatter = ModelFieldGroupFormatter(
+            BlagEntry, 'blag__name', "%s_editor", 'entry_id')
+        self.food = Blag.objects.create(name='food')
+        self.travel = Blag.objects.create(name='travel')
+        self.entries = [
+            BlagEntry.objects.create(blag=blag, title=str(i), body='')
+            for i, blag in enumerate([self.food, self.travel, self.food])]
+
+    def _user(self, *groups):
+        user = MagicMock()
+        user.ldap_user.group_dns = [
+            'cn=%s,ou=access,dc=test' % group for group in groups]
+        return user
+
+    def _request(self, entry_id):
+        request = MagicMock()
+        request.resolver_match.kwargs = {'entry_id': entry_id}
+        request.GET = {}
+        return request
+
+    def test_call(self):
+        self.assertEqual(self.formatter(self._request(self.entries[0].pk)),
+                         {'food_editor'})
+        self.assertRaises(Http404, self.formatter, self._request(-1))
+
+    def test_roles_for_object(self):
+        self.assertEqual(self.formatter.roles_for_object(self.entries[1]),
+                         {'travel_editor'})
+
+    def test_field_values(self):
+        self.assertEqual(
+            self.formatter.field_values(
+                {'food_editor', 'Travel_Editor', 'food', '_editor'}),
+            {'food', 'travel'})
+
+    def test_filter_queryset(self):
+        queryset = BlagEntry.objects.order_by('pk')
+        with CaptureQueriesContext(connection) as queries:
+            entries = list(self.formatter.filter_queryset(
+                queryset, self._user('food_editor', 'other')))
+        self.assertEqual(entries, [self.entries[0], self.entries[2]])
+        self.assertEqual(len(queries), 1)
+
+        self.assertEqual(
+            list(self.formatter.filter_queryset(
+                queryset, self._user('TRAVEL_editor'))),
+            [self.entries[1]])
+        self.assertEqual(
+            list(self.formatter.filter_queryset(queryset, self._user('a'))),
+            [])
+
+    def test_filter_queryset_ignore_case(self):
+        Blag.objects.filter(pk=self.travel.pk).update(name='Travel')
+        queryset = BlagEntry.objects.order_by('pk')
+        self.assertEqual(
+            list(self.formatter.filter_queryset(
+                queryset, self._user('travel_editor'))),
+            [])
+        formatter = ModelFieldGroupFormatter(
+            BlagEntry, 'blag__name', "%s_editor", 'entry_id',
+            ignore_case=True)
+        self.assertEqual(
+            list(formatter.filter_queryset(
+                queryset, self._user('travel_editor'))),
+            [self.entries[1]])
+
+    def test_filter_queryset_multivalued(self):
+        formatter = ModelFieldGroupFormatter(
+            TaggedEntry, 'tags__name', "%s_editor", 'entry_id')
+        a, b = Tag.objects.create(name='a'), Tag.objects.create(name='b')
+        only_a = TaggedEntry.objects.create(title='a')
+        only_a.tags.add(a)
+        both = TaggedEntry.objects.create(title='ab')
+        both.tags.add(a, b)
+        TaggedEntry.objects.create(title='untagged')
+        self.assertEqual(formatter(self._request(both.pk)),
+                         {'a_editor', 'b_editor'})
+
+        queryset = TaggedEntry.objects.order_by('pk')
+        # Like the check, every tag's group is needed.
+        with CaptureQueriesContext(connection) as queries:
+            entries = list(formatter.filter_queryset(
+                queryset, self._user('a_editor')))
+        self.assertEqual(entries, [only_a])
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(
+            list(formatter.filter_queryset(
+                queryset, self._user('a_editor', 'b_editor'))),
+            [only_a, both])
+        self.assertEqual(
+            list(formatter.filter_queryset(queryset, self._user('b_editor'))),
+            [])
+
+    def test_invalid_format(self):
+        self.assertRaises(ValueError, ModelFieldGroupFormatter,
+                          BlagEntry, 'blag__name', "editors")
+
+    def test_repr(self):
+        self.assertEqual(
+            repr(self.formatter),
+            "ModelFieldGroupFormatter(BlagEntry, blag__name, %s_editor, "
+            "entry_id)")
+
+    def test_callable_key(self):
+        self.assertIn("'tests.BlagEntry'", self.formatter.get_callable_key())
+        # Same named models in other apps don't share cached roles.
+        other_model = MagicMock(__name__='BlagEntry')
+        other_model._meta.label = 'other.BlagEntry'
+        other = ModelFieldGroupFormatter(
+            other_model, 'blag__name', "%s_editor", 'entry_id')
+        self.assertEqual(repr(other), repr(self.formatter))
+        self.assertNotEqual(other.get_callable_key(),
+                            self.formatter.get_callable_key())
+
+
+class CountingCallable(DynamicRoleCallable):
+    cache_timeout = 60
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, key, **kwargs):
+        self.calls += 1
+        return {'%s_%s' % (key, self.calls)}
+
+    def get_cache_key(self, key, **kwargs):
+        return key
+
+    def get_callable_key(self):
+        return 'CountingCallable()'
+
+
+class AsyncCountingCallable(CountingCallable):
+    async def __call__(self, key, **kwargs):
+        return super(AsyncCountingCallable, self).__call__(key, **kwargs)
+
+
+class TestDynamicRoleCache(DjangoTestCase):
+    def setUp(self):
+        cache.clear()
+        self.roles = CountingCallable()
+
+    def test_cached(self):
+        node = DynamicRolesNode(self.roles)
+        self.assertEqual(node.get_roles_set(key='a'), {'a_1'})
+        self.assertEqual(node.get_roles_set(key='a'), {'a_1'})
+        self.assertEqual(node.get_roles_set(key='b'), {'b_2'})
+        # Callables with the same callable key share the cache.
+        self.assertEqual(CountingCallable().get_cached_roles(key='a'),
+                         {'a_1'})
+
+    def test_async_cached(self):
+        roles = AsyncCountingCallable()
+        node = DynamicRolesNode(roles)
+        self.assertEqual(async_to_sync(node.aget_roles_set)(key='a'),
+                         {'a_1'})
+        self.assertEqual(async_to_sync(node.aget_roles_set)(key='a'),
+                         {'a_1'})
+        self.assertEqual(node.get_roles_set(key='a'), {'a_1'})
+        self.assertEqual(roles.calls, 1)
+
+    def test_not_cached(self):
+        self.roles.cache_timeout = None
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_1'})
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_2'})
+        self.roles.cache_timeout = 60
+        self.roles.get_cache_key = lambda key: None
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_3'})
+
+    def test_no_callable_key(self):
+        self.roles.get_callable_key = lambda: None
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_1'})
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_2'})
+
+    def test_invalidate(self):
+        self.roles.get_cached_roles(key='a')
+        self.roles.get_cached_roles(key='b')
+        self.roles.invalidate('a')
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_3'})
+        self.assertEqual(self.roles.get_cached_roles(key='b'), {'b_2'})
+        self.roles.invalidate()
+        self.assertEqual(self.roles.get_cached_roles(key='a'), {'a_4'})
+        self.assertEqual(self.roles.get_cached_roles(key='b'), {'b_5'})
+
+    def test_model_field_formatter(self):
+        formatter = ModelFieldGroupFormatter(
+            BlagEntry, 'blag__name', "%s_editor", 'entry_id',
+            cache_timeout=60)
+        formatter.invalidate_on_save(Blag)
+        blag = Blag.objects.create(name='food')
+        entry = BlagEntry.objects.create(blag=blag, title='', body='')
+        request = MagicMock()
+        request.resolver_match.kwargs = {'entry_id': str(entry.pk)}
+        request.GET = {}
+
+        def check(expected_roles, expected_queries):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(formatter.get_cached_roles(request=request),
+                                 expected_roles)
+            self.assertEqual(len(queries), expected_queries)
+
+        check({'food_editor'}, 1)
+        check({'food_editor'}, 0)
+        entry.blag = Blag.objects.create(name='travel')
+        entry.save()
+        check({'travel_editor'}, 1)
+        Blag.objects.filter(pk=entry.blag_id).update(name='other')
+        check({'travel_editor'}, 0)
+        Blag.objects.get(pk=entry.blag_id).save()
+        check({'other_editor'}, 1)
@@ -0,0 +1,216 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.db import connections
+from django.test import override_settings
+from mock import MagicMock
+from mock import patch
+from unittest import TestCase
+
+from ..evaluation import ConcurrentPermissionChecker
+from ..evaluation import PartialEvaluator
+from ..evaluation import aevaluate
+from ..evaluation import is_enabled
+from ..evaluation import split_dynamic_roles_node
+from ..membership import DynamicRolesNode as dg
+from ..membership import RolesNode as g
+from ..membership import ValueNode
+
+
+class TestPartialEvaluator(TestCase):
+    def setUp(self):
+        self.d1 = dg(lambda **kwargs: {'a'})
+        self.d2 = dg(lambda **kwargs: {'b'})
+
+    def _visit(self, node, roles=('a',), resolved=None):
+        return PartialEvaluator(roles, resolved or {}).visit(node)
+
+    def test_static(self):
+        self.assertEqual(self._visit(g('a') & ~g('b')), (True, frozenset()))
+        self.assertEqual(self._visit(g('b') ^ ValueNode(True)),
+                         (True, frozenset()))
+
+    def test_unknown(self):
+        self.assertEqual(self._visit(self.d1 | self.d2),
+                         (None, frozenset([self.d1, self.d2])))
+        self.assertEqual(self._visit(~self.d1), (None, frozenset([self.d1])))
+        self.assertEqual(self._visit(g('a') ^ self.d1),
+                         (None, frozenset([self.d1])))
+
+    def test_short_circuit(self):
+        self.assertEqual(self._visit(g('a') | self.d1), (True, frozenset()))
+        self.assertEqual(self._visit(self.d1 & g('b')), (False, frozenset()))
+        self.assertEqual(self._visit(g('a') & self.d1 | self.d2),
+                         (None, frozenset([self.d1, self.d2])))
+        self.assertEqual(self._visit(g('b') & self.d1 | self.d2),
+                         (None, frozenset([self.d2])))
+
+    def test_split(self):
+        node = self.d1 & self.d2
+        d1, d2 = sorted(split_dynamic_roles_node(node),
+                        key=lambda leaf: leaf == self.d2)
+        self.assertEqual((d1, d2), (self.d1, self.d2))
+        self.assertEqual(self._visit(node), (None, frozenset([d1, d2])))
+        self.assertEqual(self._visit(node, resolved={d2: {'b'}}),
+                         (False, frozenset()))
+        self.assertEqual(self._visit(node, ['a', 'b'], {d1: {'a'}}),
+                         (None, frozenset([d2])))
+        self.assertEqual(
+            self._visit(node, ['a', 'b'], {d1: {'a'}, d2: {'b'}}),
+            (True, frozenset()))
+
+    def test_resolved(self):
+        node = self.d1 | self.d2
+        self.assertEqual(self._visit(node, resolved={self.d1: {'a'}}),
+                         (True, frozenset()))
+        self.assertEqual(self._visit(node, resolved={self.d1: {'b'}}),
+                         (None, frozenset([self.d2])))
+
+
+class TestConcurrentPermissionChecker(TestCase):
+    def test_concurrent(self):
+        barrier = threading.Barrier(2, timeout=5)
+
+        def roles_callable(**kwargs):
+            # Both callables have to be running at once to get past this.
+            barrier.wait()
+            return {kwargs['role']}
+
+        def other_roles_callable(**kwargs):
+            barrier.wait()
+            return {'b'}
+
+        # A single node with two callables, which still run concurrently.
+        node = dg(roles_callable) & dg(other_roles_callable)
+        checker = ConcurrentPermissionChecker(['a', 'b'])
+        self.assertTrue(checker.visit(node, role='a'))
+        checker = ConcurrentPermissionChecker(['b'])
+        self.assertFalse(checker.visit(node, role='a'))
+
+    def test_not_called(self):
+        roles_callable = MagicMock(return_value={'a'})
+        node = g('a') | dg(roles_callable)
+        self.assertTrue(ConcurrentPermissionChecker(['a']).visit(node))
+        self.assertFalse(roles_callable.called)
+
+    def test_inline(self):
+        thread_ids = []
+
+        def roles_callable(**kwargs):
+            thread_ids.append(threading.get_ident())
+            return {'a'}
+
+        executor = MagicMock()
+        node = g('b') | dg(roles_callable)
+        self.assertTrue(
+            ConcurrentPermissionChecker(['a'], executor).visit(node))
+        self.assertEqual(thread_ids, [threading.get_ident()])
+        self.assertFalse(executor.submit.called)
+
+    def test_nested(self):
+        """Callables can check permissions without deadlocking the pool."""
+        def nested_callable(**kwargs):
+            inner = dg(lambda **kwargs: {'b'}) & dg(lambda **kwargs: {'c'})
+            checker = ConcurrentPermissionChecker(['b', 'c'])
+            return {'a'} if checker.visit(inner) else set()
+
+        node = dg(nested_callable) & dg(lambda **kwargs: {'d'})
+        results = []
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown, wait=False)
+        with patch('baya.evaluation.get_executor', return_value=executor):
+            thread = threading.Thread(target=lambda: results.append(
+                ConcurrentPermissionChecker(['a', 'd']).visit(node)))
+            thread.daemon = True
+            thread.start()
+            thread.join(5)
+        self.assertEqual(results, [True])
+
+    def _visit_opening_connection(self, conn_max_age):
+        def roles_callable(**kwargs):
+            connections['default'].ensure_connection()
+            return {'a'}
+
+        node = dg(roles_callable) | dg(lambda **kwargs: {'b'})
+        # sqlite ignores closing in memory databases, so spy on close.
+        with patch.dict(connections.settings['default'],
+                        CONN_MAX_AGE=conn_max_age), \
+                patch.object(type(connections['default']), 'close',
+                             autospec=True) as close:
+            executor = ThreadPoolExecutor(max_workers=1)
+            self.addCleanup(executor.shutdown)
+            self.assertTrue(
+                ConcurrentPermissionChecker(['a'], executor).visit(node))
+        return close.called
+
+    def test_closes_old_connections(self):
+        self.assertTrue(self._visit_opening_connection(0))
+
+    def test_keeps_persistent_connections(self):
+        self.assertFalse(self._visit_opening_connection(None))
+
+    def test_atomic_block(self):
+        thread_ids = {}
+
+        def orm_callable(**kwargs):
+            thread_ids['orm'] = threading.get_ident()
+            return {'a'}
+
+        def other_callable(**kwargs):
+            thread_ids['other'] = threading.get_ident()
+            return {'b'}
+        other_callable.thread_sensitive = False
+
+        node = dg(orm_callable) | dg(other_callable)
+        with patch('baya.evaluation._in_atomic_block', return_value=True):
+            self.assertFalse(ConcurrentPermissionChecker([]).visit(node))
+        self.assertEqual(thread_ids['orm'], threading.get_ident())
+        self.assertNotEqual(thread_ids['other'], threading.get_ident())
+
+    def test_exception(self):
+        def roles_callable(**kwargs):
+            raise ValueError()
+
+        node = dg(roles_callable) | dg(lambda **kwargs: {'b'})
+        with self.assertRaises(ValueError):
+            ConcurrentPermissionChecker(['a']).visit(node)
+
+    def test_not_set(self):
+        node = dg(lambda **kwargs: ['a']) | dg(lambda **kwargs: {'b'})
+        with self.assertRaises(RuntimeError):
+            ConcurrentPermissionChecker(['a']).visit(node)
+
+
+class TestAevaluate(TestCase):
+    def test_aevaluate(self):
+        cancelled = []
+
+        async def fast(**kwargs):
+            return {kwargs['role']}
+
+        async def slow(**kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return set()
+
+        node = dg(fast) | dg(slow)
+        self.assertTrue(async_to_sync(aevaluate)(node, ['a'], role='a'))
+        self.assertEqual(cancelled, [True])
+
+    def test_static(self):
+        roles_callable = MagicMock(return_value={'a'})
+        node = g('b') & dg(roles_callable)
+        self.assertFalse(async_to_sync(aevaluate)(node, ['a']))
+        self.assertFalse(roles_callable.called)
+
+
+class TestIsEnabled(TestCase):
+    def test_is_enabled(self):
+        self.assertFalse(is_enabled())
+        with override_settings(BAYA_CONCURRENT_DYNAMIC_ROLES=True):
+            self.assertTrue(is_enabled())
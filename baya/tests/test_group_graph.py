@@ -0,0 +1,285 @@
+import datetime
+import re
+import threading
+from unittest import TestCase
+
+import ldap
+from django_auth_ldap.config import LDAPSearch
+from mock import Mock
+from mock import patch
+
+from . import directory
+from ..group_graph import GroupGraph
+from ..group_graph import GroupGraphCache
+from ..group_graph import get_group_graph
+from ..mock_ldap_helpers import group_dn
+from ..mock_ldap_helpers import mock_ldap_directory
+
+
+def _group_infos(**kwargs):
+    return [(dn, attrs) for dn, attrs in mock_ldap_directory(**kwargs).items()
+            if 'groupOfNames' in attrs.get('objectClass', [])]
+
+
+def _dns(*names):
+    return {group_dn(name, 'dc=test') for name in names}
+
+
+class TestGroupGraph(TestCase):
+    def setUp(self):
+        self.graph = GroupGraph(_group_infos(
+            ldap_dc='dc=test',
+            extra_users=directory.test_users,
+            group_lineage=directory.group_lineage))
+
+    def test_closure(self):
+        self.assertEqual(self.graph.closure(_dns('a')),
+                         _dns('a', 'aa', 'ab', 'aaa'))
+        self.assertEqual(self.graph.closure(_dns('aa')), _dns('aa', 'aaa'))
+        self.assertEqual(self.graph.closure(_dns('a_admin', 'b')),
+                         _dns('a_admin', 'a', 'aa', 'ab', 'aaa', 'b'))
+        self.assertEqual(self.graph.closure(_dns('nothing')), _dns('nothing'))
+
+    def test_case_insensitive(self):
+        self.assertEqual(self.graph.closure(['CN=AA,ou=Access,dc=test']),
+                         _dns('aa', 'aaa'))
+        self.assertIn('CN=AA,ou=Access,dc=test', self.graph)
+
+    def test_unknown(self):
+        self.assertEqual(self.graph.closure(['cn=unknown,ou=other']), set())
+
+    def test_parents(self):
+        self.assertEqual(self.graph.parents(group_dn('a', 'dc=test')),
+                         _dns('aa', 'ab'))
+        self.assertEqual(self.graph.parents(group_dn('aaa', 'dc=test')),
+                         frozenset())
+
+    def test_group_info(self):
+        dn, attrs = self.graph.group_info(group_dn('aa', 'dc=test'))
+        self.assertEqual(dn, group_dn('aa', 'dc=test'))
+        self.assertEqual(attrs['cn'], ['aa'])
+
+    def test_cycle(self):
+        graph = GroupGraph(_group_infos(
+            ldap_dc='dc=test', extra_users=[('user', 'x')],
+            group_lineage=[('x', 'y'), ('y', 'z'), ('z', 'x')]))
+        self.assertEqual(graph.closure(_dns('x')), _dns('x', 'y', 'z'))
+        self.assertEqual(graph.closure(_dns('z')), _dns('x', 'y', 'z'))
+
+
+class TestGroupGraphCache(TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = GroupGraphCache(ttl=60, clock=lambda: self.now)
+
+    def test_ttl(self):
+        load = Mock(side_effect=lambda: object())
+        graph = self.cache.get('key', load)
+        self.now = 59
+        self.assertIs(self.cache.get('key', load), graph)
+        self.assertIsNot(self.cache.get('other', load), graph)
+        self.now = 60
+        self.assertIsNot(self.cache.get('key', load), graph)
+        self.assertEqual(load.call_count, 3)
+
+    def test_clear(self):
+        load = Mock(side_effect=lambda: object())
+        graph = self.cache.get('key', load)
+        self.cache.clear()
+        self.assertIsNot(self.cache.get('key', load), graph)
+
+    def test_get_group_graph(self):
+        group_search = Mock(spec=['base_dn', 'scope', 'filterstr', 'execute'],
+                            base_dn='ou=Access', scope=2, filterstr='(cn=*)')
+        group_search.execute.return_value = [('cn=a,ou=Access', {})]
+        connection = Mock()
+        with patch('baya.group_graph.group_graphs', self.cache):
+            graph = get_group_graph(lambda: connection, group_search)
+            self.assertIs(get_group_graph(Mock(), group_search), graph)
+        self.assertIn('cn=a,ou=access', graph)
+        group_search.execute.assert_called_once_with(connection)
+
+    def test_get_group_graph_sync(self):
+        group_search = Mock(
+            spec=['base_dn', 'scope', 'filterstr', 'execute',
+                  'search_with_additional_term_string'],
+            base_dn='ou=Access', scope=2, filterstr='(cn=*)')
+        group_search.execute.return_value = []
+        search = group_search.search_with_additional_term_string.return_value
+        search.execute.return_value = []
+        sync_connection = Mock()
+        self.cache = GroupGraphCache(ttl=60, sync_interval=0,
+                                     clock=lambda: self.now)
+        self.addCleanup(self.cache.shutdown)
+        with patch('baya.group_graph.group_graphs', self.cache):
+            get_group_graph(Mock(), group_search,
+                            sync_connection=lambda: sync_connection)
+            self.cache.shutdown()
+        search.execute.assert_called_once_with(sync_connection)
+        sync_connection.unbind_s.assert_called_once_with()
+
+
+class TestGroupGraphUpdate(TestCase):
+    def setUp(self):
+        self.group_infos = dict(_group_infos(
+            ldap_dc='dc=test',
+            extra_users=directory.test_users,
+            group_lineage=directory.group_lineage))
+        self.graph = GroupGraph(self.group_infos.items())
+
+    def _members(self, name, *member_names):
+        dn = group_dn(name, 'dc=test')
+        attrs = dict(self.group_infos.get(dn, {'cn': [name]}))
+        attrs['member'] = [group_dn(member, 'dc=test')
+                           for member in member_names]
+        return dn, attrs
+
+    def test_add_member(self):
+        self.assertEqual(self.graph.closure(_dns('b')), _dns('b'))
+        self.assertEqual(self.graph.closure(_dns('a')),
+                         _dns('a', 'aa', 'ab', 'aaa'))
+        changed = self.graph.update([self._members('aaa', 'aa', 'b')])
+        self.assertEqual(changed, _dns('b'))
+        self.assertEqual(self.graph.closure(_dns('b')), _dns('b', 'aaa'))
+        # Closures without b aren't recomputed.
+        self.assertIn(group_dn('a', 'dc=test'), self.graph._closures)
+
+    def test_remove_member(self):
+        self.assertEqual(self.graph.closure(_dns('a_admin')),
+                         _dns('a_admin', 'a', 'aa', 'ab', 'aaa'))
+        self.graph.update([self._members('aa')])
+        self.assertEqual(self.graph.closure(_dns('a_admin')),
+                         _dns('a_admin', 'a', 'ab'))
+        self.assertEqual(self.graph.closure(_dns('aa')), _dns('aa', 'aaa'))
+
+    def test_new_groups(self):
+        self.graph.update([self._members('c', 'b'), self._members('cc', 'c')])
+        self.assertEqual(self.graph.closure(_dns('b')), _dns('b', 'c', 'cc'))
+        # A group listed by a known group before it exists.
+        self.graph.update([self._members('e', 'd')])
+        self.assertEqual(self.graph.closure(_dns('d')), set())
+        self.graph.update([self._members('d')])
+        self.assertEqual(self.graph.closure(_dns('d')), _dns('d', 'e'))
+
+
+class FakeDirectoryConnection(object):
+    """Searches a mock_ldap_directory for groups, by modifyTimestamp."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.filterstrs = []
+
+    def search_s(self, base, scope, filterstr, attrlist=None):
+        self.filterstrs.append(filterstr)
+        match = re.search(r'\(modifyTimestamp>=(\d+Z)\)', filterstr)
+        return [
+            (dn, attrs) for dn, attrs in self.directory.items()
+            if dn.endswith(base.lower()) and
+            'groupOfNames' in attrs.get('objectClass', []) and
+            (match is None or
+             attrs['modifyTimestamp'][0] >= match.group(1))]
+
+
+class TestGroupGraphSync(TestCase):
+    def setUp(self):
+        self.now = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        self.directory = mock_ldap_directory(
+            ldap_dc='dc=test',
+            extra_users=directory.test_users,
+            group_lineage=directory.group_lineage)
+        for attrs in self.directory.values():
+            attrs['modifyTimestamp'] = [self._timestamp()]
+        self.connection = FakeDirectoryConnection(self.directory)
+        self.group_search = LDAPSearch(
+            'ou=Access,dc=test', ldap.SCOPE_SUBTREE,
+            '(objectClass=groupOfNames)')
+        self.graph = GroupGraph.load(
+            self.connection, self.group_search, now=lambda: self.now)
+
+    def _timestamp(self):
+        return self.now.strftime('%Y%m%d%H%M%SZ')
+
+    def _sync(self):
+        return self.graph.sync(self.connection, self.group_search,
+                               now=lambda: self.now, overlap=0)
+
+    def test_sync(self):
+        self.assertEqual(self.graph.closure(_dns('b')), _dns('b'))
+        self.now += datetime.timedelta(minutes=1)
+        self.assertEqual(self._sync(), set())
+        self.assertIn('(modifyTimestamp>=20200101000000Z)',
+                      self.connection.filterstrs[-1])
+
+        self.now += datetime.timedelta(minutes=1)
+        dn = group_dn('ab', 'dc=test')
+        self.directory[dn] = dict(
+            self.directory[dn],
+            member=self.directory[dn]['member'] + [group_dn('b', 'dc=test')],
+            modifyTimestamp=[self._timestamp()])
+        self.now += datetime.timedelta(seconds=5)
+        self.assertEqual(self._sync(), _dns('b'))
+        self.assertIn('(modifyTimestamp>=20200101000100Z)',
+                      self.connection.filterstrs[-1])
+        self.assertEqual(self.graph.closure(_dns('b')), _dns('b', 'ab'))
+
+    def test_never_synced(self):
+        self.assertRaises(ValueError, GroupGraph([]).sync,
+                          self.connection, self.group_search)
+
+    def test_cache(self):
+        now = [0]
+        cache = GroupGraphCache(ttl=300, sync_interval=30,
+                                clock=lambda: now[0])
+        self.addCleanup(cache.shutdown)
+        sync = Mock()
+        graph = cache.get('key', lambda: self.graph, sync)
+        self.assertFalse(sync.called)
+        now[0] = 30
+        self.assertIs(cache.get('key', Mock(), sync), graph)
+        cache.shutdown()
+        sync.assert_called_once_with(graph)
+        now[0] = 59
+        cache.get('key', Mock(), sync)
+        cache.shutdown()
+        self.assertEqual(sync.call_count, 1)
+        # Without a sync_interval, the graph is only reloaded.
+        cache = GroupGraphCache(ttl=300, clock=lambda: now[0])
+        cache.get('key', lambda: self.graph, sync)
+        now[0] = 200
+        cache.get('key', lambda: self.graph, sync)
+        self.assertEqual(sync.call_count, 1)
+
+    def test_background_sync(self):
+        now = [0]
+        cache = GroupGraphCache(ttl=300, sync_interval=30,
+                                clock=lambda: now[0])
+        self.addCleanup(cache.shutdown)
+        started = threading.Event()
+        finish = threading.Event()
+        syncs = []
+
+        def sync(graph):
+            syncs.append(threading.current_thread())
+            started.set()
+            finish.wait(5)
+            if len(syncs) == 1:
+                raise ldap.SERVER_DOWN()
+
+        graph = cache.get('key', lambda: self.graph, sync)
+        now[0] = 30
+        # The request doesn't wait for the sync, and others don't start
+        # another one.
+        self.assertIs(cache.get('key', Mock(), sync), graph)
+        self.assertTrue(started.wait(5))
+        cache.get('key', Mock(), sync)
+        finish.set()
+        cache.shutdown()
+        self.assertEqual(len(syncs), 1)
+        self.assertIsNot(syncs[0], threading.current_thread())
+        # A failed sync is tried again on the next get.
+        cache.get('key', Mock(), sync)
+        cache.shutdown()
+        self.assertEqual(len(syncs), 2)
+        cache.get('key', Mock(), sync)
+        cache.shutdown()
+        self.assertEqual(len(syncs), 2)
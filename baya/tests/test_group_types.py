@@ -0,0 +1,195 @@
+import ldap
+from django.test import TestCase
+from django_auth_ldap.config import LDAPSearch
+from django_auth_ldap.config import LDAPSearchUnion
+from mock import Mock
+from mock import patch
+
+from . import directory
+from ..group_graph import GroupGraph
+from ..group_graph import GroupGraphCache
+from ..group_types import BatchedNestedGroupOfNamesType
+from ..group_types import MemberOfGroupOfNamesType
+from ..mock_ldap_helpers import group_dn
+from ..mock_ldap_helpers import mock_ldap_directory
+from ..mock_ldap_helpers import mock_ldap_setup
+from ..mock_ldap_helpers import person_dn
+
+
+DC = 'dc=test'
+MIDDLE = ['middle%d' % i for i in range(30)]
+LEAVES = ['leaf%d' % i for i in range(3)]
+
+# In mock_ldap_directory, members of a parent group are in its children.
+GROUP_LINEAGE = (
+    [('root', middle) for middle in MIDDLE] +
+    [(middle, LEAVES[i % 3]) for i, middle in enumerate(MIDDLE)] +
+    [(leaf, 'end') for leaf in LEAVES])
+
+
+class TestBatchedNestedGroupOfNamesType(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestBatchedNestedGroupOfNamesType, cls).setUpClass()
+        cls.mockldap = mock_ldap_setup(
+            ldap_dc=DC,
+            extra_users=[('wide', 'root'), ('lonely', 'end')],
+            group_lineage=GROUP_LINEAGE)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.mockldap
+        super(TestBatchedNestedGroupOfNamesType, cls).tearDownClass()
+
+    def setUp(self):
+        self.mockldap.start()
+        self.ldapobj = self.mockldap['ldap://localhost']
+        self.group_search = LDAPSearch(
+            'ou=Access,%s' % DC, ldap.SCOPE_SUBTREE,
+            '(objectClass=groupOfNames)')
+
+    def tearDown(self):
+        self.mockldap.stop()
+        del self.ldapobj
+
+    def _user_groups(self, group_type, username, group_search=None):
+        ldap_user = Mock(dn=person_dn(username, DC), connection=self.ldapobj)
+        with patch.object(group_type, 'find_groups_with_any_member',
+                          wraps=group_type.find_groups_with_any_member
+                          ) as find_groups:
+            group_infos = group_type.user_groups(
+                ldap_user, group_search or self.group_search)
+        return {group_info[0] for group_info in group_infos}, find_groups
+
+    def test_wide(self):
+        group_type = BatchedNestedGroupOfNamesType(chunk_size=7)
+        group_dns, find_groups = self._user_groups(group_type, 'wide')
+        self.assertEqual(
+            group_dns,
+            {group_dn(name, DC) for name in ['root', 'end'] + MIDDLE + LEAVES})
+        # root, the middle groups, the leaves, end, and nothing above end.
+        self.assertEqual(find_groups.call_count, 5)
+        searched = [len(call[0][0]) for call in find_groups.call_args_list]
+        self.assertEqual(searched, [1, 1, 30, 3, 1])
+
+    def test_chunk_filters(self):
+        group_type = BatchedNestedGroupOfNamesType(chunk_size=7)
+        member_dns = {group_dn(middle, DC) for middle in MIDDLE}
+        with patch.object(self.ldapobj, 'search',
+                          wraps=self.ldapobj.search) as search:
+            group_infos = group_type.find_groups_with_any_member(
+                member_dns, self.group_search, self.ldapobj)
+        self.assertEqual(search.call_count, 5)
+        self.assertEqual(
+            sorted(call[0][2].count('(member=')
+                   for call in search.call_args_list),
+            [2, 7, 7, 7, 7])
+        self.assertEqual(
+            {group_info[0] for group_info in group_infos},
+            {group_dn(leaf, DC) for leaf in LEAVES})
+
+    def test_chunk_error(self):
+        group_type = BatchedNestedGroupOfNamesType(chunk_size=7)
+        member_dns = {group_dn(middle, DC) for middle in MIDDLE}
+        ldap_result = self.ldapobj.result
+        msgids = []
+
+        def result(msgid):
+            # The second of the five chunks fails.
+            msgids.append(msgid)
+            if len(msgids) == 2:
+                raise ldap.SIZELIMIT_EXCEEDED()
+            return ldap_result(msgid)
+
+        self.ldapobj.abandon = Mock()
+        self.addCleanup(delattr, self.ldapobj, 'abandon')
+        with patch.object(self.ldapobj, 'result', side_effect=result):
+            # Rather than dropping that chunk's groups.
+            with self.assertRaises(ldap.SIZELIMIT_EXCEEDED):
+                group_type.find_groups_with_any_member(
+                    member_dns, self.group_search, self.ldapobj)
+        self.assertEqual(self.ldapobj.abandon.call_count, 3)
+
+    def test_search_union(self):
+        group_search = LDAPSearchUnion(self.group_search, LDAPSearch(
+            'ou=People,%s' % DC, ldap.SCOPE_SUBTREE,
+            '(objectClass=groupOfNames)'))
+        group_type = BatchedNestedGroupOfNamesType(chunk_size=7)
+        group_dns, _ = self._user_groups(group_type, 'lonely', group_search)
+        self.assertEqual(group_dns, {group_dn('end', DC)})
+
+    def test_unknown_user(self):
+        ldap_user = Mock(dn=None)
+        self.assertEqual(BatchedNestedGroupOfNamesType().user_groups(
+            ldap_user, self.group_search), [])
+
+    def test_chunk_size(self):
+        self.assertRaises(ValueError, BatchedNestedGroupOfNamesType,
+                          chunk_size=0)
+
+
+class TestMemberOfGroupOfNamesType(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(TestMemberOfGroupOfNamesType, cls).setUpClass()
+        kwargs = dict(ldap_dc=DC, extra_users=directory.test_users,
+                      group_lineage=directory.group_lineage,
+                      member_of_dns=True)
+        cls.directory = mock_ldap_directory(**kwargs)
+        cls.mockldap = mock_ldap_setup(**kwargs)
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.mockldap
+        super(TestMemberOfGroupOfNamesType, cls).tearDownClass()
+
+    def setUp(self):
+        self.mockldap.start()
+        self.ldapobj = self.mockldap['ldap://localhost']
+        self.group_search = LDAPSearch(
+            'ou=Access,%s' % DC, ldap.SCOPE_SUBTREE,
+            '(objectClass=groupOfNames)')
+        patcher = patch('baya.group_graph.group_graphs', GroupGraphCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.mockldap.stop()
+        del self.ldapobj
+
+    def _ldap_user(self, username):
+        dn = person_dn(username, DC)
+        return Mock(dn=dn, attrs=self.directory[dn],
+                    connection=self.ldapobj)
+
+    def test_member_of(self):
+        group_type = MemberOfGroupOfNamesType()
+        with patch.object(GroupGraph, 'load', wraps=GroupGraph.load) as load:
+            group_infos = group_type.user_groups(
+                self._ldap_user('has_a'), self.group_search)
+            self.assertEqual(
+                {group_info[0] for group_info in group_infos},
+                {group_dn(name, DC) for name in ['a', 'aa', 'ab', 'aaa']})
+            self.assertEqual(
+                {group_type.group_name_from_info(group_info)
+                 for group_info in group_infos},
+                {'a', 'aa', 'ab', 'aaa'})
+            self.assertEqual(load.call_count, 1)
+            # The graph is cached, so this doesn't search.
+            with patch.object(self.ldapobj, 'search_s') as search_s:
+                group_infos = group_type.user_groups(
+                    self._ldap_user('has_aa'), self.group_search)
+            self.assertFalse(search_s.called)
+            self.assertEqual(load.call_count, 1)
+        self.assertEqual({group_info[0] for group_info in group_infos},
+                         {group_dn(name, DC) for name in ['aa', 'aaa']})
+
+    def test_no_member_of(self):
+        group_type = MemberOfGroupOfNamesType()
+        ldap_user = Mock(dn=person_dn('has_aa', DC), attrs={},
+                         connection=self.ldapobj)
+        with patch.object(GroupGraph, 'load') as load:
+            group_infos = group_type.user_groups(ldap_user, self.group_search)
+        self.assertFalse(load.called)
+        self.assertEqual({group_info[0] for group_info in group_infos},
+                         {group_dn(name, DC) for name in ['aa', 'aaa']})
@@ -0,0 +1,86 @@
+from django.contrib.auth import SESSION_KEY
+from django.http import HttpResponse
+from django.test import RequestFactory
+from django.test import SimpleTestCase
+from mock import Mock
+from mock import PropertyMock
+
+from ..middleware import SESSION_ROLES_KEY
+from ..middleware import SessionRolesMiddleware
+from ..middleware import dumps_roles
+from ..middleware import loads_roles
+from ..middleware import store_session_roles
+from ..utils import get_user_roles
+
+
+class User(object):
+    def __init__(self, pk, group_dns=None, loaded=False):
+        self.pk = pk
+        self.ldap_user = Mock(group_dns=group_dns)
+        self.ldap_user._groups._group_dns = group_dns if loaded else None
+
+
+class TestSnapshot(SimpleTestCase):
+    def test_loads(self):
+        user = User(1)
+        value = dumps_roles(user, {'b', 'a'})
+        self.assertEqual(loads_roles(user, value), {'a', 'b'})
+        self.assertIsNone(loads_roles(User(2), value))
+        self.assertIsNone(loads_roles(user, value, max_age=-1))
+        self.assertIsNone(loads_roles(user, value[:-1]))
+
+    def test_compact(self):
+        user = User(1)
+        # Mostly groups the Gates don't refer to.
+        roles = {'a', 'aa'} | {'department-group-%d' % i for i in range(200)}
+        value = dumps_roles(user, roles)
+        self.assertEqual(loads_roles(user, value), roles)
+        self.assertLess(len(value), len(','.join(roles)) / 4)
+
+
+class TestSessionRolesMiddleware(SimpleTestCase):
+    def setUp(self):
+        self.middleware = SessionRolesMiddleware(lambda request: HttpResponse())
+
+    def _request(self, user, **session):
+        request = RequestFactory().get('/')
+        request.session = dict(session)
+        request.user = user
+        return request
+
+    def test_login(self):
+        user = User(1, ['cn=a,ou=access'], loaded=True)
+        request = self._request(user)
+        store_session_roles(sender=type(user), request=request, user=user)
+        self.assertEqual(
+            loads_roles(user, request.session[SESSION_ROLES_KEY]), {'a'})
+
+    def test_restores_roles(self):
+        user = User(1)
+        type(user.ldap_user).group_dns = PropertyMock(
+            side_effect=AssertionError("LDAP was queried"))
+        request = self._request(user, **{
+            SESSION_KEY: '1', SESSION_ROLES_KEY: dumps_roles(user, {'a'})})
+        self.middleware(request)
+        self.assertEqual(get_user_roles(user), {'a'})
+        self.assertIn(SESSION_ROLES_KEY, request.session)
+
+    def test_expired(self):
+        user = User(1, ['cn=b,ou=access'])
+        request = self._request(user, **{
+            SESSION_KEY: '1', SESSION_ROLES_KEY: dumps_roles(User(2), {'a'})})
+        self.middleware.process_request(request)
+        self.assertNotIn(SESSION_ROLES_KEY, request.session)
+        self.assertEqual(get_user_roles(user), {'b'})
+        # The roles are only stored if the request looked them up.
+        self.middleware.process_response(request, HttpResponse())
+        self.assertNotIn(SESSION_ROLES_KEY, request.session)
+        user.ldap_user._groups._group_dns = user.ldap_user.group_dns
+        self.middleware.process_response(request, HttpResponse())
+        self.assertEqual(
+            loads_roles(user, request.session[SESSION_ROLES_KEY]), {'b'})
+
+    def test_anonymous(self):
+        request = self._request(Mock(side_effect=AssertionError))
+        self.middleware(request)
+        self.assertEqual(request.session, {})
@@ -85,6 +85,14 @@ class TestMockLdapDirectory(TestCase):
         self.assertEqual(directory[group_dn('child_2_2', "")]['member'],
                          [group_dn('child_2', '')])
 
+    def test_member_of(self):
+        kwargs = dict(extra_users=[('somebody', 'agroup')], ldap_dc="")
+        dn = person_dn('somebody', "")
+        directory = mock_ldap_directory(**kwargs)
+        self.assertEqual(directory[dn]['memberOf'], ['agroup'])
+        directory = mock_ldap_directory(member_of_dns=True, **kwargs)
+        self.assertEqual(directory[dn]['memberOf'], [group_dn('agroup', "")])
+
     def test_no_args(self):
         directory = mock_ldap_directory()
         self.assertEqual(len(directory), 5)
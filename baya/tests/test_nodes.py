@@ -1,3 +1,8 @@
+import asyncio
+import threading
+
+from asgiref.sync import async_to_sync
+from mock import MagicMock
 from mock import Mock
 
 from operator import and_
@@ -70,6 +75,103 @@ class TestDynamicRolesNode(TestCase):
         node = dg(c1)
         self.assertRaises(RuntimeError, node.get_roles_set, x='abc')
 
+    def test_memoized_per_request(self):
+        roles_callable = Mock(return_value={'a'})
+        node = dg(roles_callable)
+        other = dg(roles_callable) | dg(lambda **kwargs: {'b'})
+        request = MagicMock()
+        self.assertEqual(node.get_roles_set(request=request), {'a'})
+        self.assertEqual(node.get_roles_set(request=request), {'a'})
+        self.assertEqual(other._operands[0].get_roles_set(request=request), {'a'})
+        self.assertEqual(roles_callable.call_count, 1)
+
+        node.get_roles_set(request=request, obj=1)
+        self.assertEqual(roles_callable.call_count, 2)
+        node.get_roles_set(request=MagicMock())
+        self.assertEqual(roles_callable.call_count, 3)
+        # Without a request, there's nothing to memoize on.
+        node.get_roles_set()
+        node.get_roles_set()
+        self.assertEqual(roles_callable.call_count, 5)
+
+    def test_memoize_opt_out(self):
+        roles_callable = Mock(return_value={'a'})
+        roles_callable.memoize = False
+        node = dg(roles_callable)
+        request = MagicMock()
+        node.get_roles_set(request=request)
+        node.get_roles_set(request=request)
+        self.assertEqual(roles_callable.call_count, 2)
+
+    def test_memoize_unhashable_kwargs(self):
+        roles_callable = Mock(return_value={'a'})
+        node = dg(roles_callable)
+        request = MagicMock()
+        node.get_roles_set(request=request, data=[])
+        node.get_roles_set(request=request, data=[])
+        self.assertEqual(roles_callable.call_count, 2)
+
+    def test_aget_roles_set_concurrent(self):
+        """Async callables are awaited concurrently."""
+        events = {}
+
+        def make_callable(name, other):
+            async def roles_callable(**kwargs):
+                events[name].set()
+                await asyncio.wait_for(events[other].wait(), 1)
+                return {name}
+            return roles_callable
+
+        async def check():
+            events['a'] = asyncio.Event()
+            events['b'] = asyncio.Event()
+            node = dg(make_callable('a', 'b'), make_callable('b', 'a'),
+                      lambda **kwargs: {'c'})
+            return await node.aget_roles_set()
+
+        self.assertEqual(async_to_sync(check)(), {'a', 'b', 'c'})
+
+    def test_aget_roles_set_thread_sensitive(self):
+        """Sync callables which opt out of thread_sensitive run concurrently.
+        """
+        events = {'a': threading.Event(), 'b': threading.Event()}
+
+        def make_callable(name, other):
+            def roles_callable(**kwargs):
+                events[name].set()
+                if not events[other].wait(1):
+                    raise AssertionError("Not run concurrently")
+                return {name}
+            roles_callable.thread_sensitive = False
+            return roles_callable
+
+        node = dg(make_callable('a', 'b'), make_callable('b', 'a'))
+        self.assertEqual(async_to_sync(node.aget_roles_set)(), {'a', 'b'})
+
+    def test_aget_roles_set_memoized(self):
+        calls = []
+
+        async def roles_callable(**kwargs):
+            calls.append(kwargs)
+            return {'a'}
+
+        node = dg(roles_callable)
+        request = MagicMock()
+        self.assertEqual(
+            async_to_sync(node.aget_roles_set)(request=request), {'a'})
+        self.assertEqual(node.get_roles_set(request=request), {'a'})
+        self.assertEqual(len(calls), 1)
+
+    def test_async_callable_in_sync_code(self):
+        async def roles_callable(**kwargs):
+            return {'a'}
+        self.assertEqual(dg(roles_callable).get_roles_set(), {'a'})
+
+        async def invalid_callable(**kwargs):
+            return ['a']
+        self.assertRaises(RuntimeError,
+                          async_to_sync(dg(invalid_callable).aget_roles_set))
+
     def test_combine_roles(self):
         """Combining roles into a simpler node when AND-ing."""
         role1 = dg(lambda x: x)
@@ -1,3 +1,4 @@
+import asyncio
 import functools
 from mock import patch
 from mock import sentinel
@@ -5,12 +6,14 @@ from types import FunctionType
 
 import six
 import django
+from asgiref.sync import async_to_sync
 from django.conf import settings
 if django.VERSION[:2] < (4, 0):
     from django.conf.urls import include
 else:
     from django.urls import include
 from django.urls import reverse_lazy
+from django.core.exceptions import PermissionDenied
 from django.http import HttpResponse
 from django.test.utils import override_settings
 from django.views.generic import ListView
@@ -23,6 +26,7 @@ from ..membership import DynamicRolesNode as dg
 from ..permissions import Gate
 from ..permissions import requires
 from ..permissions import DENY_ALL
+from ..role_sets import RoleDictionary
 from ..visitors import PermissionChecker
 from ..utils import has_permission
 
@@ -183,6 +187,85 @@ class TestGate(LDAPGroupAuthTestBase):
         self._test_perms(gate, False, False)
 
 
+class TestFilterUsers(LDAPGroupAuthTestBase):
+    def test_users(self):
+        has_all = self.login('has_all')
+        has_aaa = self.login('has_aaa')
+        gate = Gate(get_requires=A, post_requires=AAA)
+        self.assertEqual(gate.filter_users([has_all, has_aaa]), [has_all])
+        self.assertEqual(gate.filter_users([has_aaa, has_all], 'post'),
+                         [has_aaa, has_all])
+
+    def test_role_sets(self):
+        gate = Gate(get_requires=(A | B) & ~AA, post_requires=AA)
+        role_sets = [['a'], ['A', 'aa'], {'b'}, [], ('a',)]
+        self.assertEqual(gate.filter_users(role_sets),
+                         [['a'], {'b'}, ('a',)])
+        self.assertEqual(gate.filter_users(role_sets, 'any'),
+                         [['a'], ['A', 'aa'], {'b'}, ('a',)])
+
+    def test_bitmasks(self):
+        roles = RoleDictionary(['a', 'aa', 'b'])
+        masks = [roles.encode(role_set)
+                 for role_set in [['a'], ['a', 'aa'], ['b'], []]]
+        gate = Gate(get_requires=(A | B) & ~AA)
+        self.assertEqual(gate.filter_users(masks, role_dictionary=roles),
+                         [masks[0], masks[2]])
+
+    def test_bitmasks_missing_roles(self):
+        roles = RoleDictionary(['a', 'b'])
+        masks = [roles.encode(['a']), roles.encode(['a', 'aa'])]
+        gate = Gate(get_requires=A & ~AA)
+        self.assertRaises(ValueError, gate.filter_users, masks,
+                          role_dictionary=roles)
+        # The caller's dictionary isn't changed, so retrying raises too.
+        self.assertNotIn('aa', roles)
+        self.assertRaises(ValueError, gate.filter_users, masks,
+                          role_dictionary=roles)
+        # Role sets don't depend on the dictionary.
+        self.assertEqual(
+            gate.filter_users([['a'], ['a', 'aa']], role_dictionary=roles),
+            [['a']])
+
+    def test_evaluates_role_sets_once(self):
+        gate = Gate(get_requires=A)
+        with patch.object(PermissionChecker, 'visit',
+                          return_value=True) as visit:
+            gate.filter_users([['a'], ['a'], ['b'], ['A']] * 10)
+        # Static nodes are compiled instead of visited.
+        self.assertFalse(visit.called)
+
+        node = dg(lambda **kwargs: {'a'})
+        gate = Gate(get_requires=node)
+        with patch.object(PermissionChecker, 'visit',
+                          return_value=True) as visit:
+            allowed = gate.filter_users([['a'], ['a'], ['b'], ['A']] * 10,
+                                        request=sentinel.request)
+        self.assertEqual(len(allowed), 40)
+        self.assertEqual(visit.call_count, 2)
+        visit.assert_called_with(node, request=sentinel.request)
+
+    def test_dynamic(self):
+        roles = RoleDictionary(['b'])
+        gate = Gate(get_requires=dg(lambda **kwargs: {'a'}))
+        self.assertEqual(
+            gate.filter_users([{'a'}, {'b'}], request=sentinel.request),
+            [{'a'}])
+        # The dynamic roles aren't known when compiling, so they're never
+        # in a bitmask.
+        self.assertEqual(
+            gate.filter_users([roles.encode(['a', 'b'])],
+                              role_dictionary=roles,
+                              request=sentinel.request),
+            [])
+
+    def test_invalid(self):
+        gate = Gate(get_requires=A)
+        self.assertRaises(TypeError, gate.filter_users, ['a'])
+        self.assertRaises(ValueError, gate.filter_users, [1])
+        self.assertRaises(ValueError, gate.filter_users, [['a']], 'put')
+
+
 class TestDeniedReason(LDAPGroupAuthTestBase):
     def test_not_logged_in(self):
         gate = Gate()
@@ -387,6 +470,11 @@ class TestRequires(LDAPGroupAuthTestBase):
 
     def test_include(self):
         """Make sure requires(A)(include(my_app.urls)) works."""
+        # The patterns are decorated in place, and shared with the test
+        # urlconf's gate index.
+        for pattern in nested_urls2.urlpatterns:
+            self.addCleanup(setattr, pattern, '__dict__',
+                            dict(pattern.__dict__))
         decorated_include = requires(A)(include(nested_urls2))
         for pattern in decorated_include[0].urlpatterns:
             [cell] = [cell for cell in pattern.resolve.__closure__
@@ -461,3 +549,100 @@ class TestRequiresDynamic(LDAPGroupAuthTestBase):
             self.login('has_b'), decorated1, {'group': 'A'})
         self.assert_has_permission(
             self.login('has_all'), decorated1, {'group': 'A'})
+
+
+async def async_undecorated_view(request):
+    return HttpResponse('async_undecorated_view response')
+
+
+async def _admin_group(request):
+    await asyncio.sleep(0)
+    return {'%s_admin' % request.GET['group'].lower()}
+
+
+class TestRequiresAsync(LDAPGroupAuthTestBase):
+    def _call(self, view, user, method='GET', get=None):
+        if method == 'GET':
+            request = self.mock_get_request(user, get=get)
+        else:
+            request = self.mock_post_request(user, get=get)
+        return async_to_sync(view)(request)
+
+    def test_async_dispatcher(self):
+        decorated = requires(get=AA, post=A)(async_undecorated_view)
+        self.assertTrue(asyncio.iscoroutinefunction(decorated))
+        self.assertEqual(
+            self._call(decorated, self.login('has_aa')).status_code, 200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_aa'), 'POST')
+        self.assertEqual(
+            self._call(decorated, self.login('has_a'), 'POST').status_code,
+            200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_b'))
+
+    def test_not_logged_in(self):
+        decorated = requires(AA)(async_undecorated_view)
+        response = self._call(decorated, None)
+        self.assertEqual(response.status_code, 302)
+
+    def test_nested(self):
+        decorated = requires(A)(requires(B)(async_undecorated_view))
+        self.assertTrue(asyncio.iscoroutinefunction(decorated))
+        self.assertEqual(
+            self._call(decorated, self.login('has_a_b')).status_code, 200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_a'))
+        self.assertTrue(
+            has_permission(decorated, self.login('has_a_b'), 'get'))
+        self.assertFalse(
+            has_permission(decorated, self.login('has_a'), 'get'))
+
+    def test_async_dynamic_roles(self):
+        decorated = requires(dg(_admin_group) | B)(async_undecorated_view)
+        self.assertEqual(
+            self._call(decorated, self.login('has_all'),
+                       get={'group': 'A'}).status_code,
+            200)
+        self.assertEqual(
+            self._call(decorated, self.login('has_b'),
+                       get={'group': 'A'}).status_code,
+            200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_a'), get={'group': 'A'})
+
+    def test_sync_dynamic_roles(self):
+        dynamic_group = dg(DjangoRequestGroupFormatter("%s_admin", 'group'))
+        decorated = requires(dynamic_group)(async_undecorated_view)
+        self.assertEqual(
+            self._call(decorated, self.login('has_all'),
+                       get={'group': 'A'}).status_code,
+            200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_a'), get={'group': 'A'})
+
+    def test_async_roles_in_sync_view(self):
+        decorated = requires(dg(_admin_group))(undecorated_view)
+        self.assert_has_permission(
+            self.login('has_all'), decorated, {'group': 'A'})
+        self.assert_no_permission(
+            self.login('has_a'), decorated, {'group': 'A'})
+
+    @override_settings(BAYA_CONCURRENT_DYNAMIC_ROLES=True)
+    def test_concurrent_dynamic_roles(self):
+        node = ((dg(_admin_group) &
+                 dg(DjangoRequestGroupFormatter("%s_admin", 'group'))) | B)
+        decorated = requires(node)(async_undecorated_view)
+        self.assertEqual(
+            self._call(decorated, self.login('has_all'),
+                       get={'group': 'A'}).status_code,
+            200)
+        self.assertRaises(PermissionDenied, self._call,
+                          decorated, self.login('has_a'), get={'group': 'A'})
+        decorated = requires(node)(undecorated_view)
+        self.assert_has_permission(
+            self.login('has_all'), decorated, {'group': 'A'})
+        self.assert_has_permission(
+            self.login('has_b'), decorated, {'group': 'A'})
+        self.assert_no_permission(
+            self.login('has_a'), decorated, {'group': 'A'})
@@ -0,0 +1,88 @@
+import ldap
+from django_auth_ldap.config import LDAPSearch
+from django_auth_ldap.config import LDAPSearchUnion
+from mock import patch
+
+from .test_base import LDAPGroupAuthTestBase
+from .. import prefetch_role_sets
+from ..backend import NestedLDAPGroupsBackend
+from ..group_graph import GroupGraphCache
+from ..membership import RolesNode as g
+from ..permissions import Gate
+from ..prefetch import _user_attr
+from ..utils import group_names
+from ..utils import user_in_group
+
+USERNAMES = ['has_all', 'has_a', 'has_aa', 'has_b', 'has_a_b', 'has_nothing']
+
+
+class TestPrefetchRoleSets(LDAPGroupAuthTestBase):
+    member_of_dns = True
+
+    def setUp(self):
+        super(TestPrefetchRoleSets, self).setUp()
+        patcher = patch('baya.group_graph.group_graphs', GroupGraphCache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.backend = NestedLDAPGroupsBackend()
+
+    def _searches(self):
+        return patch.object(self.ldapobj, 'search_s',
+                            wraps=self.ldapobj.search_s)
+
+    def test_agrees_with_group_lookups(self):
+        expected = {
+            username: group_names(self.backend.get_group_dns(username))
+            for username in USERNAMES}
+        with self._searches() as search_s:
+            role_sets = prefetch_role_sets(
+                USERNAMES, backend=self.backend, chunk_size=4)
+        self.assertEqual(role_sets, expected)
+        self.assertEqual(role_sets['has_a'], {'a', 'aa', 'ab', 'aaa'})
+        # Two user searches, and one to load the group graph.
+        self.assertEqual(search_s.call_count, 3)
+
+    def test_unknown_user(self):
+        role_sets = prefetch_role_sets(['has_a', 'nobody*'],
+                                       backend=self.backend)
+        self.assertEqual(role_sets['nobody*'], frozenset())
+
+    def test_unbinds(self):
+        prefetch_role_sets(['has_a', 'nobody*'], backend=self.backend)
+        # The bulk search's connection, and the one looking up nobody*.
+        self.assertEqual(self.ldapobj.methods_called().count('unbind_s'), 2)
+
+    def test_role_sets(self):
+        role_sets = prefetch_role_sets(USERNAMES, backend=self.backend)
+        self.assertTrue(user_in_group(role_sets['has_aa'], 'aaa'))
+        self.assertFalse(user_in_group(role_sets['has_aa'], g('a')))
+        gate = Gate(get_requires=g('a') | g('b'))
+        self.assertEqual(
+            gate.filter_users([role_sets[name] for name in USERNAMES]),
+            [role_sets[name]
+             for name in ['has_all', 'has_b', 'has_a_b']])
+
+    def test_invalid_chunk_size(self):
+        self.assertRaises(ValueError, prefetch_role_sets, USERNAMES,
+                          backend=self.backend, chunk_size=0)
+
+
+class TestUserAttr(LDAPGroupAuthTestBase):
+    def _search(self, filterstr):
+        return LDAPSearch('ou=people,dc=test', ldap.SCOPE_SUBTREE, filterstr)
+
+    def test_user_attr(self):
+        self.assertEqual(_user_attr(self._search('(uid=%(user)s)')), 'uid')
+        self.assertEqual(_user_attr(self._search(
+            '(&(objectClass=person)(mail=%(user)s))')), 'mail')
+        self.assertEqual(_user_attr(LDAPSearchUnion(
+            self._search('(uid=%(user)s)'),
+            self._search('(&(uid=%(user)s)(ou=x))'))), 'uid')
+
+    def test_no_user_attr(self):
+        self.assertIsNone(_user_attr(self._search(
+            '(|(uid=%(user)s)(mail=%(user)s))')))
+        self.assertIsNone(_user_attr(self._search('(uid=%(user)s@x)')))
+        self.assertIsNone(_user_attr(LDAPSearchUnion(
+            self._search('(uid=%(user)s)'),
+            self._search('(mail=%(user)s)'))))
@@ -0,0 +1,170 @@
+import threading
+
+import ldap
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.test import override_settings
+from mock import Mock
+from mock import PropertyMock
+from mock import patch
+
+from ..backend import _record_outage
+from ..role_cache import RoleSetCache
+from ..utils import get_user_roles
+
+
+class TestRoleSetCache(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000
+        self.cache = RoleSetCache(60, 300, clock=lambda: self.now)
+        self.addCleanup(self.cache.shutdown)
+
+    def test_fresh(self):
+        load = Mock(return_value={'a'})
+        self.assertEqual(self.cache.get('user', load), {'a'})
+        self.now += 59
+        self.assertEqual(self.cache.get('user', load), {'a'})
+        self.assertEqual(load.call_count, 1)
+
+    def test_stale_while_revalidate(self):
+        self.cache.get('user', lambda: {'a'})
+        self.now += 60
+        load = Mock(return_value={'b'})
+        refresh = Mock(return_value={'b'})
+        self.assertEqual(self.cache.get('user', load, refresh), {'a'})
+        self.cache.shutdown()
+        self.assertFalse(load.called)
+        refresh.assert_called_once_with()
+        self.assertEqual(self.cache.get('user', load, refresh), {'b'})
+
+    def test_one_refresh(self):
+        self.cache.get('user', lambda: {'a'})
+        self.now += 60
+        started = threading.Event()
+        finish = threading.Event()
+
+        def refresh():
+            started.set()
+            finish.wait(5)
+            return {'b'}
+        refresh = Mock(side_effect=refresh)
+        self.cache.get('user', Mock(), refresh)
+        started.wait(5)
+        self.assertEqual(self.cache.get('user', Mock(), refresh), {'a'})
+        finish.set()
+        self.cache.shutdown()
+        self.assertEqual(refresh.call_count, 1)
+
+    def test_hard_expiry(self):
+        self.cache.get('user', lambda: {'a'})
+        self.now += 300
+        refresh = Mock()
+        self.assertEqual(self.cache.get('user', lambda: {'b'}, refresh), {'b'})
+        self.assertFalse(refresh.called)
+
+    def test_refresh_error(self):
+        self.cache.get('user', lambda: {'a'})
+        self.now += 60
+        with patch('baya.role_cache.logger') as logger:
+            self.cache.get('user', Mock(), Mock(side_effect=IOError))
+            self.cache.shutdown()
+        self.assertTrue(logger.exception.called)
+        self.assertEqual(self.cache.get('user', Mock(), lambda: {'a'}), {'a'})
+
+    def test_max_stale_on_error(self):
+        self.cache.max_stale_on_error = 600
+        self.cache.get('user', lambda: {'a'})
+        self.now += 300
+        with patch('baya.role_cache.logger') as logger:
+            self.assertEqual(self.cache.get(
+                'user', Mock(side_effect=ldap.SERVER_DOWN)), {'a'})
+        self.assertTrue(logger.warning.called)
+        self.assertRaises(IOError, self.cache.get, 'user',
+                          Mock(side_effect=IOError))
+        self.now += 300
+        self.assertRaises(ldap.SERVER_DOWN, self.cache.get, 'user',
+                          Mock(side_effect=ldap.SERVER_DOWN))
+
+    def test_hard_expiry_default(self):
+        self.assertEqual(RoleSetCache(60).hard_expiry, 120)
+        self.assertRaises(ValueError, RoleSetCache, 60, 30)
+
+
+class TestGetUserRoles(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.now = 1000
+        self.cache = RoleSetCache(60, clock=lambda: self.now)
+        self.addCleanup(self.cache.shutdown)
+        patcher = patch('baya.role_cache._role_cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _user(self, group_dns, loaded=False):
+        ldap_user = Mock(_username='user', group_dns=group_dns,
+                         _baya_cached_roles=None)
+        ldap_user._groups._group_dns = group_dns if loaded else None
+        return Mock(ldap_user=ldap_user)
+
+    def test_disabled(self):
+        get_user_roles(self._user(['cn=a,ou=access']))
+        self.assertEqual(get_user_roles(self._user(['cn=b,ou=access'])), {'b'})
+
+    @override_settings(BAYA_ROLE_CACHE_TIMEOUT=60)
+    def test_cached(self):
+        self.assertEqual(get_user_roles(self._user(['cn=a,ou=access'])), {'a'})
+        self.assertEqual(get_user_roles(self._user(['cn=b,ou=access'])), {'a'})
+        # Groups loaded for this request are used, but not cached, since
+        # django-auth-ldap may have ignored failed searches.
+        self.assertEqual(
+            get_user_roles(self._user(['cn=c,ou=access'], loaded=True)), {'c'})
+        self.assertEqual(get_user_roles(self._user(['cn=d,ou=access'])), {'a'})
+
+    @override_settings(BAYA_ROLE_CACHE_TIMEOUT=60)
+    def test_memoized(self):
+        user = self._user(['cn=a,ou=access'])
+        with patch.object(self.cache, 'get',
+                          wraps=self.cache.get) as cache_get, \
+                patch.object(self.cache, '_store',
+                             wraps=self.cache._store) as store:
+            for _ in range(3):
+                self.assertEqual(get_user_roles(user), {'a'})
+            # Once the lookup loaded the group DNs, too.
+            user.ldap_user._groups._group_dns = ['cn=a,ou=access']
+            self.assertEqual(get_user_roles(user), {'a'})
+        self.assertEqual(cache_get.call_count, 1)
+        self.assertEqual(store.call_count, 1)
+        # Callers can't change the request's roles.
+        get_user_roles(user).add('b')
+        self.assertEqual(get_user_roles(user), {'a'})
+
+    @override_settings(BAYA_ROLE_CACHE_TIMEOUT=60)
+    def test_refresh(self):
+        get_user_roles(self._user(['cn=a,ou=access']))
+        self.now += 60
+        user = self._user(['cn=b,ou=access'])
+        with patch('baya.role_cache._lookup_roles',
+                   return_value={'c'}) as lookup_roles:
+            self.assertEqual(get_user_roles(user), {'a'})
+            self.cache.shutdown()
+        # The refresh doesn't use the request's ldap_user.
+        lookup_roles.assert_called_once_with(user.ldap_user.backend, 'user')
+        self.assertEqual(get_user_roles(self._user([])), {'c'})
+
+    @override_settings(BAYA_ROLE_CACHE_TIMEOUT=60)
+    def test_ignored_outage(self):
+        self.cache.max_stale_on_error = 600
+        get_user_roles(self._user(['cn=a,ou=access']))
+        self.now += 120
+        user = self._user([])
+
+        def group_dns():
+            # What django-auth-ldap's searches do during an outage.
+            _record_outage(ldap.SERVER_DOWN())
+            return []
+
+        type(user.ldap_user).group_dns = PropertyMock(side_effect=group_dns)
+        self.assertEqual(get_user_roles(user), {'a'})
+        # The empty roles weren't cached.
+        self.assertEqual(get_user_roles(self._user(['cn=b,ou=access'])), {'b'})
@@ -0,0 +1,95 @@
+from unittest import TestCase
+
+from ..role_sets import RoleDictionary
+from ..role_sets import RoleSetCodec
+
+
+class TestRoleDictionary(TestCase):
+    def test_stable_ids(self):
+        roles = RoleDictionary(['b', 'A', 'c'])
+        self.assertEqual(list(roles), ['a', 'b', 'c'])
+        self.assertEqual(roles.add('a'), 0)
+        self.assertEqual(roles.add('d'), 3)
+        self.assertEqual(len(roles), 4)
+
+    def test_contains(self):
+        roles = RoleDictionary(['a'])
+        self.assertIn('a', roles)
+        self.assertIn('A', roles)
+        self.assertNotIn('b', roles)
+
+    def test_copy(self):
+        roles = RoleDictionary(['b', 'c'])
+        roles.add('a')
+        copy = roles.copy()
+        self.assertEqual(list(copy), ['b', 'c', 'a'])
+        copy.add('d')
+        self.assertNotIn('d', roles)
+
+    def test_encode(self):
+        roles = RoleDictionary(['a', 'b', 'c'])
+        self.assertEqual(roles.encode([]), 0)
+        self.assertEqual(roles.encode(['a']), 0b1)
+        self.assertEqual(roles.encode(['C', 'a']), 0b101)
+
+    def test_encode_unknown(self):
+        roles = RoleDictionary(['a', 'b'])
+        self.assertEqual(roles.encode(['b', 'unknown']), 0b10)
+
+    def test_decode(self):
+        roles = RoleDictionary(['a', 'b', 'c'])
+        self.assertEqual(roles.decode(0), frozenset())
+        self.assertEqual(roles.decode(0b110), {'b', 'c'})
+        self.assertEqual(roles.decode(roles.encode(['a', 'c'])), {'a', 'c'})
+
+
+class TestRoleSetCodec(TestCase):
+    def setUp(self):
+        self.codec = RoleSetCodec(
+            RoleDictionary(['role%03d' % i for i in range(300)]))
+
+    def test_round_trip(self):
+        for roles in [set(), {'role000'}, {'role299', 'role000', 'role150'},
+                      {'role001', 'other', u'\xfcnicode'},
+                      {'role%03d' % i for i in range(0, 300, 2)}]:
+            self.assertEqual(self.codec.decode(self.codec.encode(roles)),
+                             roles)
+
+    def test_case_insensitive(self):
+        data = self.codec.encode(['ROLE001', 'Other'])
+        self.assertEqual(self.codec.decode(data), {'role001', 'other'})
+        self.assertTrue(self.codec.contains(data, 'Role001'))
+        self.assertTrue(self.codec.contains(data, 'OTHER'))
+
+    def test_compact(self):
+        roles = {'role%03d' % i for i in range(0, 300, 2)}
+        # A byte per role, plus a few for the header.
+        self.assertLessEqual(len(self.codec.encode(roles)), len(roles) + 10)
+
+    def test_contains(self):
+        data = self.codec.encode(['role010', 'role200', 'other'])
+        for role in ['role010', 'role200', 'other']:
+            self.assertTrue(self.codec.contains(data, role))
+        for role in ['role000', 'role011', 'role299', 'othe', 'unknown']:
+            self.assertFalse(self.codec.contains(data, role))
+
+    def test_dictionary_grows(self):
+        data = self.codec.encode(['role001', 'new'])
+        self.codec.role_dictionary.add('new')
+        self.assertEqual(self.codec.decode(data), {'role001', 'new'})
+        self.assertTrue(self.codec.contains(data, 'new'))
+        self.assertEqual(self.codec.decode(self.codec.encode(['new'])),
+                         {'new'})
+
+    def test_other_dictionary(self):
+        data = self.codec.encode(['role001'])
+        for dictionary in [RoleDictionary(['a']), RoleDictionary(
+                ['role%03d' % i for i in range(1, 301)])]:
+            codec = RoleSetCodec(dictionary)
+            self.assertRaises(ValueError, codec.decode, data)
+            self.assertRaises(ValueError, codec.contains, data, 'role001')
+
+    def test_invalid(self):
+        data = self.codec.encode(['role001', 'other'])
+        for invalid in [b'', b'\x00' + data[1:], data[:-3]]:
+            self.assertRaises(ValueError, self.codec.decode, invalid)
@@ -39,3 +39,36 @@ class CanUserPerformActionTagTest(LDAPGroupAuthTestBase):
         })
         rendered = self.BASIC_TEMPLATE.render(context)
         self.assertIn('True', rendered)
+
+
+class BayaPermissionMapTagTest(LDAPGroupAuthTestBase):
+
+    MAP_TEMPLATE = Template(
+        "{%  load baya_tags  %}"
+        "{%  baya_permission_map 'index' undecorated='my_undecorated_view' "
+        "as perms %}"
+        "index={{ perms.index }} undecorated={{ perms.undecorated }}"
+    )
+
+    def _render(self, user):
+        return self.MAP_TEMPLATE.render(Context({'user': user}))
+
+    def test_anonymous_user(self):
+        rendered = self._render(AnonymousUser())
+        self.assertIn('index=False', rendered)
+        self.assertIn('undecorated=False', rendered)
+
+    def test_has_nothing(self):
+        rendered = self._render(self.login('has_nothing'))
+        self.assertIn('index=False', rendered)
+        self.assertIn('undecorated=False', rendered)
+
+    def test_has_some(self):
+        rendered = self._render(self.login('has_aa'))
+        self.assertIn('index=True', rendered)
+        self.assertIn('undecorated=False', rendered)
+
+    def test_has_all(self):
+        rendered = self._render(self.login('has_all'))
+        self.assertIn('index=True', rendered)
+        self.assertIn('undecorated=True', rendered)
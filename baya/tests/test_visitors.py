@@ -1,3 +1,4 @@
+from asgiref.sync import async_to_sync
 from mock import MagicMock
 from unittest import TestCase
 
@@ -5,8 +6,11 @@ from ..dynamic_roles import DjangoRequestGroupFormatter
 from ..membership import DynamicRolesNode as dg
 from ..membership import RolesNode as g
 from ..membership import ValueNode
+from ..role_sets import RoleDictionary
 from ..visitors import ExpressionWriter
 from ..visitors import PermissionChecker
+from ..visitors import PolicyCompiler
+from ..visitors import aresolve_dynamic_roles
 
 
 class TestPermissionChecker(TestCase):
@@ -168,3 +172,71 @@ class TestExpressionWriter(TestCase):
         self.assertEqual('{a} & False', self.writer.visit(node))
         node = ~node
         self.assertEqual('~({a} & False)', self.writer.visit(node))
+
+
+class TestPolicyCompiler(TestCase):
+    def setUp(self):
+        self.roles = RoleDictionary()
+        self.compiler = PolicyCompiler(self.roles)
+        a = g('A')
+        b = g('B')
+        c = g('C')
+        self.nodes = [
+            a,
+            g('A', 'B'),
+            g(),
+            a & b,
+            a | b,
+            a ^ b,
+            ~a,
+            ~(a | b) & c,
+            (a & b) ^ (b | ~c),
+            ValueNode(True),
+            ValueNode(False) | a,
+        ]
+
+    def _check(self, node, user_roles):
+        policy = self.compiler.visit(node)
+        self.assertEqual(
+            policy(self.roles.encode(user_roles)),
+            PermissionChecker(user_roles).visit(node))
+
+    def test_agrees_with_permission_checker(self):
+        for node in self.nodes:
+            for user_roles in [[], ['A'], ['B'], ['a', 'b'], ['C'],
+                               ['a', 'c'], ['a', 'b', 'c'], ['D']]:
+                self._check(node, user_roles)
+
+    def test_adds_roles(self):
+        self.compiler.visit(g('A') | g('B', 'C'))
+        self.assertEqual(set(self.roles), {'a', 'b', 'c'})
+
+    def test_cached(self):
+        node = g('A') & g('B')
+        self.assertIs(self.compiler.visit(node), self.compiler.visit(node))
+
+    def test_dynamic(self):
+        dynamic = dg(DjangoRequestGroupFormatter('%s_admin', 'group'))
+        self.assertIsNone(self.compiler.visit(dynamic))
+        self.assertIsNone(self.compiler.visit(g('A') | dynamic))
+        self.assertIsNone(self.compiler.visit(~dynamic))
+
+
+class TestResolveDynamicRoles(TestCase):
+    def test_resolved(self):
+        calls = []
+
+        async def roles_callable(**kwargs):
+            calls.append(kwargs)
+            return {'a'}
+
+        dynamic = dg(roles_callable)
+        node = (dynamic & g('b')) | ~dynamic
+        resolved = async_to_sync(aresolve_dynamic_roles)(node, x=1)
+        self.assertEqual(resolved, {dynamic: {'a'}})
+        self.assertEqual(calls, [{'x': 1}])
+        self.assertTrue(
+            PermissionChecker(['a', 'b'], resolved=resolved).visit(node))
+        self.assertFalse(
+            PermissionChecker(['a'], resolved=resolved).visit(node))
+        self.assertEqual(len(calls), 1)
@@ -1,6 +1,8 @@
 import six
 from ldap.dn import str2dn
 
+from . import evaluation
+from . import role_cache
 from .membership import RolesNode as g
 from .visitors import PermissionChecker
 
@@ -9,6 +11,48 @@ def group_names(group_dn_list):
     return {str2dn(group)[0][0][1].lower() for group in group_dn_list}
 
 
+def get_user_roles(user):
+    """Return the set of (lowercased) group names that a user is in.
+
+    Args:
+        user: A user with its ldap_user property populated. Users without an
+              ldap_user, like the AnonymousUser, have no roles. Or a role
+              set, eg from baya.prefetch.prefetch_role_sets.
+
+    With BAYA_ROLE_CACHE_TIMEOUT set, the roles are cached across requests,
+    see baya.role_cache. Roles restored from the session by
+    baya.middleware.SessionRolesMiddleware are used as they are.
+    """
+    if isinstance(user, (set, frozenset)):
+        return {role.lower() for role in user}
+    session_roles = getattr(user, '_baya_roles', None)
+    if isinstance(session_roles, frozenset):
+        return set(session_roles)
+    if hasattr(user, 'ldap_user'):
+        if role_cache.is_enabled():
+            return role_cache.get_user_roles(user.ldap_user)
+        return group_names(user.ldap_user.group_dns)
+    return set()
+
+
+async def aget_user_roles(user):
+    """Async version of get_user_roles.
+
+    Looking up a user's groups can query LDAP, so it runs on the LDAP thread
+    pool (see baya.backend.run_in_ldap_executor), unless the user's groups
+    are already loaded or its roles came from the session.
+    """
+    ldap_user = getattr(user, 'ldap_user', None)
+    if (ldap_user is None or
+            isinstance(getattr(user, '_baya_roles', None), frozenset)):
+        return get_user_roles(user)
+    groups = getattr(ldap_user, '_groups', None)
+    if getattr(groups, '_group_dns', None) is not None:
+        return get_user_roles(user)
+    from .backend import run_in_ldap_executor
+    return await run_in_ldap_executor(get_user_roles, user)
+
+
 def user_in_group(user, group, **kwargs):
     """Check if a user is in a desired group.
 
@@ -18,13 +62,17 @@ def user_in_group(user, group, **kwargs):
         group: The expected group, as a string or a RolesNode. If you want
                to check membership in several groups, this must be a RolesNode.
         kwargs: passed to the PermissionChecker.visit method.
+
+    With BAYA_CONCURRENT_DYNAMIC_ROLES set, the DynamicRolesNode callables
+    run concurrently, see baya.evaluation.
     """
-    user_groups = set()
-    if hasattr(user, 'ldap_user'):
-        user_groups = group_names(user.ldap_user.group_dns)
     if isinstance(group, six.string_types):
         group = g(group)
-    return PermissionChecker(user_groups).visit(group, **kwargs)
+    if evaluation.is_enabled():
+        checker = evaluation.ConcurrentPermissionChecker(get_user_roles(user))
+    else:
+        checker = PermissionChecker(get_user_roles(user))
+    return checker.visit(group, **kwargs)
 
 
 def _get_gate(fn):
@@ -42,11 +90,20 @@ def has_permission(fn, user, permission):
     methods which only operate on a single Gate.
 
     Args:
-        fn: The function which may be protected by baya
+        fn: The function which may be protected by baya, or the name of a
+            url, in which case the gates are looked up in the GateIndex of
+            the current urlconf, eg request.urlconf (see baya.gate_index).
         user: The django User which is being checked for access
         permission: The permission to check for. One of 'get', 'post', 'any'
     Returns True if the user has permission, False otherwise.
     """
+    if isinstance(fn, six.string_types):
+        from django.urls import get_urlconf
+        from .gate_index import get_gate_index
+        urlconf = get_urlconf()
+        gates = get_gate_index(urlconf).get_gates(fn, urlconf=urlconf)
+        return check_gates(gates, PermissionChecker(get_user_roles(user)),
+                           permission)
     gate = _get_gate(fn)
     if gate:
         if permission == 'get':
@@ -69,3 +126,74 @@ def has_permission(fn, user, permission):
             else:
                 return has_permission(nested_fn, user, permission)
     return False
+
+
+def get_gates(fn):
+    """Return every Gate protecting fn, outermost first.
+
+    This walks the same chain of nested Gates that has_permission does.
+    """
+    gates = []
+    gate = _get_gate(fn)
+    while gate:
+        gates.append(gate)
+        if getattr(fn, '__closure__', None) is None:
+            # Not wrapping any function, so bail out
+            break
+        fn = fn.__closure__[0].cell_contents
+        gate = _get_gate(fn)
+    return gates
+
+
+def check_gates(gates, checker, permission, cache=None, **kwargs):
+    """Check a chain of Gates (see get_gates) against a PermissionChecker.
+
+    This has the same semantics as has_permission, but lets the caller build
+    the PermissionChecker (and so look up the user's groups) only once when
+    checking many views.
+
+    Args:
+        gates: A sequence of Gates, which must all allow access.
+        checker: A PermissionChecker built from the user's roles.
+        permission: The permission to check for. One of 'get', 'post', 'any'
+        cache: An optional dict, mapping membership nodes to the result of
+            visiting them with `checker`. Share it between calls to avoid
+            re-evaluating nodes common to many views.
+        kwargs: passed to the PermissionChecker.visit method.
+    Returns True if every gate allows access, False otherwise. Returns False
+    if there are no gates, like has_permission.
+    """
+    if cache is None:
+        cache = {}
+
+    def _visit(node):
+        if node not in cache:
+            cache[node] = checker.visit(node, **kwargs)
+        return cache[node]
+
+    if not gates:
+        return False
+    for gate in gates:
+        nodes = get_permission_nodes(gate, permission)
+        if not any(_visit(node) for node in nodes):
+            return False
+    return True
+
+
+def get_permission_nodes(gate, permission):
+    """Return the membership nodes of a Gate which grant `permission`.
+
+    The gate grants the permission if any of the returned nodes pass.
+
+    Args:
+        gate: A Gate
+        permission: The permission to check for. One of 'get', 'post', 'any'
+    """
+    if permission == 'get':
+        return (gate.get_requires,)
+    elif permission == 'post':
+        return (gate.post_requires,)
+    elif permission == 'any':
+        return (gate.get_requires, gate.post_requires)
+    raise ValueError(
+        "%s is not a valid permission to check." % permission)
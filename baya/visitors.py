@@ -2,9 +2,11 @@
 Visitor pattern for walking through a BaseNode AST.
 """
 
+import asyncio
 from collections import namedtuple
 
 from .membership import AndNode
+from .membership import DynamicRolesNode
 from .membership import OperatorNode
 from .membership import OrNode
 from .membership import RolesNode
@@ -160,11 +162,14 @@ class PermissionChecker(NodeVisitor):
     All concrete visit methods will return a boolean.
     """
 
-    def __init__(self, roles):
+    def __init__(self, roles, resolved=None):
         """Instantiate a PermissionChecker.
 
         Args:
             roles: An iterable of strings, representing roles a user has.
+            resolved: An optional dict mapping DynamicRolesNodes to their
+                already computed roles sets, eg from
+                aresolve_dynamic_roles. Those nodes' callables aren't called.
 
         Usage:
 
@@ -178,8 +183,11 @@ class PermissionChecker(NodeVisitor):
             user_has_permissions = checker.visit(required_groups)
         """
         self._roles_set = {role.lower() for role in roles}
+        self._resolved = resolved or {}
 
     def _visit_roles_node(self, roles_node, **kwargs):
+        if roles_node in self._resolved:
+            return self._resolved[roles_node] <= self._roles_set
         return roles_node.get_roles_set(**kwargs) <= self._roles_set
 
     def _visit_unary_node(self, operator_node, visited_operand):
@@ -189,3 +197,101 @@ class PermissionChecker(NodeVisitor):
                            right_visited_operand):
         return operator_node.operator(left_visited_operand.value,
                                       right_visited_operand.value)
+
+
+class PolicyCompiler(NodeVisitor):
+    """
+    NodeVisitor concrete class that compiles a node AST into a function.
+
+    The compiled function takes a role bitmask, as built by
+    baya.role_sets.RoleDictionary.encode, and returns a boolean with the same
+    value as a PermissionChecker visiting the node would. New roles are added
+    to the RoleDictionary as they are found.
+
+    DynamicRolesNodes can't be compiled, since their roles are only known at
+    request time. Visiting a node which contains one returns None.
+
+    Compiled functions are cached per node, so compiling many nodes which
+    share subtrees only compiles each subtree once.
+
+    Usage:
+
+        roles = RoleDictionary()
+        compiler = PolicyCompiler(roles)
+        policy = compiler.visit(g('a') | g('b'))
+        user_has_permissions = policy(roles.encode(user_groups))
+    """
+
+    def __init__(self, role_dictionary):
+        self._role_dictionary = role_dictionary
+        self._cache = {}
+
+    def visit(self, node, **kwargs):
+        if node not in self._cache:
+            self._cache[node] = super(PolicyCompiler, self).visit(
+                node, **kwargs)
+        return self._cache[node]
+
+    def _visit_value_node(self, value_node, **kwargs):
+        value = value_node.value
+        return lambda mask: value
+
+    def _visit_roles_node(self, roles_node, **kwargs):
+        if isinstance(roles_node, DynamicRolesNode):
+            return None
+        required = 0
+        for role in roles_node.get_roles_set():
+            required |= 1 << self._role_dictionary.add(role)
+        return lambda mask: mask & required == required
+
+    def _visit_unary_node(self, operator_node, visited_operand):
+        operand = visited_operand.value
+        if operand is None:
+            return None
+        operator = operator_node.operator
+        return lambda mask: operator(operand(mask))
+
+    def _visit_binary_node(self, operator_node, left_visited_operand,
+                           right_visited_operand):
+        left = left_visited_operand.value
+        right = right_visited_operand.value
+        if left is None or right is None:
+            return None
+        # Short circuit the common operators.
+        if isinstance(operator_node, AndNode):
+            return lambda mask: left(mask) and right(mask)
+        if isinstance(operator_node, OrNode):
+            return lambda mask: left(mask) or right(mask)
+        operator = operator_node.operator
+        return lambda mask: operator(left(mask), right(mask))
+
+
+def iter_dynamic_roles_nodes(node):
+    """Yield every distinct DynamicRolesNode in a node AST."""
+    seen = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node in seen:
+            continue
+        seen.add(node)
+        if isinstance(node, DynamicRolesNode):
+            yield node
+        elif isinstance(node, OperatorNode):
+            stack.extend(node._operands)
+
+
+async def aresolve_dynamic_roles(node, **kwargs):
+    """Compute the roles of every DynamicRolesNode in node concurrently.
+
+    Returns a dict of DynamicRolesNode -> roles set, to pass to
+    PermissionChecker as `resolved`.
+
+    Args:
+        node: A BaseNode
+        kwargs: passed to DynamicRolesNode.aget_roles_set
+    """
+    nodes = list(iter_dynamic_roles_nodes(node))
+    roles_sets = await asyncio.gather(*[
+        dynamic_node.aget_roles_set(**kwargs) for dynamic_node in nodes])
+    return dict(zip(nodes, roles_sets))
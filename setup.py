@@ -63,5 +63,8 @@ setup(
         'development': [
             'mockldap>=0.2.0',
         ],
+        'audit': [
+            'numpy>=1.17',
+        ],
     },
 )